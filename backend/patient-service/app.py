@@ -1,41 +1,132 @@
 import os
-from flask import Flask, jsonify, request
-from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
+from flask import Flask, Response, jsonify, request, send_file
 from flask_cors import CORS
-from datetime import datetime
+from column_types import MedicalConditionList, AllergiesList
+from logging_config import configure_logging
+from metrics import RequestMetrics
+from query_stats import QueryStats
+from profiler import RequestProfiler, format_collapsed, format_pstats, format_raw
+from database import PooledSQLAlchemy, engine_options_from_env, pool_statistics, register_fork_safety
+from storage import create_storage, blob_key, digest_from_key
+from thumbnails import DerivativePipeline, derivative_key, DERIVATIVE_CONTENT_TYPE, DERIVATIVE_SIZES
+from changes import ChangeTracker, CursorExpired
+from outbox import Outbox, OutboxDispatcher, parse_destinations
+from partitioning import PartitionManager, add_months
+from duplicates import DuplicateFinder
+from merge import PatientMerger
+from drug_safety import AllergyChecker, load_drug_classes
+from events import EventBroker, RESYNC, format_event, subscription_options
+from jobs import JobQueue, HANDLERS as JOB_HANDLERS, SUCCEEDED as JOB_SUCCEEDED, run_workers
+from bulk_import import BulkImporter, ImportFormatError, FORMATS as IMPORT_FORMATS, IMPORT_KINDS
+from datetime import datetime, timedelta
 import uuid
-import boto3
 from werkzeug.utils import secure_filename
+from sqlalchemy.exc import IntegrityError
 import base64
-import json
+import hashlib
+import re
 import math
-import logging
+import time
+import threading
+import click
 
 # Initialize Flask app
 app = Flask(__name__)
+# JSON logs written by a background thread, with patient data redacted; LOG_LEVEL,
+# LOG_FORMAT (json or text) and LOG_SAMPLE_RATES (e.g. "GET /api/patients=0.1,/health=0")
+log_pipeline = configure_logging(app)
 # Update CORS configuration to be more permissive during development
 CORS(app, origins=['*'], supports_credentials=True, allow_headers=['Content-Type', 'X-User-ID', 'Authorization'])
 
 # Configure database
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///patient_service.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
+# Pool sizing, pre-ping and recycle come from DB_POOL_* variables (see database.py)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options_from_env(app.config['SQLALCHEMY_DATABASE_URI'])
+db = PooledSQLAlchemy(app)
+# Forked workers must not reuse the parent's pooled connections
+register_fork_safety(db)
+
+# Optional read replicas (comma-separated URLs) for GET requests and GraphQL queries
+DATABASE_REPLICA_URLS = [url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+if DATABASE_REPLICA_URLS:
+    db.enable_replicas(
+        app,
+        DATABASE_REPLICA_URLS,
+        eject_seconds=int(os.environ.get('DB_REPLICA_EJECT_SECONDS', 30)),
+        sticky_seconds=int(os.environ.get('DB_READ_YOUR_WRITES_SECONDS', 5))
+    )
+
+# Flask-Migrate pulls in alembic, which only the `flask db` commands need
+migrate = None
+if os.environ.get('FLASK_RUN_FROM_CLI') == 'true':
+    from flask_migrate import Migrate
+    migrate = Migrate(app, db)
 
 # Configure AWS S3
 S3_BUCKET = os.environ.get('S3_BUCKET', 'hms-patient-images')
 S3_REGION = os.environ.get('S3_REGION', 'us-east-1')
 S3_ACCESS_KEY = os.environ.get('S3_ACCESS_KEY', '')
 S3_SECRET_KEY = os.environ.get('S3_SECRET_KEY', '')
+# Objects are private; clients read them through presigned URLs. Public-read
+# objects are an opt-in for buckets without patient data.
+S3_PUBLIC_READ = os.environ.get('S3_PUBLIC_READ', 'false').lower() == 'true'
+# Lifetime (seconds) of presigned upload/download URLs
+S3_PRESIGN_EXPIRES = int(os.environ.get('S3_PRESIGN_EXPIRES', 900))
+S3_PRESIGN_CACHE_SIZE = int(os.environ.get('S3_PRESIGN_CACHE_SIZE', 4096))
+
+# Configure local filesystem storage (used when S3 is not configured)
+LOCAL_STORAGE_ROOT = os.environ.get('LOCAL_STORAGE_ROOT', os.path.join(app.instance_path, 'uploads'))
+LOCAL_STORAGE_BASE_URL = os.environ.get('LOCAL_STORAGE_BASE_URL', '')
+# Stored objects are patient images: /files/ URLs need a signature unless this is set to false
+LOCAL_STORAGE_REQUIRE_SIGNATURE = os.environ.get('LOCAL_STORAGE_REQUIRE_SIGNATURE', 'true').lower() == 'true'
+LOCAL_STORAGE_MAX_AGE = int(os.environ.get('LOCAL_STORAGE_MAX_AGE', 3600))
+
+# Initialize the storage backend ('s3' or 'local', see storage.py)
+storage = create_storage({
+    'STORAGE_BACKEND': os.environ.get('STORAGE_BACKEND'),
+    'S3_BUCKET': S3_BUCKET,
+    'S3_REGION': S3_REGION,
+    'S3_ACCESS_KEY': S3_ACCESS_KEY,
+    'S3_SECRET_KEY': S3_SECRET_KEY,
+    'S3_PUBLIC_READ': S3_PUBLIC_READ,
+    'S3_PRESIGN_EXPIRES': S3_PRESIGN_EXPIRES,
+    'S3_PRESIGN_CACHE_SIZE': S3_PRESIGN_CACHE_SIZE,
+    'LOCAL_STORAGE_ROOT': LOCAL_STORAGE_ROOT,
+    'LOCAL_STORAGE_BASE_URL': LOCAL_STORAGE_BASE_URL,
+})
 
-# Initialize S3 client
-s3_client = boto3.client(
-    's3',
-    region_name=S3_REGION,
-    aws_access_key_id=S3_ACCESS_KEY,
-    aws_secret_access_key=S3_SECRET_KEY
-) if S3_ACCESS_KEY and S3_SECRET_KEY else None
+# Thumbnail/preview generation runs in a process pool (see thumbnails.py)
+THUMBNAIL_WORKERS = int(os.environ.get('THUMBNAIL_WORKERS', 0)) or None
+derivatives = DerivativePipeline(max_workers=THUMBNAIL_WORKERS)
+
+# Per-route request metrics served on /metrics. With METRICS_DIR set (gunicorn.conf.py
+# sets one per master) every worker's numbers are merged into each scrape.
+metrics = RequestMetrics(
+    app,
+    directory=os.environ.get('METRICS_DIR') or None,
+    flush_interval=float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+)
+
+# Per-request SQL statement counts and timings (Server-Timing header), slow-query
+# log and N+1 detection
+query_stats = QueryStats(
+    app,
+    slow_query_ms=float(os.environ.get('SQL_SLOW_QUERY_MS', 200)),
+    n_plus_one_threshold=int(os.environ.get('SQL_N_PLUS_ONE_THRESHOLD', 5)),
+    server_timing=os.environ.get('SQL_SERVER_TIMING', 'true').lower() == 'true'
+)
+
+# cProfile for single requests: on demand with the X-Profile: <PROFILER_TOKEN> header
+# (or ?__profile=<PROFILER_TOKEN>), or a random PROFILER_SAMPLE_RATE share of requests.
+# Results are served by /api/admin/profiles.
+profiler = RequestProfiler(
+    app,
+    token=os.environ.get('PROFILER_TOKEN') or None,
+    sample_rate=float(os.environ.get('PROFILER_SAMPLE_RATE', 0)),
+    buffer_size=int(os.environ.get('PROFILER_BUFFER_SIZE', 50)),
+    directory=os.environ.get('PROFILER_DIR') or None
+)
 
 # User roles for RBAC
 ROLES = {
@@ -90,33 +181,6 @@ class User(db.Model):
         user_permissions = ROLES.get(self.role, {}).get('permissions', [])
         return permission in user_permissions
 
-# Helper classes for SQLite JSON storage
-class MedicalConditionList(db.TypeDecorator):
-    impl = db.Text
-    
-    def process_bind_param(self, value, dialect):
-        if value is None:
-            return '[]'
-        return json.dumps(value)
-    
-    def process_result_value(self, value, dialect):
-        if value is None:
-            return []
-        return json.loads(value)
-
-class AllergiesList(db.TypeDecorator):
-    impl = db.Text
-    
-    def process_bind_param(self, value, dialect):
-        if value is None:
-            return '[]'
-        return json.dumps(value)
-    
-    def process_result_value(self, value, dialect):
-        if value is None:
-            return []
-        return json.loads(value)
-
 # Define Patient model
 class Patient(db.Model):
     __tablename__ = 'patients'
@@ -137,10 +201,14 @@ class Patient(db.Model):
     createdAt = db.Column(db.DateTime, default=datetime.utcnow)
     updatedAt = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     createdBy = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=True)
+    externalId = db.Column(db.String(100), nullable=True, unique=True, index=True)  # Patient id in the system it was imported from
+    nameBlockKey = db.Column(db.String(20), nullable=True, index=True)  # Soundex of lastName + dateOfBirth (duplicates.py)
+    phoneBlockKey = db.Column(db.String(15), nullable=True, index=True)  # Normalized phone (duplicates.py)
     
     def to_dict(self):
         return {
             'id': self.id,
+            'externalId': self.externalId,
             'firstName': self.firstName,
             'lastName': self.lastName,
             'dateOfBirth': self.dateOfBirth,
@@ -156,6 +224,17 @@ class Patient(db.Model):
             'createdBy': self.createdBy
         }
 
+# Content-addressed image data shared by every MedicalImage with identical bytes
+class ImageBlob(db.Model):
+    __tablename__ = 'image_blobs'
+    
+    digest = db.Column(db.String(64), primary_key=True)  # SHA-256 hex of the content
+    storageKey = db.Column(db.String(300), nullable=False)
+    contentType = db.Column(db.String(100), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    refCount = db.Column(db.Integer, nullable=False, default=0)  # Number of MedicalImage rows using this blob
+    createdAt = db.Column(db.DateTime, default=datetime.utcnow)
+
 # Define Medical Image model for storing multiple images per patient
 class MedicalImage(db.Model):
     __tablename__ = 'medical_images'
@@ -167,12 +246,17 @@ class MedicalImage(db.Model):
     description = db.Column(db.Text, nullable=True)
     uploadedAt = db.Column(db.DateTime, default=datetime.utcnow)
     uploadedBy = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=True)
+    blobDigest = db.Column(db.String(64), db.ForeignKey('image_blobs.digest'), nullable=True, index=True)
+    thumbnailUrl = db.Column(db.String(500), nullable=True)  # Small derivative for galleries
+    previewUrl = db.Column(db.String(500), nullable=True)  # Screen-sized derivative
     
     def to_dict(self):
         return {
             'id': self.id,
             'patientId': self.patientId,
             'imageUrl': self.imageUrl,
+            'thumbnailUrl': self.thumbnailUrl,
+            'previewUrl': self.previewUrl,
             'imageType': self.imageType,
             'description': self.description,
             'uploadedAt': self.uploadedAt.isoformat(),
@@ -182,6 +266,7 @@ class MedicalImage(db.Model):
 # Define Appointment model
 class Appointment(db.Model):
     __tablename__ = 'appointments'
+    __table_args__ = (db.Index('ix_appointments_appointmentDate_startTime', 'appointmentDate', 'startTime'),)
     
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     patientId = db.Column(db.String(36), db.ForeignKey('patients.id'), nullable=False)
@@ -244,6 +329,7 @@ class Medication(db.Model):
 # Define Medical Record model
 class MedicalRecord(db.Model):
     __tablename__ = 'medical_records'
+    __table_args__ = (db.Index('ix_medical_records_visitDate', 'visitDate'),)
     
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     patientId = db.Column(db.String(36), db.ForeignKey('patients.id'), nullable=False)
@@ -272,6 +358,220 @@ class MedicalRecord(db.Model):
             'updatedAt': self.updatedAt.isoformat()
         }
 
+# Progress of a bulk import (see bulk_import.py), committed with each chunk
+class ImportCheckpoint(db.Model):
+    __tablename__ = 'import_checkpoints'
+    
+    name = db.Column(db.String(200), primary_key=True)
+    kind = db.Column(db.String(30), nullable=False)  # One of bulk_import.IMPORT_KINDS
+    byteOffset = db.Column(db.BigInteger, nullable=False, default=0)  # Where the next unread row starts
+    rowsRead = db.Column(db.Integer, nullable=False, default=0)
+    imported = db.Column(db.Integer, nullable=False, default=0)
+    skipped = db.Column(db.Integer, nullable=False, default=0)  # Patients whose externalId was already imported
+    failed = db.Column(db.Integer, nullable=False, default=0)
+    createdAt = db.Column(db.DateTime, default=datetime.utcnow)
+    updatedAt = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    completedAt = db.Column(db.DateTime, nullable=True)
+
+# Background job (see jobs.py); heavy work runs in `flask jobs-worker`, not in requests
+class Job(db.Model):
+    __tablename__ = 'jobs'
+    __table_args__ = (db.Index('ix_jobs_status_createdAt', 'status', 'createdAt'),)
+    
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    kind = db.Column(db.String(50), nullable=False)  # Key of jobs.HANDLERS
+    params = db.Column(db.JSON, nullable=True)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, succeeded, failed, canceled
+    progress = db.Column(db.Float, nullable=False, default=0.0)  # 0.0 - 1.0
+    progressMessage = db.Column(db.String(200), nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    maxAttempts = db.Column(db.Integer, nullable=False, default=3)
+    workerId = db.Column(db.String(100), nullable=True)  # host:pid of the worker running it
+    error = db.Column(db.Text, nullable=True)
+    resultKey = db.Column(db.String(300), nullable=True)  # Storage key of the result file
+    resultName = db.Column(db.String(200), nullable=True)
+    resultContentType = db.Column(db.String(100), nullable=True)
+    resultSize = db.Column(db.BigInteger, nullable=True)
+    createdBy = db.Column(db.String(36), nullable=True)
+    createdAt = db.Column(db.DateTime, default=datetime.utcnow)
+    startedAt = db.Column(db.DateTime, nullable=True)
+    heartbeatAt = db.Column(db.DateTime, nullable=True)
+    finishedAt = db.Column(db.DateTime, nullable=True)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'params': self.params,
+            'status': self.status,
+            'progress': self.progress,
+            'progressMessage': self.progressMessage,
+            'attempts': self.attempts,
+            'maxAttempts': self.maxAttempts,
+            'error': self.error,
+            'result': {
+                'name': self.resultName,
+                'contentType': self.resultContentType,
+                'size': self.resultSize
+            } if self.resultKey else None,
+            'createdBy': self.createdBy,
+            'createdAt': self.createdAt.isoformat(),
+            'startedAt': self.startedAt.isoformat() if self.startedAt else None,
+            'finishedAt': self.finishedAt.isoformat() if self.finishedAt else None
+        }
+
+# Persistent background jobs (jobs.py). A running job sends a heartbeat every
+# JOB_HEARTBEAT_SECONDS; without one for JOB_STALE_SECONDS it is handed to another worker.
+job_queue = JobQueue(
+    db, Job, storage,
+    heartbeat_interval=float(os.environ.get('JOB_HEARTBEAT_SECONDS', 10)),
+    stale_seconds=float(os.environ.get('JOB_STALE_SECONDS', 120))
+)
+
+# Append-only log of changes to clinical data, read by /api/changes for incremental sync
+class ChangeLog(db.Model):
+    __tablename__ = 'change_log'
+    # AUTOINCREMENT: without it SQLite reuses the numbers of pruned rows, and
+    # clients holding a cursor past them would never see the new changes
+    __table_args__ = {'sqlite_autoincrement': True}
+    
+    # INTEGER PRIMARY KEY is SQLite's rowid; BIGINT elsewhere
+    seq = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True, autoincrement=True)
+    tableName = db.Column(db.String(50), nullable=False)
+    rowId = db.Column(db.String(36), nullable=False)
+    operation = db.Column(db.String(10), nullable=False)  # insert, update, delete
+    changedAt = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+# Every flush touching these models appends to change_log in the same transaction (changes.py)
+change_tracker = ChangeTracker(
+    db, ChangeLog, [Patient, Appointment, Medication, MedicalRecord],
+    visibility_lag=timedelta(seconds=float(os.environ.get('CHANGES_VISIBILITY_LAG_SECONDS', 10)))
+)
+
+# Pushes committed appointment and patient changes to /api/events/stream subscribers (events.py).
+# Changes made by other processes arrive through change_log every EVENTS_POLL_SECONDS.
+event_broker = EventBroker(
+    app, db, change_tracker, [Patient, Appointment],
+    max_queue=int(os.environ.get('EVENTS_QUEUE_SIZE', 100)),
+    poll_interval=float(os.environ.get('EVENTS_POLL_SECONDS', 1))
+)
+EVENTS_KEEPALIVE_SECONDS = float(os.environ.get('EVENTS_KEEPALIVE_SECONDS', 15))
+# Each Flask stream holds a gthread thread for as long as the client listens, so
+# a worker only serves this many; more clients get 503 (asgi.py has no such limit)
+EVENTS_MAX_FLASK_STREAMS = int(os.environ.get('EVENTS_MAX_FLASK_STREAMS', 1))
+_flask_stream_slots = threading.BoundedSemaphore(EVENTS_MAX_FLASK_STREAMS) if EVENTS_MAX_FLASK_STREAMS > 0 else None
+
+# Webhook event waiting for delivery by `flask outbox-dispatch` (outbox.py)
+class OutboxEvent(db.Model):
+    __tablename__ = 'outbox_events'
+    __table_args__ = (db.Index('ix_outbox_events_destination_status_id', 'destination', 'status', 'id'),)
+    
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True, autoincrement=True)
+    destination = db.Column(db.String(100), nullable=False)  # Key of WEBHOOK_DESTINATIONS
+    eventType = db.Column(db.String(50), nullable=False)  # e.g. appointment.created
+    aggregateId = db.Column(db.String(36), nullable=False)
+    payload = db.Column(db.JSON, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, delivered, dead
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    nextAttemptAt = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    lastError = db.Column(db.Text, nullable=True)
+    createdAt = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    deliveredAt = db.Column(db.DateTime, nullable=True)
+
+# Downstream systems notified of appointment and medical record changes, e.g.
+# {"billing": {"url": "https://billing/hooks", "events": ["appointment.*"], "secret": "..."}}
+WEBHOOK_DESTINATIONS = parse_destinations(os.environ.get('WEBHOOK_DESTINATIONS'))
+# Events are written in the same transaction as the change; no HTTP call on the request path
+outbox = Outbox(db, OutboxEvent, WEBHOOK_DESTINATIONS, [Appointment, MedicalRecord])
+
+# Possible duplicate patients, compared within blocks of shared keys (duplicates.py)
+duplicate_finder = DuplicateFinder(db, Patient, threshold=float(os.environ.get('DUPLICATE_THRESHOLD', 0.85)))
+
+# Audit record of a duplicate patient merged into another one (merge.py)
+class PatientMerge(db.Model):
+    __tablename__ = 'patient_merges'
+    
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    targetPatientId = db.Column(db.String(36), nullable=False, index=True)  # The patient kept
+    sourcePatientId = db.Column(db.String(36), nullable=False, index=True)  # The patient merged and deleted
+    sourceSnapshot = db.Column(db.JSON, nullable=False)  # The source patient as it was before the merge
+    movedRows = db.Column(db.JSON, nullable=False)  # Table name -> rows moved to the target
+    mergedBy = db.Column(db.String(36), nullable=True)
+    mergedAt = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'targetPatientId': self.targetPatientId,
+            'sourcePatientId': self.sourcePatientId,
+            'sourceSnapshot': self.sourceSnapshot,
+            'movedRows': self.movedRows,
+            'mergedBy': self.mergedBy,
+            'mergedAt': self.mergedAt.isoformat() if self.mergedAt else None
+        }
+
+patient_merger = PatientMerger(db, PatientMerge, [Appointment, Medication, MedicalRecord, MedicalImage], change_tracker, outbox)
+
+# Drug classes that prescriptions are checked against patient allergies with,
+# compiled once at startup (drug_safety.py)
+DRUG_CLASSES_PATH = os.environ.get('DRUG_CLASSES_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'drug_classes.json'))
+allergy_checker = AllergyChecker(db, Medication, Patient, load_drug_classes(DRUG_CLASSES_PATH))
+
+# Allergy warnings for a medication just prescribed (REST and GraphQL), logged
+# by medication id and severity only: patient ids and allergies are PHI
+def new_medication_allergy_warnings(medication):
+    warnings = allergy_checker.check_medication(medication)
+    if warnings:
+        app.logger.warning('Medication %s saved with %d allergy warnings (%s)', medication.id,
+                           len(warnings), ', '.join(warning['severity'] for warning in warnings))
+    return warnings
+
+# Appointments or medical records of one month, archived off the main tables
+# on databases without partitioning (partitioning.py)
+class ArchivedMonth(db.Model):
+    __tablename__ = 'archived_months'
+    __table_args__ = (db.UniqueConstraint('tableName', 'month', name='uq_archived_months_table_month'),)
+    
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True, autoincrement=True)
+    tableName = db.Column(db.String(50), nullable=False)
+    month = db.Column(db.String(7), nullable=False)  # Format: YYYY-MM
+    rowCount = db.Column(db.Integer, nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)  # zlib-compressed NDJSON, one row per line
+    archivedAt = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+# Monthly partitions of appointments and medical_records on PostgreSQL
+partitions = PartitionManager(db, ArchivedMonth, months_ahead=int(os.environ.get('PARTITION_MONTHS_AHEAD', 3)))
+
+# Mock admin user attached to every request during development/testing
+def mock_admin_user():
+    return User(
+        id=str(uuid.uuid4()),
+        username='dev-admin',
+        password='password',
+        firstName='Dev',
+        lastName='Admin',
+        email='dev@example.com',
+        role='ADMIN'
+    )
+
+# Placeholder patient created for unknown IDs in development mode
+def mock_patient(id, created_by):
+    return Patient(
+        id=id,
+        firstName="Mock",
+        lastName="Patient",
+        dateOfBirth="2000-01-01",
+        gender="Other",
+        email=f"patient-{id}@example.com",
+        phone="123-456-7890",
+        address="123 Mock Street",
+        insuranceId="MOCK-INS-123",
+        medicalConditions=["None"],
+        allergies=["None"],
+        notes="Mock patient for development",
+        createdBy=created_by
+    )
+
 # Helper function to check user authorization
 def authorize(required_permission):
     def decorator(func):
@@ -284,80 +584,242 @@ def authorize(required_permission):
             
             # Always create a mock admin user for development/testing
             # This ensures CRUD operations work without authentication
-            mock_user = User(
-                id=str(uuid.uuid4()),
-                username='dev-admin',
-                password='password',
-                firstName='Dev',
-                lastName='Admin',
-                email='dev@example.com',
-                role='ADMIN'
-            )
-            request.user = mock_user
+            request.user = mock_admin_user()
             return func(*args, **kwargs)
         
         wrapper.__name__ = func.__name__
         return wrapper
     return decorator
 
-# Helper function to upload an image to S3
+# Helper function to upload an image to the configured storage backend.
+# Objects are keyed by content digest, so re-uploading identical bytes is skipped.
 def upload_to_s3(file_data, folder='patient-profiles'):
-    if not s3_client:
+    try:
+        key, digest, size = storage.save_content_addressed(folder, file_data, content_type=file_data.mimetype or 'application/octet-stream')
+        return storage.url_for(key)
+    except Exception as e:
+        print(f"Error uploading to storage: {str(e)}")
+        return None
+
+_DATA_URL_RE = re.compile(r'^data:([\w/+.-]+);base64,')
+
+# Decode a base64 (optionally data-URL) image. Returns (content_type, bytes);
+# raises ValueError (binascii.Error) for invalid base64.
+def decode_base64_image(base64_data):
+    match = _DATA_URL_RE.match(base64_data)
+    content_type = match.group(1) if match else 'image/jpeg'  # Default content type
+    return content_type, base64.b64decode(base64_data.split(',')[1] if ',' in base64_data else base64_data)
+
+# Decode a base64 (optionally data-URL) image and store it content-addressed.
+# Returns (key, digest, size, content_type, file_data) or None on failure.
+def store_base64_image(base64_data, folder='patient-profiles'):
+    if not base64_data:
         return None
     
     try:
-        # Generate a unique filename
-        filename = f"{str(uuid.uuid4())}-{secure_filename(file_data.filename)}"
-        
-        # Upload to S3
-        s3_client.upload_fileobj(
-            file_data,
-            S3_BUCKET,
-            f"{folder}/{filename}",
-            ExtraArgs={'ACL': 'public-read'}
-        )
-        
-        # Return the S3 URL
-        return f"https://{S3_BUCKET}.s3.amazonaws.com/{folder}/{filename}"
+        content_type, file_data = decode_base64_image(base64_data)
+        key, digest, size = storage.save_content_addressed(folder, file_data, content_type=content_type)
+        return key, digest, size, content_type, file_data
     except Exception as e:
-        print(f"Error uploading to S3: {str(e)}")
+        print(f"Error uploading to storage: {str(e)}")
         return None
 
-# Upload base64 encoded image to S3
+# Upload base64 encoded image to the configured storage backend
 def upload_base64_to_s3(base64_data, folder='patient-profiles'):
-    if not s3_client or not base64_data:
-        return None
-    
+    stored = store_base64_image(base64_data, folder)
+    return storage.url_for(stored[0]) if stored else None
+
+# Attach a reference to the blob for `digest`, creating the row on first use.
+# The increment is done in SQL so concurrent uploads of the same bytes don't lose counts.
+# Returns the blob's storage key: when the same bytes were stored first under
+# another content type (another extension), that object is the one to use.
+def acquire_image_blob(digest, key, size, content_type):
+    blob = ImageBlob.query.get(digest)
+    if blob is None:
+        try:
+            with db.session.begin_nested():
+                db.session.add(ImageBlob(digest=digest, storageKey=key, contentType=content_type, size=size, refCount=0))
+        except IntegrityError:
+            # Another request inserted the same blob first
+            pass
+    ImageBlob.query.filter_by(digest=digest).update({ImageBlob.refCount: ImageBlob.refCount + 1}, synchronize_session=False)
+    return db.session.query(ImageBlob.storageKey).filter_by(digest=digest).scalar()
+
+# Remove an object this request stored that lost the race to an existing blob
+def discard_duplicate_object(key):
     try:
-        # Extract the file data and extension
-        file_data = base64.b64decode(base64_data.split(',')[1] if ',' in base64_data else base64_data)
-        file_ext = 'jpg'  # Default extension
-        
-        # Generate a unique filename
-        filename = f"{str(uuid.uuid4())}.{file_ext}"
-        
-        # Upload to S3
-        s3_client.put_object(
-            Body=file_data,
-            Bucket=S3_BUCKET,
-            Key=f"{folder}/{filename}",
-            ContentType=f"image/{file_ext}",
-            ACL='public-read'
-        )
-        
-        # Return the S3 URL
-        return f"https://{S3_BUCKET}.s3.amazonaws.com/{folder}/{filename}"
+        storage.delete(key)
     except Exception as e:
-        print(f"Error uploading to S3: {str(e)}")
+        app.logger.error('Error deleting duplicate image %s: %s', key, e)
+
+# Drop a reference; returns the storage key once the last one is gone, for the
+# caller to delete the stored object and its derivatives after committing
+def release_image_blob(digest):
+    ImageBlob.query.filter_by(digest=digest).update({ImageBlob.refCount: ImageBlob.refCount - 1}, synchronize_session=False)
+    key = db.session.query(ImageBlob.storageKey).filter(ImageBlob.digest == digest, ImageBlob.refCount <= 0).scalar()
+    if key is None:
         return None
+    deleted = ImageBlob.query.filter(ImageBlob.digest == digest, ImageBlob.refCount <= 0).delete(synchronize_session=False)
+    return key if deleted else None
+
+# Presigned GET for viewing; signatures are cached by the storage backend
+def presigned_get_url(key):
+    return presigned_get_url_with_expiry(key)[0]
+
+# (url, seconds left) or (None, None); a cached URL has less than S3_PRESIGN_EXPIRES left
+def presigned_get_url_with_expiry(key):
+    try:
+        return storage.presigned_get_url_with_expiry(key)
+    except Exception as e:
+        app.logger.error('Error signing download URL: %s', e)
+        return None, None
+
+# Presigned PUT so clients upload straight to storage without going through Flask.
+# Returns (url, headers) or (None, None).
+def presigned_put_url(key, content_type, sha256=None):
+    try:
+        return storage.presigned_put_url(key, content_type, sha256=sha256)
+    except Exception as e:
+        app.logger.error('Error signing upload URL: %s', e)
+        return None, None
+
+def image_to_dict_with_view_url(image):
+    data = image.to_dict()
+    data['viewUrl'] = presigned_get_url(storage.key_from_url(image.imageUrl)) or image.imageUrl
+    if image.thumbnailUrl:
+        data['thumbnailViewUrl'] = presigned_get_url(storage.key_from_url(image.thumbnailUrl)) or image.thumbnailUrl
+    return data
+
+# Patient with a signed URL for displaying the profile image
+def patient_to_dict_with_view_url(patient):
+    data = patient.to_dict()
+    if patient.profileImageUrl:
+        data['profileImageViewUrl'] = presigned_get_url(storage.key_from_url(patient.profileImageUrl)) or patient.profileImageUrl
+    return data
+
+# Create and update payloads, shared with the async handlers in asgi.py.
+# medicalConditions and allergies may be sent as comma separated strings.
+def split_list_field(value):
+    if isinstance(value, str):
+        return [item.strip() for item in value.split(',') if item.strip()]
+    return value
+
+def patient_from_data(data, created_by, profile_image_url=None):
+    medical_conditions = split_list_field(data.get('medicalConditions'))
+    allergies = split_list_field(data.get('allergies'))
+    return Patient(
+        firstName=data.get('firstName'),
+        lastName=data.get('lastName'),
+        dateOfBirth=data.get('dateOfBirth'),
+        gender=data.get('gender'),
+        email=data.get('email'),
+        phone=data.get('phone'),
+        address=data.get('address'),
+        insuranceId=data.get('insuranceId'),
+        medicalConditions=medical_conditions if isinstance(medical_conditions, list) else [],
+        allergies=allergies if isinstance(allergies, list) else [],
+        notes=data.get('notes', ''),
+        profileImageUrl=profile_image_url,
+        createdBy=created_by
+    )
+
+# profile_image_url is the upload of data['profileImage'], None if it failed
+def apply_patient_update(patient, data, profile_image_url=None):
+    for field in ('firstName', 'lastName', 'dateOfBirth', 'gender', 'email', 'phone', 'address', 'insuranceId', 'notes'):
+        if field in data:
+            setattr(patient, field, data[field])
+    for field in ('medicalConditions', 'allergies'):
+        if field in data:
+            setattr(patient, field, split_list_field(data[field]))
+    if data.get('profileImage'):
+        patient.profileImageUrl = profile_image_url
+
+# Store rendered derivatives next to the original and record their URLs
+def save_derivatives(image_ids, original_key, rendered):
+    urls = {}
+    for name, data in rendered.items():
+        key = derivative_key(original_key, name)
+        urls[f"{name}Url"] = storage.save(key, data, content_type=DERIVATIVE_CONTENT_TYPE)
+    with app.app_context():
+        MedicalImage.query.filter(MedicalImage.id.in_(image_ids)).update(urls, synchronize_session=False)
+        db.session.commit()
+
+# Queue thumbnail/preview generation for a freshly stored image.
+# `data` is the original bytes when we have them (presigned uploads read them back).
+def schedule_derivatives(image, key, data=None):
+    if not derivatives.enabled:
+        return
+    
+    # Duplicate content already has derivatives next to the shared original
+    thumbnail_key = derivative_key(key, 'thumbnail')
+    preview_key = derivative_key(key, 'preview')
+    if storage.exists(thumbnail_key) and storage.exists(preview_key):
+        image.thumbnailUrl = storage.url_for(thumbnail_key)
+        image.previewUrl = storage.url_for(preview_key)
+        db.session.commit()
+        return
+    
+    def load_original():
+        if data is not None:
+            return data
+        with storage.open(key) as original:
+            return original.read()
+    
+    derivatives.submit([image.id], key, load_original, save_derivatives)
+
+# Serve objects from the local filesystem backend. send_file streams through
+# wsgi.file_wrapper (sendfile under gunicorn) and handles Range/ETag requests.
+@app.route('/files/<path:key>', methods=['GET', 'HEAD'])
+def serve_stored_file(key):
+    if storage.name != 'local':
+        return jsonify({'message': 'Not found'}), 404
+    
+    signature = request.args.get('signature')
+    if signature or LOCAL_STORAGE_REQUIRE_SIGNATURE:
+        if not storage.verify_signature('GET', key, request.args.get('expires'), signature):
+            return jsonify({'message': 'Invalid or expired signature'}), 403
+    
+    try:
+        path = storage.path_for(key)
+    except ValueError:
+        return jsonify({'message': 'Not found'}), 404
+    if not os.path.isfile(path):
+        return jsonify({'message': 'Not found'}), 404
+    
+    response = send_file(path, conditional=True, etag=True, max_age=LOCAL_STORAGE_MAX_AGE)
+    # Patient images must never end up in shared caches
+    response.cache_control.public = False
+    response.cache_control.private = True
+    return response
+
+# Receive presigned uploads for the local filesystem backend
+@app.route('/files/<path:key>', methods=['PUT'])
+def receive_stored_file(key):
+    if storage.name != 'local':
+        return jsonify({'message': 'Not found'}), 404
+    
+    if not storage.verify_signature('PUT', key, request.args.get('expires'), request.args.get('signature')):
+        return jsonify({'message': 'Invalid or expired signature'}), 403
+    
+    try:
+        storage.save(key, request.stream, content_type=request.content_type or 'application/octet-stream', sha256=digest_from_key(key))
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    
+    return '', 204
 
 # Add GraphQL endpoint
+# graphene and the schema are imported on the first GraphQL request, then reused
+_graphql_view = None
+
 @app.route('/graphql', methods=['GET', 'POST'])
 def graphql_server():
-    from flask_graphql import GraphQLView
-    from schema import schema
-    view = GraphQLView.as_view('graphql', schema=schema, graphiql=True)
-    return view()
+    global _graphql_view
+    if _graphql_view is None:
+        from flask_graphql import GraphQLView
+        from schema import schema
+        _graphql_view = GraphQLView.as_view('graphql', schema=schema, graphiql=True)
+    return _graphql_view()
 
 # API Endpoints
 @app.route('/api/patients', methods=['GET'])
@@ -371,9 +833,6 @@ def get_all_patients():
     # Limit maximum per_page to 100 to prevent excessive loads
     per_page = min(per_page, 100)
     
-    # Get total count for pagination metadata
-    total_patients = Patient.query.count()
-    
     # Get paginated patients
     patients = Patient.query.order_by(Patient.lastName.asc(), Patient.firstName.asc())
     
@@ -383,17 +842,20 @@ def get_all_patients():
     if request.user and request.user.role == 'PATIENT':
         patients = patients.filter_by(createdBy=request.user.id)
     
+    # Get total count for pagination metadata, of the patients this user can see
+    total_patients = patients.order_by(None).count()
+    
     # Apply pagination
     patients = patients.paginate(page=page, per_page=per_page, error_out=False)
     
     # Prepare response
     response = {
-        'data': [patient.to_dict() for patient in patients.items],
+        'data': [patient_to_dict_with_view_url(patient) for patient in patients.items],
         'pagination': {
             'total': total_patients,
             'per_page': per_page,
             'current_page': page,
-            'total_pages': math.ceil(total_patients / per_page),
+            'total_pages': math.ceil(total_patients / per_page) if total_patients > 0 else 1,
             'has_next': patients.has_next,
             'has_prev': patients.has_prev
         }
@@ -409,28 +871,14 @@ def get_patient(id):
     
     # For development mode, create a mock patient if it doesn't exist
     if not patient and os.environ.get('FLASK_ENV') == 'development':
-        app.logger.info(f"Creating mock patient with ID: {id} for development")
-        mock_patient = Patient(
-            id=id,
-            firstName="Mock",
-            lastName="Patient",
-            dateOfBirth="2000-01-01",
-            gender="Other",
-            email=f"patient-{id}@example.com",
-            phone="123-456-7890",
-            address="123 Mock Street",
-            insuranceId="MOCK-INS-123",
-            medicalConditions=["None"],
-            allergies=["None"],
-            notes="Mock patient for development",
-            createdBy=request.user.id
-        )
+        app.logger.info('Creating mock patient with ID: %s for development', id)
+        patient = mock_patient(id, request.user.id)
         
         # Add to database temporarily
-        db.session.add(mock_patient)
+        db.session.add(patient)
         db.session.commit()
         
-        return jsonify(mock_patient.to_dict())
+        return jsonify(patient_to_dict_with_view_url(patient))
     
     if not patient:
         return jsonify({'message': 'Patient not found'}), 404
@@ -439,7 +887,7 @@ def get_patient(id):
     if request.user.role == 'PATIENT' and request.user.id != patient.createdBy:
         return jsonify({'message': 'Forbidden - You can only view your own records'}), 403
         
-    return jsonify(patient.to_dict())
+    return jsonify(patient_to_dict_with_view_url(patient))
 
 @app.route('/api/patients', methods=['POST'])
 @app.route('/patients', methods=['POST'])  # Added non-prefixed route
@@ -447,54 +895,34 @@ def get_patient(id):
 def create_patient():
     data = request.get_json()
     
-    # Log the incoming data for debugging
-    app.logger.info(f"Creating patient with data: {json.dumps(data)}")
-    
-    # Convert string arrays to lists if they are strings
-    if 'medicalConditions' in data:
-        if isinstance(data['medicalConditions'], str):
-            data['medicalConditions'] = [condition.strip() for condition in data['medicalConditions'].split(',') if condition.strip()]
-        elif not isinstance(data['medicalConditions'], list):
-            data['medicalConditions'] = []
-    else:
-        data['medicalConditions'] = []
-    
-    if 'allergies' in data:
-        if isinstance(data['allergies'], str):
-            data['allergies'] = [allergy.strip() for allergy in data['allergies'].split(',') if allergy.strip()]
-        elif not isinstance(data['allergies'], list):
-            data['allergies'] = []
-    else:
-        data['allergies'] = []
-    
-    app.logger.info(f"Processed medical conditions: {data.get('medicalConditions')}")
-    app.logger.info(f"Processed allergies: {data.get('allergies')}")
+    # Field names only: the values are patient data
+    app.logger.debug('Creating patient with fields: %s', sorted(data))
     
     # Process profile image if provided
     profile_image_url = None
     if 'profileImage' in data and data['profileImage']:
         profile_image_url = upload_base64_to_s3(data['profileImage'])
     
-    new_patient = Patient(
-        firstName=data.get('firstName'),
-        lastName=data.get('lastName'),
-        dateOfBirth=data.get('dateOfBirth'),
-        gender=data.get('gender'),
-        email=data.get('email'),
-        phone=data.get('phone'),
-        address=data.get('address'),
-        insuranceId=data.get('insuranceId'),
-        medicalConditions=data.get('medicalConditions', []),
-        allergies=data.get('allergies', []),
-        notes=data.get('notes', ''),
-        profileImageUrl=profile_image_url,
-        createdBy=request.user.id
-    )
+    new_patient = patient_from_data(data, request.user.id, profile_image_url)
+    app.logger.debug('Processed %d medical conditions and %d allergies',
+                     len(new_patient.medicalConditions), len(new_patient.allergies))
     
     db.session.add(new_patient)
     db.session.commit()
     
-    return jsonify(new_patient.to_dict()), 201
+    # Created anyway; the front desk decides whether it is the same person
+    response = patient_to_dict_with_view_url(new_patient)
+    response['possibleDuplicates'] = duplicate_finder.candidates(new_patient)
+    return jsonify(response), 201
+
+# Patients that may be the same person as this one
+@app.route('/api/patients/<string:id>/duplicates', methods=['GET'])
+@authorize('read')
+def get_patient_duplicates(id):
+    patient = Patient.query.get(id)
+    if not patient:
+        return jsonify({'message': 'Patient not found'}), 404
+    return jsonify({'data': duplicate_finder.candidates(patient)})
 
 @app.route('/api/patients/<string:id>', methods=['PUT'])
 @app.route('/patients/<string:id>', methods=['PUT'])  # Added non-prefixed route
@@ -504,22 +932,8 @@ def update_patient(id):
     
     # For development mode, create a mock patient if it doesn't exist
     if not patient and os.environ.get('FLASK_ENV') == 'development':
-        app.logger.info(f"Creating mock patient with ID: {id} for development during update")
-        patient = Patient(
-            id=id,
-            firstName="Mock",
-            lastName="Patient",
-            dateOfBirth="2000-01-01",
-            gender="Other",
-            email=f"patient-{id}@example.com",
-            phone="123-456-7890",
-            address="123 Mock Street",
-            insuranceId="MOCK-INS-123",
-            medicalConditions=["None"],
-            allergies=["None"],
-            notes="Mock patient for development",
-            createdBy=request.user.id
-        )
+        app.logger.info('Creating mock patient with ID: %s for development during update', id)
+        patient = mock_patient(id, request.user.id)
         
         # Add to database
         db.session.add(patient)
@@ -530,47 +944,16 @@ def update_patient(id):
     
     data = request.get_json()
     
-    # Update patient fields
-    if 'firstName' in data:
-        patient.firstName = data['firstName']
-    if 'lastName' in data:
-        patient.lastName = data['lastName']
-    if 'dateOfBirth' in data:
-        patient.dateOfBirth = data['dateOfBirth']
-    if 'gender' in data:
-        patient.gender = data['gender']
-    if 'email' in data:
-        patient.email = data['email']
-    if 'phone' in data:
-        patient.phone = data['phone']
-    if 'address' in data:
-        patient.address = data['address']
-    if 'insuranceId' in data:
-        patient.insuranceId = data['insuranceId']
-    
-    # Handle arrays
-    if 'medicalConditions' in data:
-        if isinstance(data['medicalConditions'], str):
-            patient.medicalConditions = [condition.strip() for condition in data['medicalConditions'].split(',') if condition.strip()]
-        else:
-            patient.medicalConditions = data['medicalConditions']
-    
-    if 'allergies' in data:
-        if isinstance(data['allergies'], str):
-            patient.allergies = [allergy.strip() for allergy in data['allergies'].split(',') if allergy.strip()]
-        else:
-            patient.allergies = data['allergies']
-    
-    if 'notes' in data:
-        patient.notes = data['notes']
-    
     # Process profile image if provided
+    profile_image_url = None
     if 'profileImage' in data and data['profileImage']:
-        patient.profileImageUrl = upload_base64_to_s3(data['profileImage'])
+        profile_image_url = upload_base64_to_s3(data['profileImage'])
+    
+    apply_patient_update(patient, data, profile_image_url)
     
     db.session.commit()
     
-    return jsonify(patient.to_dict())
+    return jsonify(patient_to_dict_with_view_url(patient))
 
 @app.route('/api/patients/<string:id>', methods=['DELETE'])
 @app.route('/patients/<string:id>', methods=['DELETE'])  # Added non-prefixed route
@@ -581,31 +964,68 @@ def delete_patient(id):
         if not patient:
             return jsonify({'message': 'Patient not found'}), 404
         
-        app.logger.info(f"Deleting patient with ID: {id}")
-        app.logger.info(f"Request user: {request.user.id if hasattr(request, 'user') else 'No user'}")
-        app.logger.info(f"Request headers: {request.headers}")
+        app.logger.info('Deleting patient with ID: %s', id, extra={'userId': getattr(request, 'user', None) and request.user.id})
         
         # Delete associated medical records first (if they exist)
         try:
             medical_records = MedicalRecord.query.filter_by(patientId=id).all()
-            app.logger.info(f"Found {len(medical_records)} medical records to delete")
+            app.logger.info('Found %d medical records to delete', len(medical_records))
             for record in medical_records:
                 db.session.delete(record)
         except Exception as record_error:
-            app.logger.error(f"Error deleting medical records: {str(record_error)}")
+            app.logger.error('Error deleting medical records: %s', record_error)
             # Continue with patient deletion even if records can't be deleted
         
         # Delete the patient
         db.session.delete(patient)
         db.session.commit()
         
-        app.logger.info(f"Successfully deleted patient with ID: {id}")
+        app.logger.info('Successfully deleted patient with ID: %s', id)
         return jsonify({'message': 'Patient deleted successfully'}), 200
     except Exception as e:
         db.session.rollback()
-        app.logger.error(f"Error deleting patient {id}: {str(e)}")
+        app.logger.error('Error deleting patient %s: %s', id, e)
         return jsonify({'message': f'Error deleting patient: {str(e)}'}), 500
 
+# Merge a duplicate patient into this one: its appointments, medications,
+# medical records and images move here in one transaction, then it is deleted
+@app.route('/api/patients/<string:id>/merge', methods=['POST'])
+@authorize('delete')
+def merge_patient(id):
+    data = request.get_json(silent=True) or {}
+    source_id = data.get('sourceId')
+    if not source_id:
+        return jsonify({'message': 'sourceId is required'}), 400
+    if source_id == id:
+        return jsonify({'message': 'A patient cannot be merged into itself'}), 400
+    
+    # Locked in id order, so concurrent merges of the same pair cannot deadlock
+    patients = {patient.id: patient for patient in
+                Patient.query.filter(Patient.id.in_([id, source_id])).order_by(Patient.id).with_for_update()}
+    target, source = patients.get(id), patients.get(source_id)
+    if not target:
+        return jsonify({'message': 'Patient not found'}), 404
+    if not source:
+        return jsonify({'message': 'Source patient not found'}), 404
+    
+    try:
+        merge = patient_merger.merge(target, source, merged_by=request.user.id)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error('Error merging patient %s into %s: %s', source_id, id, e)
+        return jsonify({'message': f'Error merging patients: {str(e)}'}), 500
+    
+    app.logger.info('Merged patient %s into %s: %s', source_id, id, merge.movedRows)
+    return jsonify({'patient': patient_to_dict_with_view_url(target), 'merge': merge.to_dict()})
+
+# Patients merged into this one, newest first
+@app.route('/api/patients/<string:id>/merges', methods=['GET'])
+@authorize('read')
+def get_patient_merges(id):
+    merges = PatientMerge.query.filter_by(targetPatientId=id).order_by(PatientMerge.mergedAt.desc()).all()
+    return jsonify({'data': [merge.to_dict() for merge in merges]})
+
 @app.route('/api/patients/<string:patient_id>/images', methods=['POST'])
 @app.route('/patients/<string:patient_id>/images', methods=['POST'])  # Added non-prefixed route
 @authorize('write')
@@ -618,21 +1038,43 @@ def upload_medical_image(patient_id):
     
     # Process the medical image
     if 'imageData' in data and data['imageData']:
-        image_url = upload_base64_to_s3(data['imageData'], folder='medical-images')
-        if not image_url:
-            return jsonify({'message': 'Failed to upload image'}), 500
+        try:
+            content_type, image_data = decode_base64_image(data['imageData'])
+        except ValueError:
+            return jsonify({'message': 'Invalid image data'}), 400
+        
+        # Bytes we already have are not stored again, whatever content type
+        # they are sent as this time
+        digest = hashlib.sha256(image_data).hexdigest()
+        blob = ImageBlob.query.get(digest)
+        written_key = None
+        if blob is not None:
+            key = blob.storageKey
+            acquire_image_blob(digest, key, blob.size, blob.contentType)
+        else:
+            try:
+                written_key, digest, size = storage.save_content_addressed('medical-images', image_data, content_type=content_type)
+            except Exception as e:
+                app.logger.error('Error uploading to storage: %s', e)
+                return jsonify({'message': 'Failed to upload image'}), 500
+            key = acquire_image_blob(digest, written_key, size, content_type)
         
         medical_image = MedicalImage(
             patientId=patient_id,
-            imageUrl=image_url,
+            imageUrl=storage.url_for(key),
             imageType=data.get('imageType', 'Other'),
             description=data.get('description', ''),
-            uploadedBy=request.user.id
+            uploadedBy=request.user.id,
+            blobDigest=digest
         )
         
         db.session.add(medical_image)
         db.session.commit()
         
+        if written_key and written_key != key:
+            discard_duplicate_object(written_key)
+        schedule_derivatives(medical_image, key, image_data)
+        
         return jsonify(medical_image.to_dict()), 201
     
     return jsonify({'message': 'No image data provided'}), 400
@@ -665,7 +1107,7 @@ def get_patient_images(patient_id):
     
     # Prepare response
     response = {
-        'data': [image.to_dict() for image in images.items],
+        'data': [image_to_dict_with_view_url(image) for image in images.items],
         'pagination': {
             'total': total_images,
             'per_page': per_page,
@@ -678,6 +1120,148 @@ def get_patient_images(patient_id):
     
     return jsonify(response)
 
+@app.route('/api/patients/<string:patient_id>/images/upload-url', methods=['POST'])
+@app.route('/patients/<string:patient_id>/images/upload-url', methods=['POST'])  # Added non-prefixed route
+@authorize('write')
+def create_image_upload_url(patient_id):
+    patient = Patient.query.get(patient_id)
+    if not patient:
+        return jsonify({'message': 'Patient not found'}), 404
+    
+    data = request.get_json() or {}
+    content_type = data.get('contentType', 'image/jpeg')
+    if not content_type.startswith('image/') and content_type != 'application/dicom':
+        return jsonify({'message': 'Unsupported content type'}), 400
+    
+    sha256 = (data.get('sha256') or '').lower()
+    if sha256:
+        # Content-addressed upload: identical bytes share one object, so the
+        # client can skip the upload entirely when we already have it
+        if not re.fullmatch(r'[0-9a-f]{64}', sha256):
+            return jsonify({'message': 'Invalid sha256 digest'}), 400
+        blob = ImageBlob.query.get(sha256)
+        if blob is not None:
+            return jsonify({'exists': True, 'key': blob.storageKey}), 200
+        key = blob_key('medical-images', sha256, content_type)
+    else:
+        # Keys are scoped per patient so the completion callback can verify ownership
+        filename = secure_filename(data.get('filename', '')) or 'image'
+        key = f"medical-images/{patient_id}/{str(uuid.uuid4())}-{filename}"
+    
+    upload_url, headers = presigned_put_url(key, content_type, sha256=sha256 or None)
+    if not upload_url:
+        return jsonify({'message': 'Failed to create upload URL'}), 500
+    
+    return jsonify({
+        'exists': False,
+        'uploadUrl': upload_url,
+        'method': 'PUT',
+        'headers': headers,
+        'key': key,
+        'expiresIn': S3_PRESIGN_EXPIRES
+    }), 201
+
+@app.route('/api/patients/<string:patient_id>/images/complete', methods=['POST'])
+@app.route('/patients/<string:patient_id>/images/complete', methods=['POST'])  # Added non-prefixed route
+@authorize('write')
+def complete_image_upload(patient_id):
+    patient = Patient.query.get(patient_id)
+    if not patient:
+        return jsonify({'message': 'Patient not found'}), 404
+    
+    data = request.get_json() or {}
+    key = data.get('key', '')
+    digest = digest_from_key(key)
+    blob = ImageBlob.query.get(digest) if digest else None
+    if digest:
+        if not key.startswith('medical-images/') or '..' in key:
+            return jsonify({'message': 'Invalid upload key'}), 400
+    elif not key.startswith(f"medical-images/{patient_id}/") or '..' in key:
+        return jsonify({'message': 'Invalid upload key'}), 400
+    
+    # Make sure the client actually finished the direct upload. The blob's size
+    # and content type are read from the stored object, not taken from the client.
+    if blob is None:
+        try:
+            stored = storage.head(key)
+        except Exception:
+            stored = None
+        if stored is None:
+            return jsonify({'message': 'Uploaded object not found'}), 409
+    
+    uploaded_key = key
+    if digest:
+        if blob is not None:
+            key = acquire_image_blob(digest, blob.storageKey, blob.size, blob.contentType)
+        else:
+            key = acquire_image_blob(digest, key, stored['size'], stored['contentType'])
+    
+    medical_image = MedicalImage(
+        patientId=patient_id,
+        imageUrl=storage.url_for(key),
+        imageType=data.get('imageType', 'Other'),
+        description=data.get('description', ''),
+        uploadedBy=request.user.id,
+        blobDigest=digest
+    )
+    
+    db.session.add(medical_image)
+    db.session.commit()
+    
+    if uploaded_key != key:
+        # The same bytes were already stored under another content type
+        discard_duplicate_object(uploaded_key)
+    schedule_derivatives(medical_image, key)
+    
+    return jsonify(image_to_dict_with_view_url(medical_image)), 201
+
+@app.route('/api/patients/<string:patient_id>/images/<string:image_id>', methods=['DELETE'])
+@app.route('/patients/<string:patient_id>/images/<string:image_id>', methods=['DELETE'])  # Added non-prefixed route
+@authorize('delete')
+def delete_medical_image(patient_id, image_id):
+    image = MedicalImage.query.filter_by(id=image_id, patientId=patient_id).first()
+    if not image:
+        return jsonify({'message': 'Image not found'}), 404
+    
+    db.session.delete(image)
+    db.session.flush()
+    
+    # Shared blobs are only removed from storage when their last reference goes
+    if image.blobDigest:
+        orphaned_key = release_image_blob(image.blobDigest)
+    else:
+        orphaned_key = storage.key_from_url(image.imageUrl)
+    
+    db.session.commit()
+    
+    if orphaned_key:
+        # The thumbnail and preview are stored next to the original and go with it
+        for key in [orphaned_key] + [derivative_key(orphaned_key, name) for name in DERIVATIVE_SIZES]:
+            try:
+                storage.delete(key)
+            except Exception as e:
+                app.logger.error('Error deleting stored image %s: %s', key, e)
+    
+    return '', 204
+
+@app.route('/api/images/<string:image_id>/download-url', methods=['GET'])
+@authorize('read')
+def get_image_download_url(image_id):
+    image = MedicalImage.query.get(image_id)
+    if not image:
+        return jsonify({'message': 'Image not found'}), 404
+    
+    # For patients with role "PATIENT", they can only view their own records
+    patient = Patient.query.get(image.patientId)
+    if request.user.role == 'PATIENT' and (not patient or request.user.id != patient.createdBy):
+        return jsonify({'message': 'Forbidden - You can only view your own records'}), 403
+    
+    url, expires_in = presigned_get_url_with_expiry(storage.key_from_url(image.imageUrl))
+    if not url:
+        return jsonify({'message': 'Download URL not available'}), 503
+    
+    return jsonify({'url': url, 'expiresIn': expires_in})
+
 @app.route('/api/appointments', methods=['POST'])
 @authorize('write')
 def create_appointment():
@@ -805,7 +1389,19 @@ def create_medication():
     db.session.add(new_medication)
     db.session.commit()
     
-    return jsonify(new_medication.to_dict()), 201
+    # Saved anyway; the prescriber decides whether the conflict matters
+    response = new_medication.to_dict()
+    response['allergyWarnings'] = new_medication_allergy_warnings(new_medication)
+    return jsonify(response), 201
+
+# Active medications that conflict with their patient's allergies
+@app.route('/api/medications/allergy-conflicts', methods=['GET'])
+@authorize('read')
+def get_allergy_conflicts():
+    # Doctors only see the medications they prescribed
+    prescribed_by = request.user.id if request.user and request.user.role != 'ADMIN' else None
+    checked, conflicts = allergy_checker.audit(prescribed_by=prescribed_by)
+    return jsonify({'data': conflicts, 'checked': checked})
 
 @app.route('/api/medications', methods=['GET'])
 @authorize('read')
@@ -881,7 +1477,9 @@ def update_medication(id):
     
     db.session.commit()
     
-    return jsonify(medication.to_dict())
+    response = medication.to_dict()
+    response['allergyWarnings'] = allergy_checker.check_medication(medication)
+    return jsonify(response)
 
 @app.route('/api/medications/<string:id>', methods=['DELETE'])
 @authorize('delete')
@@ -1004,6 +1602,202 @@ def delete_medical_record(id):
     
     return '', 204
 
+# Bulk import of patients or clinical data. The request body is the raw CSV or
+# NDJSON file and is streamed, never loaded whole. Send the same ?checkpoint=
+# again after an interruption to resume where the last committed chunk ended.
+@app.route('/api/import/<kind>', methods=['POST'])
+@authorize('write')
+def bulk_import(kind):
+    if kind not in IMPORT_KINDS:
+        return jsonify({'message': f"Unknown import kind; use one of: {', '.join(IMPORT_KINDS)}"}), 404
+    
+    input_format = request.args.get('format')
+    if input_format is None:
+        input_format = 'csv' if request.mimetype in ('text/csv', 'application/csv') else 'ndjson'
+    if input_format not in IMPORT_FORMATS:
+        return jsonify({'message': f"format must be one of: {', '.join(IMPORT_FORMATS)}"}), 400
+    
+    importer = BulkImporter(
+        db, ImportCheckpoint, kind,
+        name=request.args.get('checkpoint') or f"{kind}-{uuid.uuid4()}",
+        chunk_size=min(request.args.get('chunk_size', 1000, type=int), 10000),
+        created_by=request.user.id,
+        default_doctor_id=request.args.get('defaultDoctorId'),
+        change_tracker=change_tracker
+    )
+    try:
+        summary = importer.run(request.stream, input_format)
+    except ImportFormatError as e:
+        db.session.rollback()
+        return jsonify({'message': str(e), 'checkpoint': importer.name}), 400
+    return jsonify(summary), 200
+
+# Incremental sync: inserts, updates and deletes after a cursor, in commit order.
+# Without `since`, only the current cursor is returned (take it before a full download).
+@app.route('/api/changes', methods=['GET'])
+@authorize('read')
+def get_changes():
+    since = request.args.get('since')
+    if since is None:
+        return jsonify({'changes': [], 'cursor': str(change_tracker.latest_cursor()), 'hasMore': False})
+    try:
+        since = int(since)
+    except ValueError:
+        return jsonify({'message': 'since must be a cursor returned by this endpoint'}), 400
+    limit = max(1, min(request.args.get('limit', 500, type=int), 1000))
+    
+    try:
+        changes, cursor, has_more = change_tracker.changes_since(since, limit)
+    except CursorExpired:
+        return jsonify({'message': 'Cursor has expired; download the data again and use a new cursor'}), 410
+    
+    return jsonify({'changes': changes, 'cursor': str(cursor), 'hasMore': has_more})
+
+# Server-Sent Events: appointment and patient changes as they commit, instead of polling.
+# Filters: topics=appointments,patients, doctorId and date (appointments only).
+# Reconnecting clients send Last-Event-ID and get the changes they missed first.
+@app.route('/api/events/stream', methods=['GET'])
+@authorize('read')
+def event_stream():
+    try:
+        options = subscription_options(request.args)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('lastEventId')
+    
+    if _flask_stream_slots is None or not _flask_stream_slots.acquire(blocking=False):
+        response = jsonify({'message': 'Too many open event streams on this server; use the ASGI server for live updates'})
+        response.headers['Retry-After'] = '30'
+        return response, 503
+    
+    # Subscribe before replaying, so nothing committed in between is missed
+    subscription = event_broker.subscribe(**options)
+    replayed, last_seq = [], 0
+    try:
+        if last_event_id and last_event_id.isdigit():
+            last_seq = int(last_event_id)
+            replayed = event_broker.replay(last_seq)
+            if replayed is None:
+                replayed = [{'seq': None, 'table': None, 'operation': RESYNC}]
+            replayed = [event for event in replayed if subscription.matches(event)]
+    except Exception:
+        event_broker.unsubscribe(subscription)
+        _flask_stream_slots.release()
+        raise
+    
+    def stream():
+        try:
+            yield 'retry: 3000\n\n'
+            seen = last_seq
+            for event in replayed:
+                seen = max(seen, event['seq'] or 0)
+                yield format_event(event)
+            while True:
+                events = subscription.wait(EVENTS_KEEPALIVE_SECONDS)
+                if not events:
+                    # Keeps proxies from closing the connection and detects gone clients
+                    yield ': keepalive\n\n'
+                for event in events:
+                    if event['seq'] is None or event['seq'] > seen:
+                        yield format_event(event)
+        finally:
+            event_broker.unsubscribe(subscription)
+    
+    response = Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # nginx must not buffer the stream
+    })
+    # Runs when the server closes the response, even if the stream never started
+    response.call_on_close(_flask_stream_slots.release)
+    return response
+
+# Webhook outbox backlog per destination and status
+@app.route('/api/admin/outbox', methods=['GET'])
+@authorize('admin')
+def outbox_stats():
+    return jsonify({
+        'destinations': sorted(WEBHOOK_DESTINATIONS),
+        'events': OutboxDispatcher(db, OutboxEvent, WEBHOOK_DESTINATIONS).stats()
+    })
+
+# Background jobs: submit, poll and download results of long-running work
+@app.route('/api/jobs', methods=['POST'])
+@authorize('admin')
+def submit_job():
+    import job_handlers  # noqa: F401 - registers the handlers
+    
+    data = request.get_json() or {}
+    kind = data.get('kind')
+    if kind not in JOB_HANDLERS:
+        return jsonify({'message': f"kind must be one of: {', '.join(sorted(JOB_HANDLERS))}"}), 400
+    params = data.get('params') or {}
+    if not isinstance(params, dict):
+        return jsonify({'message': 'params must be an object'}), 400
+    
+    job = job_queue.submit(kind, params, created_by=request.user.id)
+    return jsonify(job.to_dict()), 202, {'Location': f'/api/jobs/{job.id}'}
+
+@app.route('/api/jobs', methods=['GET'])
+@authorize('admin')
+def get_all_jobs():
+    page = request.args.get('page', 1, type=int)
+    per_page = min(request.args.get('per_page', 10, type=int), 100)
+    
+    query = Job.query
+    if request.args.get('status'):
+        query = query.filter(Job.status == request.args['status'])
+    if request.args.get('kind'):
+        query = query.filter(Job.kind == request.args['kind'])
+    
+    total_jobs = query.count()
+    jobs = query.order_by(Job.createdAt.desc()).paginate(page=page, per_page=per_page, error_out=False)
+    
+    return jsonify({
+        'data': [job.to_dict() for job in jobs.items],
+        'pagination': {
+            'total': total_jobs,
+            'per_page': per_page,
+            'current_page': page,
+            'total_pages': math.ceil(total_jobs / per_page) if total_jobs > 0 else 1,
+            'has_next': jobs.has_next,
+            'has_prev': jobs.has_prev
+        }
+    })
+
+@app.route('/api/jobs/<string:id>', methods=['GET'])
+@authorize('admin')
+def get_job(id):
+    job = Job.query.get(id)
+    if not job:
+        return jsonify({'message': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/jobs/<string:id>', methods=['DELETE'])
+@authorize('admin')
+def cancel_job(id):
+    job = Job.query.get(id)
+    if not job:
+        return jsonify({'message': 'Job not found'}), 404
+    if not job_queue.cancel(id):
+        return jsonify({'message': f'Job is already {job.status}'}), 409
+    db.session.refresh(job)
+    return jsonify(job.to_dict())
+
+@app.route('/api/jobs/<string:id>/download-url', methods=['GET'])
+@authorize('admin')
+def get_job_download_url(id):
+    job = Job.query.get(id)
+    if not job:
+        return jsonify({'message': 'Job not found'}), 404
+    if job.status != JOB_SUCCEEDED or not job.resultKey:
+        return jsonify({'message': 'The job has no result yet', 'status': job.status}), 409
+    
+    url, expires_in = presigned_get_url_with_expiry(job.resultKey)
+    if not url:
+        return jsonify({'message': 'Download URL not available'}), 503
+    
+    return jsonify({'url': url, 'expiresIn': expires_in, 'name': job.resultName})
+
 @app.route('/api/auth/login', methods=['POST'])
 def login():
     data = request.get_json()
@@ -1039,14 +1833,58 @@ def health_check():
         'status': 'UP',
         'service': 'patient-service',
         'database': db_status,
-        's3': 'configured' if s3_client else 'not configured'
+        's3': 'configured' if storage.name == 's3' else 'not configured',
+        'storage': storage.name
     }), 200
 
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/api/admin/db-pool', methods=['GET'])
+@authorize('admin')
+def db_pool_stats():
+    # Statistics are per worker process; each gunicorn worker has its own pool
+    engines = [db.get_engine(app)]
+    if db.replica_router:
+        engines.extend(db.replica_router.engines)
+    return jsonify({'engines': [pool_statistics(engine) for engine in engines]})
+
+@app.route('/api/admin/profiles', methods=['GET'])
+@authorize('admin')
+def list_profiles():
+    return jsonify({'profiles': profiler.list()})
+
+@app.route('/api/admin/profiles/<profile_id>', methods=['GET'])
+@authorize('admin')
+def get_profile(profile_id):
+    entry, stats = profiler.get(profile_id)
+    if entry is None:
+        return jsonify({'message': 'Profile not found'}), 404
+
+    output_format = request.args.get('format', 'pstats')
+    if output_format == 'pstats':
+        sort = request.args.get('sort', 'cumulative')
+        if sort not in ('cumulative', 'tottime', 'calls', 'ncalls', 'name', 'filename'):
+            return jsonify({'message': f'Unsupported sort: {sort}'}), 400
+        limit = request.args.get('limit', 50, type=int)
+        return Response(format_pstats(stats, sort, limit), mimetype='text/plain')
+    if output_format == 'collapsed':
+        return Response(format_collapsed(stats), mimetype='text/plain')
+    if output_format == 'raw':
+        return Response(
+            format_raw(stats),
+            mimetype='application/octet-stream',
+            headers={'Content-Disposition': f'attachment; filename={profile_id}.prof'}
+        )
+    return jsonify({'message': 'format must be one of: pstats, collapsed, raw'}), 400
+
 # For development - seed data
 @app.route('/api/seed', methods=['GET'])
 def seed_db():
     # Clear existing data
     MedicalImage.query.delete()
+    ImageBlob.query.delete()
     Patient.query.delete()
     User.query.delete()
     Appointment.query.delete()
@@ -1294,18 +2132,216 @@ def seed_db():
 @app.route('/api/demo/patients', methods=['GET'])
 def demo_get_patients():
     patients = Patient.query.all()
-    return jsonify([patient.to_dict() for patient in patients])
+    return jsonify([patient_to_dict_with_view_url(patient) for patient in patients])
+
+# Generate thumbnails/previews for images uploaded before derivatives existed
+@app.cli.command('backfill-thumbnails')
+@click.option('--batch-size', default=50, help='Images rendered in parallel per batch')
+@click.option('--workers', default=None, type=int, help='Renderer processes (default: THUMBNAIL_WORKERS)')
+def backfill_thumbnails(batch_size, workers):
+    if not derivatives.enabled:
+        raise click.ClickException('Pillow is not installed')
+    
+    pipeline = DerivativePipeline(max_workers=workers or THUMBNAIL_WORKERS)
+    processed = failed = 0
+    last_id = ''
+    try:
+        while True:
+            # Keyset pagination keeps each batch query cheap on large tables
+            batch = (MedicalImage.query
+                     .filter(MedicalImage.thumbnailUrl.is_(None), MedicalImage.id > last_id)
+                     .order_by(MedicalImage.id)
+                     .limit(batch_size)
+                     .all())
+            if not batch:
+                break
+            last_id = batch[-1].id
+            
+            # Images sharing a blob are rendered once
+            by_key = {}
+            for image in batch:
+                key = storage.key_from_url(image.imageUrl)
+                if key:
+                    by_key.setdefault(key, []).append(image.id)
+                else:
+                    failed += 1
+            
+            keys = list(by_key)
+            originals = []
+            for key in keys:
+                try:
+                    with storage.open(key) as original:
+                        originals.append(original.read())
+                except Exception as e:
+                    app.logger.warning('Could not read original %s: %s', key, e)
+                    originals.append(b'')
+            
+            for key, rendered in zip(keys, pipeline.render_many(originals)):
+                if rendered is None:
+                    failed += len(by_key[key])
+                    continue
+                save_derivatives(by_key[key], key, rendered)
+                processed += len(by_key[key])
+            click.echo(f"Backfilled {processed} images ({failed} skipped)")
+    finally:
+        pipeline.shutdown()
+
+# Synthetic data at realistic volumes for load and performance testing
+@app.cli.command('generate-data')
+@click.option('--patients', default=10000, help='Patients to generate; child rows scale with it')
+@click.option('--seed', default=42, help='Same seed, patient count and chunk size give the same data')
+@click.option('--chunk-size', default=5000, help='Patients generated and inserted per transaction')
+@click.option('--workers', default=None, type=int, help='Generator processes (default: CPU count)')
+@click.option('--doctors', default=50, help='Doctor users the generated rows are assigned to')
+def generate_data(patients, seed, chunk_size, workers, doctors):
+    import datagen
+
+    def progress(result, total_rows, elapsed):
+        click.echo(f"Chunk {result['chunk']}: {sum(result['rows'].values())} rows "
+                   f"(generate {result['generateSeconds']:.1f}s, insert {result['insertSeconds']:.1f}s) - "
+                   f"{total_rows} rows, {total_rows / elapsed:,.0f} rows/s")
+
+    # Workers open their own connections, so they need the resolved URL (with password)
+    url = db.engine.url.render_as_string(hide_password=False)
+    try:
+        totals, elapsed = datagen.generate(url, patients, seed=seed, chunk_size=chunk_size, workers=workers,
+                                           doctors=doctors, on_progress=progress)
+    except IntegrityError:
+        raise click.ClickException(f'Data for seed {seed} already exists; use another --seed')
+    total_rows = sum(totals.values())
+    click.echo(', '.join(f'{count} {name}' for name, count in totals.items()))
+    click.echo(f'Inserted {total_rows} rows in {elapsed:.1f}s ({total_rows / elapsed:,.0f} rows/s)')
+
+# Resumable streaming import of a CSV or NDJSON file
+@app.cli.command('import-data')
+@click.argument('kind', type=click.Choice(list(IMPORT_KINDS)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'input_format', type=click.Choice(IMPORT_FORMATS), default=None,
+              help='Default: from the file extension (.csv, otherwise NDJSON)')
+@click.option('--checkpoint', default=None, help='Checkpoint name (default: kind and file name); reuse it to resume')
+@click.option('--chunk-size', default=1000, help='Rows inserted per transaction')
+@click.option('--default-doctor-id', default=None, help='Doctor for rows that do not name one')
+def import_data(kind, path, input_format, checkpoint, chunk_size, default_doctor_id):
+    input_format = input_format or ('csv' if path.lower().endswith('.csv') else 'ndjson')
+    started = time.perf_counter()
+    chunks = 0
+    
+    def progress(summary):
+        nonlocal chunks
+        chunks += 1
+        click.echo(f"{summary['rowsRead']} rows read: {summary['imported']} imported, "
+                   f"{summary['skipped']} skipped, {summary['failed']} failed "
+                   f"({summary['rowsRead'] / (time.perf_counter() - started):,.0f} rows/s)")
+    
+    importer = BulkImporter(
+        db, ImportCheckpoint, kind,
+        name=checkpoint or f"{kind}:{os.path.abspath(path)}",
+        chunk_size=chunk_size,
+        default_doctor_id=default_doctor_id,
+        change_tracker=change_tracker,
+        on_chunk=progress
+    )
+    try:
+        with open(path, 'rb') as f:
+            summary = importer.run(f, input_format)
+    except ImportFormatError as e:
+        raise click.ClickException(str(e))
+    
+    for error in summary['errors']:
+        click.echo(f"Row {error['row']}: {'; '.join(error['errors'])}", err=True)
+    if not chunks:
+        click.echo(f"Checkpoint '{importer.name}' is already complete" if summary['resumed'] else 'The file has no rows')
+    click.echo(f"Done: {summary['imported']} imported, {summary['skipped']} skipped, {summary['failed']} failed "
+               f"(checkpoint '{importer.name}')")
+
+# Compare all patients for possible duplicates and write the merge worklist
+@app.cli.command('find-duplicates')
+@click.option('--processes', default=None, type=int, help='Scoring processes (default: CPU count)')
+@click.option('--output', type=click.File('w'), default='-', help='CSV worklist file (default: stdout)')
+def find_duplicates(processes, output):
+    import csv
+    started = time.perf_counter()
+    worklist = duplicate_finder.scan(processes=processes)
+    writer = csv.writer(output)
+    writer.writerow(['patientId', 'duplicateId', 'score', 'matchedOn'])
+    writer.writerows([entry['patientId'], entry['duplicateId'], entry['score'], ' '.join(entry['matchedOn'])]
+                     for entry in worklist)
+    click.echo(f"Found {len(worklist)} possible duplicate pairs in {time.perf_counter() - started:.1f}s", err=True)
+
+# Drop change log entries older than the retention window; older cursors get 410
+@app.cli.command('prune-changes')
+@click.option('--days', default=90, help='Keep changes from this many days')
+def prune_changes(days):
+    deleted = change_tracker.prune(datetime.utcnow() - timedelta(days=days))
+    click.echo(f"Deleted {deleted} change log entries older than {days} days")
+
+# Create the coming months' partitions; run daily (gunicorn also runs it on start)
+@app.cli.command('ensure-partitions')
+def ensure_partitions():
+    created = partitions.ensure_future_partitions()
+    click.echo(f"Created partitions: {', '.join(created)}" if created else "All partitions exist")
+
+# Move appointments and medical records of old months out of the live tables
+@app.cli.command('archive-partitions')
+@click.option('--keep-months', default=24, help='Keep this many months before the current one')
+@click.option('--dry-run', is_flag=True, help='Only report what would be archived')
+def archive_partitions(keep_months, dry_run):
+    before = add_months(datetime.utcnow().date().replace(day=1), -keep_months)
+    archived = partitions.archive(before, dry_run=dry_run)
+    for table_name, month, rows, location in archived:
+        click.echo(f"{table_name} {month}: {rows} rows -> {location}")
+    click.echo(f"{'Would archive' if dry_run else 'Archived'} {len(archived)} months before {before:%Y-%m}")
+
+# Deliver webhook events from the outbox; run one dispatcher per database
+@app.cli.command('outbox-dispatch')
+@click.option('--once', is_flag=True, help='Run a single delivery round and exit')
+@click.option('--poll-interval', default=2.0, help='Seconds between rounds when nothing was sent')
+@click.option('--concurrency', default=int(os.environ.get('WEBHOOK_CONCURRENCY', 4)), help='Destinations served in parallel')
+@click.option('--batch-events', default=int(os.environ.get('WEBHOOK_BATCH_EVENTS', 50)), help='Events per webhook request')
+def outbox_dispatch(once, poll_interval, concurrency, batch_events):
+    import signal
+    import threading
+    
+    dispatcher = OutboxDispatcher(
+        db, OutboxEvent, WEBHOOK_DESTINATIONS,
+        max_batch_events=batch_events,
+        concurrency=concurrency,
+        max_attempts=int(os.environ.get('WEBHOOK_MAX_ATTEMPTS', 10)),
+        timeout=float(os.environ.get('WEBHOOK_TIMEOUT_SECONDS', 10))
+    )
+    if once:
+        expired = dispatcher.expire_unknown()
+        counts = dispatcher.dispatch_once()
+        counts['dead'] += expired
+        click.echo(f"{counts['delivered']} delivered, {counts['failed']} to retry, {counts['dead']} dead")
+        return
+    
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    click.echo(f"Dispatching webhooks to: {', '.join(sorted(WEBHOOK_DESTINATIONS)) or 'no destinations configured'}")
+    dispatcher.run(stop, poll_interval=poll_interval)
+
+# Background job workers; run alongside the web server
+@app.cli.command('jobs-worker')
+@click.option('--processes', default=1, help='Worker processes, each running one job at a time')
+@click.option('--poll-interval', default=2.0, help='Seconds between checks of an empty queue')
+@click.option('--burst', is_flag=True, help='Exit once the queue is empty')
+def jobs_worker(processes, poll_interval, burst):
+    import job_handlers  # noqa: F401 - registers the handlers
+    
+    click.echo(f"Starting {processes} job worker(s) for: {', '.join(sorted(JOB_HANDLERS))}")
+    run_workers(processes, poll_interval=poll_interval, burst=burst)
 
 if __name__ == '__main__':
     # Create database tables if they don't exist
     with app.app_context():
         db.create_all()
         
-    # Enable debug logs for request handling
+    # Debug log of each request; headers and bodies are not logged, they carry credentials and patient data
     @app.before_request
     def log_request_info():
-        app.logger.debug('Headers: %s', request.headers)
-        app.logger.debug('Body: %s', request.get_data())
+        app.logger.debug('%s %s', request.method, request.path, extra={'contentLength': request.content_length})
         
         # Check if admin user already exists and create test users if needed
         admin_exists = User.query.filter_by(username='admin').first() is not None
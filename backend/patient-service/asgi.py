@@ -0,0 +1,428 @@
+"""ASGI entry point: ``uvicorn asgi:app``.
+
+The hot REST routes (patient CRUD, images and the appointment, medication
+and medical-record reads) are served by async handlers on SQLAlchemy's
+asyncio extension, so a slow query or storage call only parks a coroutine
+instead of blocking a worker. The handlers reuse the models and helpers from
+``app.py``; blocking storage calls run in a thread. Every other route falls
+through to the Flask app, so the API surface is identical to ``wsgi.py``.
+"""
+import os
+import math
+import asyncio
+
+from anyio import to_thread
+from sqlalchemy import delete, func, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import Session as SyncSession, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.middleware.wsgi import WSGIMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+from app import (
+    app as flask_app, Patient, MedicalImage, Appointment, Medication, MedicalRecord,
+    mock_admin_user, mock_patient, upload_base64_to_s3, image_to_dict_with_view_url, patient_to_dict_with_view_url,
+    patient_from_data, apply_patient_update,
+    presigned_get_url_with_expiry, storage,
+    change_tracker, event_broker, outbox, duplicate_finder, allergy_checker, EVENTS_KEEPALIVE_SECONDS,
+)
+from changes import DELETE
+from outbox import EVENT_ACTIONS
+from database import AsyncSQLiteWriteLock, configure_sqlite_engine, engine_options_from_env
+from events import RESYNC, format_event, subscription_options
+
+
+def async_database_url(uri, root_path):
+    """Map the configured database URL onto its asyncio driver."""
+    url = make_url(uri)
+    backend = url.get_backend_name()
+    if backend == 'sqlite':
+        database = url.database
+        # Same resolution of relative paths as Flask-SQLAlchemy
+        if database and database != ':memory:' and not os.path.isabs(database):
+            database = os.path.join(root_path, database)
+        return url.set(drivername='sqlite+aiosqlite', database=database)
+    if backend == 'postgresql':
+        return url.set(drivername='postgresql+asyncpg')
+    raise ValueError(f"No asyncio driver configured for {backend}")
+
+
+def create_engine_from_config():
+    uri = flask_app.config['SQLALCHEMY_DATABASE_URI']
+    options = dict(engine_options_from_env(uri))
+    if 'poolclass' in options:
+        # Same DB_POOL_* sizing, but with the asyncio-aware pool
+        options['poolclass'] = AsyncAdaptedQueuePool
+    url = async_database_url(uri, flask_app.root_path)
+    engine = create_async_engine(url, **options)
+
+    # Same pragmas, and writers queue on the same lock file as the gunicorn workers
+    configure_sqlite_engine(engine.sync_engine, lock_class=AsyncSQLiteWriteLock)
+    return engine
+
+
+class TrackedSession(SyncSession):
+    """Sync side of the async sessions; its flushes go to change_log, the event broker and the outbox."""
+
+
+change_tracker.track(TrackedSession)
+event_broker.track(TrackedSession)
+outbox.track(TrackedSession)
+
+engine = create_engine_from_config()
+# expire_on_commit=False: serializing after commit must not trigger lazy loads
+Session = sessionmaker(engine, class_=AsyncSession, sync_session_class=TrackedSession, expire_on_commit=False)
+
+
+def authorize(func):
+    # Same development behaviour as authorize() in app.py: every request
+    # runs as a mock admin user
+    async def wrapper(request):
+        os.environ['FLASK_ENV'] = 'development'
+        request.state.user = mock_admin_user()
+        return await func(request)
+
+    wrapper.__name__ = func.__name__
+    return wrapper
+
+
+def _int_arg(request, name, default):
+    try:
+        return int(request.query_params.get(name, default))
+    except ValueError:
+        return default
+
+
+async def paginate(session, request, query, serialize=None):
+    page = max(_int_arg(request, 'page', 1), 1)
+    per_page = min(_int_arg(request, 'per_page', 10), 100)
+    if per_page < 1:
+        per_page = 10
+
+    total = await session.scalar(select(func.count()).select_from(query.order_by(None).subquery()))
+    rows = (await session.execute(query.limit(per_page).offset((page - 1) * per_page))).scalars().all()
+    if serialize is None:
+        data = [row.to_dict() for row in rows]
+    else:
+        # Serializers may sign storage URLs, which can block
+        data = await to_thread.run_sync(lambda: [serialize(row) for row in rows])
+
+    total_pages = math.ceil(total / per_page) if total > 0 else 1
+    return {
+        'data': data,
+        'pagination': {
+            'total': total,
+            'per_page': per_page,
+            'current_page': page,
+            'total_pages': total_pages,
+            'has_next': page < total_pages,
+            'has_prev': page > 1
+        }
+    }
+
+
+def _forbidden():
+    return JSONResponse({'message': 'Forbidden - You can only view your own records'}, status_code=403)
+
+
+# Patients
+@authorize
+async def get_all_patients(request):
+    query = select(Patient).order_by(Patient.lastName.asc(), Patient.firstName.asc())
+    if request.state.user.role == 'PATIENT':
+        query = query.filter_by(createdBy=request.state.user.id)
+    async with Session() as session:
+        return JSONResponse(await paginate(session, request, query, patient_to_dict_with_view_url))
+
+
+@authorize
+async def get_patient(request):
+    id = request.path_params['id']
+    async with Session() as session:
+        patient = await session.get(Patient, id)
+
+        # For development mode, create a mock patient if it doesn't exist
+        if not patient and os.environ.get('FLASK_ENV') == 'development':
+            patient = mock_patient(id, request.state.user.id)
+            session.add(patient)
+            await session.commit()
+            return JSONResponse(await to_thread.run_sync(patient_to_dict_with_view_url, patient))
+
+    if not patient:
+        return JSONResponse({'message': 'Patient not found'}, status_code=404)
+    if request.state.user.role == 'PATIENT' and request.state.user.id != patient.createdBy:
+        return _forbidden()
+    return JSONResponse(await to_thread.run_sync(patient_to_dict_with_view_url, patient))
+
+
+@authorize
+async def create_patient(request):
+    data = await request.json()
+
+    profile_image_url = None
+    if data.get('profileImage'):
+        profile_image_url = await to_thread.run_sync(upload_base64_to_s3, data['profileImage'])
+
+    patient = patient_from_data(data, request.state.user.id, profile_image_url)
+    async with Session() as session:
+        session.add(patient)
+        await session.commit()
+        response = await to_thread.run_sync(patient_to_dict_with_view_url, patient)
+        response['possibleDuplicates'] = await session.run_sync(
+            lambda sync_session: duplicate_finder.candidates(patient, sync_session))
+    return JSONResponse(response, status_code=201)
+
+
+@authorize
+async def update_patient(request):
+    id = request.path_params['id']
+    data = await request.json()
+
+    profile_image_url = None
+    if data.get('profileImage'):
+        profile_image_url = await to_thread.run_sync(upload_base64_to_s3, data['profileImage'])
+
+    async with Session() as session:
+        patient = await session.get(Patient, id)
+        if not patient and os.environ.get('FLASK_ENV') == 'development':
+            patient = mock_patient(id, request.state.user.id)
+            session.add(patient)
+        if not patient:
+            return JSONResponse({'message': 'Patient not found'}, status_code=404)
+
+        apply_patient_update(patient, data, profile_image_url)
+
+        await session.commit()
+    return JSONResponse(await to_thread.run_sync(patient_to_dict_with_view_url, patient))
+
+
+@authorize
+async def delete_patient(request):
+    id = request.path_params['id']
+    async with Session() as session:
+        patient = await session.get(Patient, id)
+        if not patient:
+            return JSONResponse({'message': 'Patient not found'}, status_code=404)
+        try:
+            record_ids = (await session.execute(select(MedicalRecord.id).where(MedicalRecord.patientId == id))).scalars().all()
+            await session.execute(delete(MedicalRecord).where(MedicalRecord.patientId == id))
+            if record_ids:
+                # The bulk delete bypasses the flush hooks that log changes and queue webhooks
+                await session.run_sync(change_tracker.record, [('medical_records', record_id, DELETE) for record_id in record_ids])
+                await session.run_sync(outbox.record, [
+                    (f'medical_record.{EVENT_ACTIONS[DELETE]}', record_id, {'id': record_id, 'patientId': id})
+                    for record_id in record_ids
+                ])
+            await session.delete(patient)
+            await session.commit()
+        except Exception as e:
+            await session.rollback()
+            flask_app.logger.error('Error deleting patient %s: %s', id, e)
+            return JSONResponse({'message': f'Error deleting patient: {str(e)}'}, status_code=500)
+    return JSONResponse({'message': 'Patient deleted successfully'})
+
+
+# Images
+@authorize
+async def get_patient_images(request):
+    patient_id = request.path_params['patient_id']
+    async with Session() as session:
+        patient = await session.get(Patient, patient_id)
+        if not patient:
+            return JSONResponse({'message': 'Patient not found'}, status_code=404)
+        if request.state.user.role == 'PATIENT' and request.state.user.id != patient.createdBy:
+            return _forbidden()
+
+        query = select(MedicalImage).filter_by(patientId=patient_id).order_by(MedicalImage.uploadedAt.desc())
+        return JSONResponse(await paginate(session, request, query, image_to_dict_with_view_url))
+
+
+@authorize
+async def get_image_download_url(request):
+    async with Session() as session:
+        image = await session.get(MedicalImage, request.path_params['image_id'])
+        if not image:
+            return JSONResponse({'message': 'Image not found'}, status_code=404)
+        patient = await session.get(Patient, image.patientId)
+    if request.state.user.role == 'PATIENT' and (not patient or request.state.user.id != patient.createdBy):
+        return _forbidden()
+
+    url, expires_in = await to_thread.run_sync(presigned_get_url_with_expiry, storage.key_from_url(image.imageUrl))
+    if not url:
+        return JSONResponse({'message': 'Download URL not available'}, status_code=503)
+    return JSONResponse({'url': url, 'expiresIn': expires_in})
+
+
+# Appointments, medications and medical records (reads)
+@authorize
+async def get_all_appointments(request):
+    query = select(Appointment)
+    if request.query_params.get('date'):
+        query = query.filter(Appointment.appointmentDate == request.query_params['date'])
+    if request.state.user.role != 'ADMIN':
+        query = query.filter(Appointment.doctorId == request.state.user.id)
+    query = query.order_by(Appointment.appointmentDate.asc(), Appointment.startTime.asc())
+    async with Session() as session:
+        return JSONResponse(await paginate(session, request, query))
+
+
+@authorize
+async def get_all_medications(request):
+    query = select(Medication)
+    if request.query_params.get('patient_id'):
+        query = query.filter(Medication.patientId == request.query_params['patient_id'])
+    if request.state.user.role != 'ADMIN':
+        query = query.filter(Medication.prescribedBy == request.state.user.id)
+    query = query.order_by(Medication.startDate.desc())
+    async with Session() as session:
+        return JSONResponse(await paginate(session, request, query))
+
+
+@authorize
+async def get_allergy_conflicts(request):
+    prescribed_by = None if request.state.user.role == 'ADMIN' else request.state.user.id
+    async with Session() as session:
+        checked, conflicts = await session.run_sync(
+            lambda sync_session: allergy_checker.audit(sync_session, prescribed_by=prescribed_by))
+    return JSONResponse({'data': conflicts, 'checked': checked})
+
+
+@authorize
+async def get_all_medical_records(request):
+    query = select(MedicalRecord)
+    if request.query_params.get('patient_id'):
+        query = query.filter(MedicalRecord.patientId == request.query_params['patient_id'])
+    if request.state.user.role != 'ADMIN':
+        query = query.filter(MedicalRecord.doctorId == request.state.user.id)
+    query = query.order_by(MedicalRecord.visitDate.desc())
+    async with Session() as session:
+        return JSONResponse(await paginate(session, request, query))
+
+
+def get_one(model, not_found):
+    @authorize
+    async def handler(request):
+        async with Session() as session:
+            item = await session.get(model, request.path_params['id'])
+        if not item:
+            return JSONResponse({'message': not_found}, status_code=404)
+        return JSONResponse(item.to_dict())
+
+    handler.__name__ = f"get_{model.__tablename__}"
+    return handler
+
+
+@authorize
+async def event_stream(request):
+    # Same stream as /api/events/stream in app.py, but a waiting client is a
+    # parked coroutine instead of a blocked thread
+    try:
+        options = subscription_options(request.query_params)
+    except ValueError as e:
+        return JSONResponse({'message': str(e)}, status_code=400)
+    last_event_id = request.headers.get('last-event-id') or request.query_params.get('lastEventId')
+
+    loop = asyncio.get_running_loop()
+    ready = asyncio.Event()
+    subscription = event_broker.subscribe(**options, wakeup=lambda: loop.call_soon_threadsafe(ready.set))
+    replayed, last_seq = [], 0
+    if last_event_id and last_event_id.isdigit():
+        last_seq = int(last_event_id)
+        replayed = await to_thread.run_sync(event_broker.replay, last_seq)
+        if replayed is None:
+            replayed = [{'seq': None, 'table': None, 'operation': RESYNC}]
+        replayed = [event for event in replayed if subscription.matches(event)]
+
+    async def stream():
+        try:
+            yield 'retry: 3000\n\n'
+            seen = last_seq
+            for event in replayed:
+                seen = max(seen, event['seq'] or 0)
+                yield format_event(event)
+            while True:
+                try:
+                    await asyncio.wait_for(ready.wait(), EVENTS_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ': keepalive\n\n'
+                    continue
+                ready.clear()
+                for event in subscription.drain():
+                    if event['seq'] is None or event['seq'] > seen:
+                        yield format_event(event)
+        finally:
+            event_broker.unsubscribe(subscription)
+
+    return StreamingResponse(stream(), media_type='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+
+
+async def health_check(request):
+    try:
+        async with engine.connect() as connection:
+            await connection.exec_driver_sql('SELECT 1')
+        db_status = 'connected'
+    except Exception:
+        db_status = 'error'
+
+    return JSONResponse({
+        'status': 'UP',
+        'service': 'patient-service',
+        'database': db_status,
+        's3': 'configured' if storage.name == 's3' else 'not configured',
+        'storage': storage.name,
+        'server': 'asgi'
+    })
+
+
+async def dispose_engine():
+    await engine.dispose()
+
+
+routes = []
+for prefix in ('/api', ''):
+    # Patient routes also exist without the /api prefix, like in app.py
+    routes += [
+        Route(f'{prefix}/patients', get_all_patients, methods=['GET']),
+        Route(f'{prefix}/patients', create_patient, methods=['POST']),
+        Route(f'{prefix}/patients/{{id}}', get_patient, methods=['GET']),
+        Route(f'{prefix}/patients/{{id}}', update_patient, methods=['PUT']),
+        Route(f'{prefix}/patients/{{id}}', delete_patient, methods=['DELETE']),
+        Route(f'{prefix}/patients/{{patient_id}}/images', get_patient_images, methods=['GET']),
+    ]
+routes += [
+    Route('/api/images/{image_id}/download-url', get_image_download_url, methods=['GET']),
+    Route('/api/appointments', get_all_appointments, methods=['GET']),
+    Route('/api/appointments/{id}', get_one(Appointment, 'Appointment not found'), methods=['GET']),
+    Route('/api/medications', get_all_medications, methods=['GET']),
+    # Before /api/medications/{id}, which would take it for an id
+    Route('/api/medications/allergy-conflicts', get_allergy_conflicts, methods=['GET']),
+    Route('/api/medications/{id}', get_one(Medication, 'Medication not found'), methods=['GET']),
+    Route('/api/medical-records', get_all_medical_records, methods=['GET']),
+    Route('/api/medical-records/{id}', get_one(MedicalRecord, 'Medical record not found'), methods=['GET']),
+    Route('/api/events/stream', event_stream, methods=['GET']),
+    Route('/health', health_check, methods=['GET']),
+    # Everything else (writes on other resources, GraphQL, files, seed, admin) is served by Flask
+    Mount('/', WSGIMiddleware(flask_app)),
+]
+
+app = Starlette(
+    routes=routes,
+    middleware=[
+        Middleware(
+            CORSMiddleware,
+            allow_origins=['*'],
+            allow_credentials=True,
+            allow_methods=['*'],
+            allow_headers=['Content-Type', 'X-User-ID', 'Authorization'],
+        )
+    ],
+    on_shutdown=[dispose_engine],
+)
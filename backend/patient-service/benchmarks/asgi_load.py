@@ -0,0 +1,140 @@
+"""Load comparison between the sync (gunicorn + wsgi) and async (uvicorn +
+asgi) deployments.
+
+Both servers run against the same seeded SQLite database with the same
+number of worker processes. Each concurrency level keeps that many requests
+in flight for a fixed duration against a read-heavy mix of patient list,
+patient detail and image download-URL requests:
+
+    pip install -r requirements-asgi.txt
+    python benchmarks/asgi_load.py --workers 2 --concurrency 10 100 500
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVERS = {
+    'sync': lambda port, workers: [
+        sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}', '--workers', str(workers), 'app:app',
+    ],
+    'async': lambda port, workers: [
+        sys.executable, '-m', 'uvicorn', '--host', '127.0.0.1', '--port', str(port), '--workers', str(workers),
+        '--log-level', 'warning', '--no-access-log', 'asgi:app',
+    ],
+}
+
+
+def seed_database(database_path):
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{database_path}')
+    script = (
+        'from app import app, db\n'
+        'with app.app_context(): db.create_all()\n'
+        'app.test_client().get("/api/seed")\n'
+    )
+    subprocess.run([sys.executable, '-c', script], cwd=SERVICE_DIR, env=env, check=True, capture_output=True)
+
+
+def wait_until_ready(url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f'Server did not start: {url}')
+
+
+async def run_level(base_url, concurrency, duration):
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        patients = (await client.get('/api/patients?per_page=100')).json()['data']
+        patient_ids = [patient['id'] for patient in patients]
+        paths = ['/api/patients?per_page=20']
+        paths += [f'/api/patients/{id}' for id in patient_ids]
+        paths += [f'/api/patients/{id}/images' for id in patient_ids]
+
+        latencies = []
+        errors = 0
+        deadline = time.perf_counter() + duration
+
+        async def user():
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    response = await client.get(random.choice(paths))
+                    if response.status_code >= 400:
+                        errors += 1
+                        continue
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(user() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+
+    def pct(p):
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))] * 1000, 2) if latencies else None
+
+    return {
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': errors,
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+        'latency_p50_ms': pct(50),
+        'latency_p95_ms': pct(95),
+        'latency_p99_ms': pct(99),
+    }
+
+
+def benchmark(mode, args, database_path, port):
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{database_path}')
+    server = subprocess.Popen(
+        SERVERS[mode](port, args.workers), cwd=SERVICE_DIR, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True,
+    )
+    base_url = f'http://127.0.0.1:{port}'
+    try:
+        wait_until_ready(f'{base_url}/health')
+        return [asyncio.run(run_level(base_url, level, args.duration)) for level in args.concurrency]
+    finally:
+        os.killpg(server.pid, signal.SIGTERM)
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare sync and async serving under concurrent load')
+    parser.add_argument('--workers', type=int, default=2, help='Worker processes for both servers')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[10, 100, 500])
+    parser.add_argument('--duration', type=float, default=10, help='Seconds per concurrency level')
+    parser.add_argument('--port', type=int, default=8731)
+    parser.add_argument('--mode', choices=['sync', 'async', 'both'], default='both')
+    args = parser.parse_args()
+
+    database_path = os.path.join(tempfile.mkdtemp(prefix='asgi-load-'), 'load.db')
+    seed_database(database_path)
+
+    modes = ['sync', 'async'] if args.mode == 'both' else [args.mode]
+    results = {mode: benchmark(mode, args, database_path, args.port + i) for i, mode in enumerate(modes)}
+    print(json.dumps({'workers': args.workers, 'duration_seconds': args.duration, 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
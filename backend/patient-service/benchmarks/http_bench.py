@@ -0,0 +1,300 @@
+"""HTTP benchmark of the main REST routes and representative GraphQL queries.
+
+A dataset is generated with ``datagen`` into a temporary SQLite database
+(or the database in ``--database-url``). Each scenario is then driven at
+several concurrency levels, either in-process through the Flask test client
+(``--mode client``: application overhead only, no network or server) or
+against a real gunicorn started with ``gunicorn.conf.py`` (``--mode
+gunicorn``). Throughput and latency percentiles are written as JSON and
+compared against ``http_baseline.json``:
+
+    python benchmarks/http_bench.py                         # both modes, compare
+    python benchmarks/http_bench.py --mode client --scenarios patients_list graphql_patients
+    python benchmarks/http_bench.py --output results.json --save-baseline
+
+Latencies depend on the machine, so refresh the baseline with
+``--save-baseline`` when moving to other hardware.
+"""
+import argparse
+import json
+import os
+import random
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'http_baseline.json')
+
+GRAPHQL_PATIENTS = '{ allPatients(limit: 20) { id firstName lastName dateOfBirth email } }'
+GRAPHQL_SEARCH = '{ allPatients(search: "smi", limit: 20) { id firstName lastName } }'
+GRAPHQL_PATIENT = 'query ($id: ID) { patient(id: $id) { id firstName lastName allergies medicalConditions } }'
+GRAPHQL_APPOINTMENTS = 'query ($id: ID) { allAppointments(patientId: $id) { id appointmentDate startTime status } }'
+
+# name -> function(ids) returning (method, path, json body or None) for one request.
+# ``ids`` holds sample patient, appointment, medication and record ids from the dataset.
+SCENARIOS = {
+    'patients_list': lambda ids: ('GET', f'/api/patients?page={random.randint(1, 50)}&per_page=20', None),
+    'patient_detail': lambda ids: ('GET', f"/api/patients/{random.choice(ids['patients'])}", None),
+    'patient_images': lambda ids: ('GET', f"/api/patients/{random.choice(ids['patients'])}/images", None),
+    'appointments_list': lambda ids: ('GET', '/api/appointments?per_page=20', None),
+    'medications_list': lambda ids: ('GET', '/api/medications?per_page=20', None),
+    'medical_records_list': lambda ids: ('GET', '/api/medical-records?per_page=20', None),
+    'medication_detail': lambda ids: ('GET', f"/api/medications/{random.choice(ids['medications'])}", None),
+    'graphql_patients': lambda ids: ('POST', '/graphql', {'query': GRAPHQL_PATIENTS}),
+    'graphql_search': lambda ids: ('POST', '/graphql', {'query': GRAPHQL_SEARCH}),
+    'graphql_patient': lambda ids: (
+        'POST', '/graphql', {'query': GRAPHQL_PATIENT, 'variables': {'id': random.choice(ids['patients'])}}
+    ),
+    'graphql_appointments': lambda ids: (
+        'POST', '/graphql', {'query': GRAPHQL_APPOINTMENTS, 'variables': {'id': random.choice(ids['patients'])}}
+    ),
+}
+
+DATASET_SCRIPT = '''
+import json, sys
+from app import app, db
+import datagen
+with app.app_context():
+    db.create_all()
+    url = db.engine.url.render_as_string(hide_password=False)
+if %(patients)d:
+    datagen.generate(url, %(patients)d, seed=%(seed)d, chunk_size=%(chunk_size)d)
+with app.app_context():
+    ids = {}
+    for table in ('patients', 'appointments', 'medications', 'medical_records'):
+        rows = db.session.execute(db.text(f'SELECT id FROM {table} ORDER BY id LIMIT 500'))
+        ids[table] = [row[0] for row in rows]
+print(json.dumps(ids))
+'''
+
+
+def prepare_dataset(database_url, patients, seed):
+    env = dict(os.environ, DATABASE_URL=database_url)
+    env.pop('FLASK_RUN_FROM_CLI', None)
+    script = DATASET_SCRIPT % {'patients': patients, 'seed': seed, 'chunk_size': max(1, min(5000, patients))}
+    result = subprocess.run(
+        [sys.executable, '-c', script], cwd=SERVICE_DIR, env=env, capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def _status(status, path, payload):
+    # GraphQL reports resolver errors in a 200 response
+    if status == 200 and path == '/graphql' and payload().get('errors'):
+        return 599
+    return status
+
+
+# Request drivers: ``session()`` returns a function(method, path, body) -> status
+# code, used by one benchmark thread
+
+class ClientDriver:
+    def __init__(self, database_url):
+        os.environ['DATABASE_URL'] = database_url
+        os.environ.setdefault('SQL_SERVER_TIMING', 'false')
+        sys.path.insert(0, SERVICE_DIR)
+        import logging
+        from app import app
+        # Request logging would dominate in-process timings, and benchmark threads
+        # contending for the GIL trip the slow-query warning
+        logging.disable(logging.WARNING)
+        self.app = app
+
+    def session(self):
+        client = self.app.test_client()
+
+        def send(method, path, body):
+            response = client.open(path, method=method, json=body)
+            return _status(response.status_code, path, lambda: response.json)
+        return send
+
+    def close(self):
+        pass
+
+
+class GunicornDriver:
+    def __init__(self, database_url, port, workers):
+        import httpx
+        self.httpx = httpx
+        env = dict(os.environ, DATABASE_URL=database_url, PORT=str(port), WEB_CONCURRENCY=str(workers))
+        env.pop('FLASK_RUN_FROM_CLI', None)
+        self.server = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--access-logfile', '/dev/null', 'wsgi:app'],
+            cwd=SERVICE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True,
+        )
+        self.base_url = f'http://127.0.0.1:{port}'
+        deadline = time.time() + 60
+        while time.time() < deadline:
+            try:
+                if httpx.get(f'{self.base_url}/health', timeout=1).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.2)
+        self.close()
+        raise RuntimeError('gunicorn did not start')
+
+    def session(self):
+        client = self.httpx.Client(base_url=self.base_url, timeout=60)
+
+        def send(method, path, body):
+            response = client.request(method, path, json=body)
+            return _status(response.status_code, path, response.json)
+        return send
+
+    def close(self):
+        os.killpg(self.server.pid, signal.SIGTERM)
+        self.server.wait()
+
+
+def run_level(driver, scenario, ids, concurrency, duration, warmup):
+    """Keep ``concurrency`` requests in flight for ``duration`` seconds."""
+    make_request = SCENARIOS[scenario]
+    latencies = [[] for _ in range(concurrency)]
+    errors = [0] * concurrency
+    sessions = [driver.session() for _ in range(concurrency)]
+    barrier = threading.Barrier(concurrency + 1)
+    state = {}
+
+    def user(index):
+        send = sessions[index]
+        barrier.wait()
+        while True:
+            now = time.perf_counter()
+            if now >= state['deadline']:
+                return
+            method, path, body = make_request(ids)
+            try:
+                status = send(method, path, body)
+            except Exception:
+                status = 599
+            elapsed = time.perf_counter() - now
+            # Requests that started during warm-up are not counted
+            if now < state['measure_from']:
+                continue
+            if status >= 400:
+                errors[index] += 1
+            else:
+                latencies[index].append(elapsed)
+
+    threads = [threading.Thread(target=user, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    state['measure_from'] = time.perf_counter() + warmup
+    state['deadline'] = state['measure_from'] + duration
+    barrier.wait()
+    for thread in threads:
+        thread.join()
+
+    samples = sorted(latency for thread_latencies in latencies for latency in thread_latencies)
+
+    def pct(p):
+        return round(samples[min(len(samples) - 1, int(len(samples) * p / 100))] * 1000, 2) if samples else None
+
+    return {
+        'concurrency': concurrency,
+        'requests': len(samples),
+        'errors': sum(errors),
+        'requests_per_second': round(len(samples) / duration, 1),
+        'latency_mean_ms': round(statistics.fmean(samples) * 1000, 2) if samples else None,
+        'latency_p50_ms': pct(50),
+        'latency_p90_ms': pct(90),
+        'latency_p99_ms': pct(99),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Regressions in throughput or median/p99 latency beyond ``tolerance``."""
+    regressions = []
+    for mode, scenarios in results['results'].items():
+        for scenario, levels in scenarios.items():
+            previous = {level['concurrency']: level for level in baseline.get('results', {}).get(mode, {}).get(scenario, [])}
+            for level in levels:
+                old = previous.get(level['concurrency'])
+                if old is None:
+                    continue
+                name = f"{mode} {scenario} c={level['concurrency']}"
+                if level['errors'] and not old['errors']:
+                    regressions.append(f"{name}: {level['errors']} errors")
+                if level['requests_per_second'] < old['requests_per_second'] * (1 - tolerance):
+                    regressions.append(f"{name}: {level['requests_per_second']} req/s vs baseline {old['requests_per_second']}")
+                for metric in ('latency_p50_ms', 'latency_p99_ms'):
+                    if level[metric] and old[metric] and level[metric] > old[metric] * (1 + tolerance):
+                        regressions.append(f"{name}: {metric} {level[metric]} vs baseline {old[metric]}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark REST and GraphQL routes against a generated dataset')
+    parser.add_argument('--mode', choices=['client', 'gunicorn', 'both'], default='both')
+    parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--duration', type=float, default=3, help='Measured seconds per scenario and level')
+    parser.add_argument('--warmup', type=float, default=0.5, help='Unmeasured seconds before each measurement')
+    parser.add_argument('--patients', type=int, default=2000, help='Generated patients')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--database-url', help='Use an existing dataset instead of generating one')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn worker processes')
+    parser.add_argument('--port', type=int, default=8741)
+    parser.add_argument('--output', help='Write the JSON results to this file')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed slowdown vs the baseline')
+    parser.add_argument('--save-baseline', action='store_true')
+    args = parser.parse_args()
+
+    if args.database_url:
+        database_url = args.database_url
+        ids = prepare_dataset(database_url, 0, args.seed)
+    else:
+        database_url = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='http-bench-'), 'bench.db')}"
+        ids = prepare_dataset(database_url, args.patients, args.seed)
+
+    modes = ['client', 'gunicorn'] if args.mode == 'both' else [args.mode]
+    results = {
+        'python': sys.version.split()[0],
+        'cpus': os.cpu_count(),
+        'patients': None if args.database_url else args.patients,
+        'duration_seconds': args.duration,
+        'gunicorn_workers': args.workers,
+        'results': {},
+    }
+    for mode in modes:
+        driver = ClientDriver(database_url) if mode == 'client' else GunicornDriver(database_url, args.port, args.workers)
+        try:
+            results['results'][mode] = {}
+            for scenario in args.scenarios:
+                levels = [run_level(driver, scenario, ids, level, args.duration, args.warmup) for level in args.concurrency]
+                results['results'][mode][scenario] = levels
+                summary = ', '.join(f"c={level['concurrency']}: {level['requests_per_second']} req/s "
+                                    f"p50 {level['latency_p50_ms']} ms p99 {level['latency_p99_ms']} ms"
+                                    for level in levels)
+                print(f'{mode} {scenario}: {summary}', file=sys.stderr)
+        finally:
+            driver.close()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if args.save_baseline:
+        with open(BASELINE_PATH, 'w') as f:
+            f.write(output + '\n')
+        return
+
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}', file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""Sustained write throughput against SQLite with several worker processes.
+
+Each worker imports the app the way a gunicorn worker would and issues a mix
+of patient creates and list reads through the Flask test client for a fixed
+duration. Run it with and without the SQLite profile to compare:
+
+    python benchmarks/sqlite_write_stress.py --workers 8 --duration 20
+    python benchmarks/sqlite_write_stress.py --compare
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def worker(database_path, profile, duration, read_ratio, start_at, results):
+    os.environ['DATABASE_URL'] = f'sqlite:///{database_path}'
+    os.environ['SQLITE_PROFILE'] = 'true' if profile else 'false'
+    sys.path.insert(0, SERVICE_DIR)
+    from app import app
+
+    client = app.test_client()
+    writes = reads = errors = locked = 0
+    latencies = []
+    time.sleep(max(0, start_at - time.time()))
+    deadline = time.time() + duration
+    counter = 0
+    while time.time() < deadline:
+        counter += 1
+        started = time.perf_counter()
+        try:
+            if read_ratio and counter % round(1 / read_ratio) == 0:
+                response = client.get('/api/patients?limit=20')
+                reads += response.status_code == 200
+            else:
+                response = client.post('/api/patients', json={
+                    'firstName': 'Stress',
+                    'lastName': f'Worker{os.getpid()}',
+                    'dateOfBirth': '1980-01-01',
+                    'gender': 'Other',
+                    'email': f'{uuid.uuid4().hex}@example.com',
+                    'phone': '555-0100',
+                    'address': '1 Benchmark Way',
+                })
+                if response.status_code == 201:
+                    writes += 1
+                    latencies.append(time.perf_counter() - started)
+                else:
+                    errors += 1
+                    locked += b'locked' in response.data
+        except Exception as e:
+            errors += 1
+            locked += 'locked' in str(e)
+    results.put({'writes': writes, 'reads': reads, 'errors': errors, 'locked': locked, 'latencies': latencies})
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def run(workers, duration, read_ratio, profile):
+    directory = tempfile.mkdtemp(prefix='sqlite-stress-')
+    database_path = os.path.join(directory, 'stress.db')
+
+    # Create the schema once, before the workers start
+    context = multiprocessing.get_context('spawn')
+    setup = context.Process(target=_create_schema, args=(database_path, profile))
+    setup.start()
+    setup.join()
+
+    results = context.Queue()
+    start_at = time.time() + 3  # let every worker finish importing first
+    processes = [
+        context.Process(target=worker, args=(database_path, profile, duration, read_ratio, start_at, results))
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    collected = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    latencies = [latency for result in collected for latency in result['latencies']]
+    writes = sum(result['writes'] for result in collected)
+    return {
+        'profile': profile,
+        'workers': workers,
+        'duration_seconds': duration,
+        'writes': writes,
+        'reads': sum(result['reads'] for result in collected),
+        'errors': sum(result['errors'] for result in collected),
+        'locked_errors': sum(result['locked'] for result in collected),
+        'writes_per_second': round(writes / duration, 1),
+        'write_latency_p50_ms': _ms(percentile(latencies, 50)),
+        'write_latency_p99_ms': _ms(percentile(latencies, 99)),
+        'database': database_path,
+    }
+
+
+def _create_schema(database_path, profile):
+    os.environ['DATABASE_URL'] = f'sqlite:///{database_path}'
+    os.environ['SQLITE_PROFILE'] = 'true' if profile else 'false'
+    sys.path.insert(0, SERVICE_DIR)
+    from app import app, db
+    with app.app_context():
+        db.create_all()
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--read-ratio', type=float, default=0.2, help='Fraction of requests that are reads')
+    parser.add_argument('--no-profile', action='store_true', help='Disable the SQLite profile (SQLITE_PROFILE=false)')
+    parser.add_argument('--compare', action='store_true', help='Run without and then with the profile')
+    args = parser.parse_args()
+
+    profiles = [False, True] if args.compare else [not args.no_profile]
+    results = [run(args.workers, args.duration, args.read_ratio, profile) for profile in profiles]
+    print(json.dumps(results if args.compare else results[0], indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""Cold-start profile: import time and time-to-first-request.
+
+Each run starts a fresh interpreter with ``-X importtime``, imports ``wsgi``
+and serves one request through the test client. The median of several runs
+is compared against ``startup_baseline.json`` so regressions show up in
+review:
+
+    python benchmarks/startup.py                  # report and compare
+    python benchmarks/startup.py --save-baseline  # update the baseline
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'startup_baseline.json')
+
+# Dependencies that should only load on first use
+LAZY_MODULES = ['boto3', 'flask_restx', 'graphene', 'flask_graphql', 'alembic', 'PIL']
+
+CHILD = '''
+import json, time
+started = time.perf_counter()
+import wsgi
+imported = time.perf_counter()
+response = wsgi.app.test_client().get('/api/patients?per_page=1')
+served = time.perf_counter()
+import sys
+print(json.dumps({
+    'import_seconds': imported - started,
+    'first_request_seconds': served - imported,
+    'status': response.status_code,
+    'lazy_modules_loaded': [name for name in %r if name in sys.modules],
+}))
+''' % (LAZY_MODULES,)
+
+_IMPORTTIME_RE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$')
+
+
+def parse_importtime(stderr):
+    """Return ``{module: (self_us, cumulative_us, indent)}``; deeper imports are more indented."""
+    modules = {}
+    for line in stderr.splitlines():
+        match = _IMPORTTIME_RE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            modules[name] = (int(self_us), int(cumulative_us), len(indent))
+    return modules
+
+
+def run_once(database_url):
+    env = dict(os.environ, DATABASE_URL=database_url, USE_SWAGGER='false')
+    env.pop('FLASK_RUN_FROM_CLI', None)
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', CHILD],
+        cwd=SERVICE_DIR, env=env, capture_output=True, text=True, check=True
+    )
+    wall = time.perf_counter() - started
+    child = json.loads(result.stdout.strip().splitlines()[-1])
+    child['process_seconds'] = wall
+    child['modules'] = parse_importtime(result.stderr)
+    return child
+
+
+def summarize(runs, top):
+    # Modules imported directly by wsgi.py / app.py (two nesting levels deep)
+    heaviest = sorted(
+        ((name, cumulative) for name, (_, cumulative, indent) in runs[-1]['modules'].items()
+         if indent <= 5 and name not in ('wsgi', 'app')),
+        key=lambda item: item[1], reverse=True
+    )[:top]
+    return {
+        'runs': len(runs),
+        'import_ms': round(statistics.median(run['import_seconds'] for run in runs) * 1000, 1),
+        'first_request_ms': round(statistics.median(run['first_request_seconds'] for run in runs) * 1000, 1),
+        'process_ms': round(statistics.median(run['process_seconds'] for run in runs) * 1000, 1),
+        'lazy_modules_loaded': runs[-1]['lazy_modules_loaded'],
+        'heaviest_imports_ms': {name: round(cumulative / 1000, 1) for name, cumulative in heaviest},
+    }
+
+
+def compare(result, baseline, tolerance):
+    regressions = []
+    for metric in ('import_ms', 'first_request_ms', 'process_ms'):
+        if metric in baseline and result[metric] > baseline[metric] * (1 + tolerance):
+            regressions.append(f"{metric}: {result[metric]} ms vs baseline {baseline[metric]} ms")
+    for name in result['lazy_modules_loaded']:
+        if name not in baseline.get('lazy_modules_loaded', []):
+            regressions.append(f"{name} is now imported at startup")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure import time and time-to-first-request')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15, help='Heaviest direct imports to list')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed slowdown vs the baseline')
+    parser.add_argument('--save-baseline', action='store_true')
+    args = parser.parse_args()
+
+    database_url = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='startup-'), 'startup.db')}"
+    subprocess.run(
+        [sys.executable, '-c', 'from app import app, db\nwith app.app_context(): db.create_all()'],
+        cwd=SERVICE_DIR, env=dict(os.environ, DATABASE_URL=database_url), check=True, capture_output=True
+    )
+
+    runs = [run_once(database_url) for _ in range(args.runs)]
+    result = summarize(runs, args.top)
+    print(json.dumps(result, indent=2))
+
+    if args.save_baseline:
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump(result, f, indent=2)
+            f.write('\n')
+        return
+
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
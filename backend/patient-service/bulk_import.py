@@ -0,0 +1,415 @@
+import csv
+import json
+import uuid
+from datetime import datetime
+from itertools import islice
+
+from sqlalchemy import func
+
+from changes import INSERT
+from duplicates import blocking_keys
+
+# Streaming import of CSV or NDJSON files. Rows flow through generators
+# (parse -> validate -> chunk) and are written with one multi-row INSERT per
+# chunk, so memory use depends on the chunk size, not on the file size.
+#
+# Progress is kept in an import_checkpoints row that is committed in the same
+# transaction as each chunk, together with the byte offset reached in the
+# source. An interrupted import resumes from that offset with nothing lost
+# or written twice.
+
+FORMATS = ('csv', 'ndjson')
+
+# Per import kind: target table, fields, and which of them need parsing.
+# Child rows reference their patient by ``patientExternalId`` (the id in the
+# source system) or by our ``patientId``.
+IMPORT_KINDS = {
+    'patients': {
+        'table': 'patients',
+        'required': ('firstName', 'lastName', 'dateOfBirth', 'gender', 'email', 'phone', 'address'),
+        'optional': ('externalId', 'insuranceId', 'medicalConditions', 'allergies', 'notes'),
+        'dates': ('dateOfBirth',),
+        'lists': ('medicalConditions', 'allergies'),
+    },
+    'appointments': {
+        'table': 'appointments',
+        'required': ('appointmentDate', 'startTime', 'endTime', 'status', 'reason'),
+        'optional': ('notes',),
+        'doctor': 'doctorId',
+        'dates': ('appointmentDate',),
+        'times': ('startTime', 'endTime'),
+    },
+    'medications': {
+        'table': 'medications',
+        'required': ('name', 'dosage', 'frequency', 'startDate'),
+        'optional': ('endDate', 'notes'),
+        'doctor': 'prescribedBy',
+        'dates': ('startDate', 'endDate'),
+    },
+    'medical_records': {
+        'table': 'medical_records',
+        'required': ('visitDate', 'chiefComplaint', 'diagnosis', 'treatmentPlan'),
+        'optional': ('followUpNeeded', 'notes'),
+        'doctor': 'doctorId',
+        'dates': ('visitDate',),
+        'booleans': ('followUpNeeded',),
+    },
+}
+
+TRUE_VALUES = ('true', 't', 'yes', 'y', '1')
+FALSE_VALUES = ('false', 'f', 'no', 'n', '0', '')
+
+
+class ImportFormatError(ValueError):
+    """The source cannot be read at all (as opposed to a single bad row)."""
+
+
+# Parsing
+
+class _LineReader:
+    """Decoded lines of a binary stream, counting the bytes consumed.
+
+    csv.reader pulls lines only as it needs them, so after each record
+    ``offset`` is exactly where the next record starts.
+    """
+
+    def __init__(self, stream, offset=0):
+        self.stream = stream
+        self.offset = offset
+        self.terminated = True
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.stream.readline()
+        if not line:
+            raise StopIteration
+        self.offset += len(line)
+        self.terminated = line.endswith(b'\n')
+        try:
+            return line.decode('utf-8')
+        except UnicodeDecodeError:
+            raise ImportFormatError(f'Invalid UTF-8 at byte {self.offset - len(line)}')
+
+
+def _skip(stream, count):
+    if count <= 0:
+        return
+    if hasattr(stream, 'seekable') and stream.seekable():
+        stream.seek(count, 1)
+        return
+    # Request bodies cannot seek: read past the part that was already imported
+    while count > 0:
+        data = stream.read(min(count, 1 << 20))
+        if not data:
+            raise ImportFormatError('The source is shorter than the checkpoint; is it the same file?')
+        count -= len(data)
+
+
+def _truncated(lines):
+    # A bad last line without a newline is most likely a cut-off upload. Stop
+    # before it so that resuming with the complete file picks the row up.
+    if not lines.terminated:
+        raise ImportFormatError(f'The source ends in an incomplete row at byte {lines.offset}')
+
+
+def parse(stream, fmt, offset=0):
+    """Yield ``(record, end_offset)`` for each record after byte ``offset``."""
+    if fmt == 'csv':
+        header_reader = _LineReader(stream)
+        try:
+            header = next(csv.reader(header_reader))
+        except StopIteration:
+            return
+        header = [name.lstrip('\ufeff').strip() for name in header]
+        _skip(stream, offset - header_reader.offset)
+        lines = _LineReader(stream, max(offset, header_reader.offset))
+        for values in csv.reader(lines):
+            if not any(values):
+                continue
+            if len(values) != len(header):
+                _truncated(lines)
+                yield {'__error__': f'Expected {len(header)} columns, got {len(values)}'}, lines.offset
+                continue
+            yield dict(zip(header, values)), lines.offset
+    elif fmt == 'ndjson':
+        _skip(stream, offset)
+        lines = _LineReader(stream, offset)
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                _truncated(lines)
+                record = {'__error__': f'Invalid JSON: {e}'}
+            if not isinstance(record, dict):
+                record = {'__error__': 'Each line must be a JSON object'}
+            yield record, lines.offset
+    else:
+        raise ImportFormatError(f"Unsupported format '{fmt}'; use one of: {', '.join(FORMATS)}")
+
+
+# Validation
+
+def _text(value):
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def _list(value):
+    if value is None or value == '':
+        return []
+    if isinstance(value, list):
+        return [str(item).strip() for item in value if str(item).strip()]
+    # CSV cells hold lists as "a; b" (or "a, b" like the REST API accepts)
+    separator = ';' if ';' in str(value) else ','
+    return [item.strip() for item in str(value).split(separator) if item.strip()]
+
+
+def validate_record(spec, table, record, default_doctor_id=None):
+    """Return ``(row, errors)``: a row ready to insert (without ids), or the list of problems."""
+    if '__error__' in record:
+        return None, [record['__error__']]
+
+    errors = []
+    row = {}
+    for field in spec['required'] + spec['optional']:
+        value = record.get(field)
+        if field in spec.get('lists', ()):
+            row[field] = _list(value)
+            continue
+        if field in spec.get('booleans', ()):
+            text = str(value).strip().lower() if value is not None else ''
+            if isinstance(value, bool):
+                row[field] = value
+            elif text in TRUE_VALUES or text in FALSE_VALUES:
+                row[field] = text in TRUE_VALUES
+            else:
+                errors.append(f'{field} must be true or false')
+            continue
+        value = _text(value)
+        if value is None:
+            if field in spec['required']:
+                errors.append(f'{field} is required')
+            row[field] = None
+            continue
+        if field in spec.get('dates', ()):
+            try:
+                datetime.strptime(value, '%Y-%m-%d')
+            except ValueError:
+                errors.append(f'{field} must be YYYY-MM-DD')
+        if field in spec.get('times', ()):
+            try:
+                value = datetime.strptime(value, '%H:%M:%S' if value.count(':') == 2 else '%H:%M').strftime('%H:%M:%S')
+            except ValueError:
+                errors.append(f'{field} must be HH:MM or HH:MM:SS')
+        length = getattr(table.c[field].type, 'length', None)
+        if length and len(value) > length:
+            errors.append(f'{field} is longer than {length} characters')
+        row[field] = value
+
+    if spec['table'] != 'patients':
+        row['patientId'] = _text(record.get('patientId'))
+        row['patientExternalId'] = _text(record.get('patientExternalId'))
+        if not row['patientId'] and not row['patientExternalId']:
+            errors.append('patientExternalId or patientId is required')
+        doctor = spec['doctor']
+        row[doctor] = _text(record.get(doctor)) or default_doctor_id
+        if not row[doctor]:
+            errors.append(f'{doctor} is required')
+
+    return (None, errors) if errors else (row, [])
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# Writing
+
+class BulkImporter:
+    """Imports one source into one table, resumably, under checkpoint ``name``.
+
+    ``run(stream, fmt)`` takes a binary stream (an open file or a request
+    body) and returns a summary. Rows that fail validation or reference an
+    unknown patient are counted and the first ``max_reported_errors`` are
+    returned with their row number; the rest of the file still loads.
+    """
+
+    def __init__(self, db, checkpoint_model, kind, name, chunk_size=1000, created_by=None,
+                 default_doctor_id=None, max_reported_errors=100, change_tracker=None, on_chunk=None):
+        if kind not in IMPORT_KINDS:
+            raise ImportFormatError(f"Unknown import kind '{kind}'; use one of: {', '.join(IMPORT_KINDS)}")
+        self.db = db
+        self.checkpoint_model = checkpoint_model
+        self.kind = kind
+        self.spec = IMPORT_KINDS[kind]
+        self.table = db.metadata.tables[self.spec['table']]
+        self.patients = db.metadata.tables['patients']
+        self.name = name
+        self.chunk_size = chunk_size
+        self.created_by = created_by
+        self.default_doctor_id = default_doctor_id
+        self.max_reported_errors = max_reported_errors
+        self.change_tracker = change_tracker
+        self.on_chunk = on_chunk
+        # Source-system patient id -> our Patient.id, filled as rows need it
+        self.patient_ids = {}
+        self.errors = []
+
+    def _checkpoint(self):
+        checkpoint = self.checkpoint_model.query.get(self.name)
+        if checkpoint is None:
+            checkpoint = self.checkpoint_model(
+                name=self.name, kind=self.kind, byteOffset=0, rowsRead=0, imported=0, skipped=0, failed=0
+            )
+            self.db.session.add(checkpoint)
+        elif checkpoint.kind != self.kind:
+            raise ImportFormatError(f"Checkpoint '{self.name}' belongs to a {checkpoint.kind} import")
+        return checkpoint
+
+    def run(self, stream, fmt):
+        checkpoint = self._checkpoint()
+        if checkpoint.completedAt is not None:
+            self.db.session.rollback()
+            return self._summary(checkpoint, resumed=True)
+        resumed = checkpoint.rowsRead > 0
+        row_number = checkpoint.rowsRead
+
+        def validated():
+            nonlocal row_number
+            for record, end_offset in parse(stream, fmt, checkpoint.byteOffset):
+                row_number += 1
+                row, errors = validate_record(self.spec, self.table, record, self.default_doctor_id)
+                yield row_number, row, errors, end_offset
+
+        for chunk in _chunks(validated(), self.chunk_size):
+            self._write_chunk(checkpoint, chunk)
+            if self.on_chunk:
+                self.on_chunk(self._summary(checkpoint, resumed))
+
+        checkpoint.completedAt = datetime.utcnow()
+        self.db.session.commit()
+        return self._summary(checkpoint, resumed)
+
+    def _reject(self, checkpoint, row_number, errors):
+        checkpoint.failed += 1
+        if len(self.errors) < self.max_reported_errors:
+            self.errors.append({'row': row_number, 'errors': errors})
+
+    def _write_chunk(self, checkpoint, chunk):
+        now = datetime.utcnow()
+        valid = []
+        for row_number, row, errors, _ in chunk:
+            if errors:
+                self._reject(checkpoint, row_number, errors)
+            else:
+                valid.append((row_number, row))
+
+        if self.kind == 'patients':
+            rows = self._prepare_patients(checkpoint, valid, now)
+        else:
+            rows = self._prepare_children(checkpoint, valid, now)
+
+        if rows:
+            # One executemany per chunk instead of an ORM unit of work per row
+            self.db.session.execute(self.table.insert(), rows)
+            if self.change_tracker is not None:
+                # Core inserts skip the ORM flush hook, so log them here
+                self.change_tracker.record(self.db.session, [(self.table.name, row['id'], INSERT) for row in rows])
+        checkpoint.imported += len(rows)
+        checkpoint.rowsRead += len(chunk)
+        checkpoint.byteOffset = chunk[-1][3]
+        checkpoint.updatedAt = now
+        self.db.session.commit()
+
+    def _prepare_patients(self, checkpoint, valid, now):
+        external_ids = {row['externalId'] for _, row in valid if row['externalId']}
+        emails = {row['email'].lower() for _, row in valid}
+        existing_external = {}
+        if external_ids:
+            existing_external = dict(self.db.session.execute(
+                self.db.select(self.patients.c.externalId, self.patients.c.id)
+                .where(self.patients.c.externalId.in_(external_ids))
+            ).all())
+        existing_emails = {email.lower() for (email,) in self.db.session.execute(
+            self.db.select(self.patients.c.email).where(func.lower(self.patients.c.email).in_(emails))
+        )}
+
+        rows = []
+        for row_number, row in valid:
+            external_id = row['externalId']
+            if external_id in existing_external:
+                # Imported before (e.g. under another checkpoint name): keep the existing patient
+                self.patient_ids[external_id] = existing_external[external_id]
+                checkpoint.skipped += 1
+                continue
+            email = row['email'].lower()
+            if email in existing_emails:
+                self._reject(checkpoint, row_number, [f"A patient with email {row['email']} already exists"])
+                continue
+            existing_emails.add(email)
+            row['id'] = str(uuid.uuid4())
+            row['createdBy'] = self.created_by
+            row['createdAt'] = row['updatedAt'] = now
+            # Core inserts skip the ORM hook that sets these
+            row.update(blocking_keys(row['lastName'], row['dateOfBirth'], row['phone']))
+            if external_id:
+                existing_external[external_id] = row['id']
+                self.patient_ids[external_id] = row['id']
+            rows.append(row)
+        return rows
+
+    def _prepare_children(self, checkpoint, valid, now):
+        # Resolve every patient reference of the chunk with two IN queries at most
+        unknown_external = {row['patientExternalId'] for _, row in valid
+                            if row['patientExternalId'] and row['patientExternalId'] not in self.patient_ids}
+        if unknown_external:
+            self.patient_ids.update(self.db.session.execute(
+                self.db.select(self.patients.c.externalId, self.patients.c.id)
+                .where(self.patients.c.externalId.in_(unknown_external))
+            ).all())
+        direct_ids = {row['patientId'] for _, row in valid if row['patientId'] and not row['patientExternalId']}
+        known_ids = set()
+        if direct_ids:
+            known_ids = {id for (id,) in self.db.session.execute(
+                self.db.select(self.patients.c.id).where(self.patients.c.id.in_(direct_ids))
+            )}
+
+        rows = []
+        for row_number, row in valid:
+            external_id = row.pop('patientExternalId')
+            if external_id:
+                row['patientId'] = self.patient_ids.get(external_id)
+                if row['patientId'] is None:
+                    self._reject(checkpoint, row_number, [f'Unknown patientExternalId {external_id}'])
+                    continue
+            elif row['patientId'] not in known_ids:
+                self._reject(checkpoint, row_number, [f"Unknown patientId {row['patientId']}"])
+                continue
+            row['id'] = str(uuid.uuid4())
+            row['createdAt'] = row['updatedAt'] = now
+            rows.append(row)
+        return rows
+
+    def _summary(self, checkpoint, resumed):
+        return {
+            'checkpoint': self.name,
+            'kind': self.kind,
+            'resumed': resumed,
+            'completed': checkpoint.completedAt is not None,
+            'rowsRead': checkpoint.rowsRead,
+            'imported': checkpoint.imported,
+            'skipped': checkpoint.skipped,
+            'failed': checkpoint.failed,
+            'errors': list(self.errors),
+        }
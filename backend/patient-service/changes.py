@@ -0,0 +1,183 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, func, select
+
+# Operations recorded in the change log
+INSERT, UPDATE, DELETE = 'insert', 'update', 'delete'
+
+
+class CursorExpired(Exception):
+    """The cursor is older than the oldest change still kept; the client must resync."""
+
+
+def flushed_changes(session, table_names):
+    """``(table name, object, operation)`` for each object of ``table_names``
+    written by the flush in progress (for use in ``after_flush`` hooks)."""
+    for operation, objects in ((INSERT, session.new), (UPDATE, session.dirty), (DELETE, session.deleted)):
+        for obj in objects:
+            table_name = getattr(obj, '__tablename__', None)
+            if table_name not in table_names:
+                continue
+            if operation == UPDATE and not session.is_modified(obj, include_collections=False):
+                continue
+            yield table_name, obj, operation
+
+
+class ChangeTracker:
+    """Append-only log of inserts, updates and deletes of the tracked models.
+
+    Every ORM flush that touches a tracked model appends one row per changed
+    object to ``change_log`` in the same transaction, so a change is logged
+    exactly when it commits. Writers that bypass the unit of work (bulk
+    inserts, set-based UPDATEs) call ``record()`` themselves.
+
+    Sequence numbers come from the table's sequence at insert time, so
+    writers never wait for each other. On PostgreSQL a transaction can commit
+    a lower ``seq`` after a reader has already seen a higher one, and a
+    rolled back one leaves a hole. Readers therefore stop before a hole until
+    the entry after it is ``visibility_lag`` old; by then the hole is taken
+    to be a rollback. SQLite writers are serialized already (see database.py),
+    so their entries commit in ``seq`` order.
+    """
+
+    def __init__(self, db, change_model, models, visibility_lag=timedelta(seconds=10)):
+        self.db = db
+        self.change_model = change_model
+        self.models = {model.__tablename__: model for model in models}
+        self.visibility_lag = visibility_lag
+        self.track(db.session)
+
+    def track(self, target):
+        """Log the flushes of another session (class or factory), e.g. asgi.py's."""
+        event.listen(target, 'after_flush', self._after_flush)
+        event.listen(target, 'after_transaction_end', self._after_transaction_end)
+
+    @property
+    def table(self):
+        return self.change_model.__table__
+
+    def _after_flush(self, session, flush_context):
+        changes = [(table_name, obj.id, operation) for table_name, obj, operation in flushed_changes(session, self.models)]
+        if changes:
+            self.record(session, changes)
+
+    def _after_transaction_end(self, session, transaction):
+        if transaction.parent is None:
+            session.info.pop('change_seqs', None)
+
+    def record(self, session, changes):
+        """Append ``(table name, row id, operation)`` entries in the session's transaction.
+
+        The sequence numbers given to them are kept in ``session.info['change_seqs']``
+        (``(table name, row id)`` -> latest seq) until the transaction ends.
+        """
+        now = datetime.utcnow()
+        rows = [
+            {'tableName': table_name, 'rowId': row_id, 'operation': operation, 'changedAt': now}
+            for table_name, row_id, operation in changes
+        ]
+        seqs = session.info.setdefault('change_seqs', {})
+        if self.db.engine.dialect.name == 'postgresql':
+            log = self.table
+            for seq, table_name, row_id in session.execute(
+                log.insert().values(rows).returning(log.c.seq, log.c.tableName, log.c.rowId)
+            ):
+                key = (table_name, row_id)
+                seqs[key] = max(seq, seqs.get(key, seq))
+            return
+
+        session.execute(self.table.insert(), rows)
+        # SQLite has one writer at a time, so this insert took the highest,
+        # consecutive numbers
+        last = session.execute(select(func.max(self.table.c.seq))).scalar()
+        for seq, (table_name, row_id, _) in enumerate(changes, start=last - len(changes) + 1):
+            seqs[(table_name, row_id)] = seq
+
+    def _settled(self, entries, since, cutoff):
+        """The leading ``entries`` (in ``seq`` order after cursor ``since``) that no
+        uncommitted entry can come before: up to the first hole whose next entry
+        was written after ``cutoff``."""
+        if self.db.engine.dialect.name != 'postgresql':
+            return entries
+        previous = since
+        for index, entry in enumerate(entries):
+            if entry.seq != previous + 1 and entry.changedAt >= cutoff:
+                return entries[:index]
+            previous = entry.seq
+        return entries
+
+    def latest_cursor(self):
+        log = self.table
+        if self.db.engine.dialect.name != 'postgresql':
+            return self.db.session.execute(select(func.max(log.c.seq))).scalar() or 0
+
+        # Entries older than the lag are settled; walk the recent ones after them
+        cutoff = datetime.utcnow() - self.visibility_lag
+        settled = self.db.session.execute(select(func.max(log.c.seq)).where(log.c.changedAt < cutoff)).scalar()
+        if settled is None:
+            oldest = self.db.session.execute(select(func.min(log.c.seq))).scalar()
+            settled = oldest - 1 if oldest is not None else 0
+        recent = self.db.session.execute(
+            select(log.c.seq, log.c.changedAt).where(log.c.seq > settled).order_by(log.c.seq)
+        ).all()
+        recent = self._settled(recent, settled, cutoff)
+        return recent[-1].seq if recent else settled
+
+    def changes_since(self, since, limit=500):
+        """Changes after cursor ``since``, oldest first, at most ``limit`` log rows.
+
+        Several changes of one row in the page collapse into its latest state;
+        upserts carry the row as ``to_dict()`` returns it and deletes are
+        tombstones without data. Returns ``(changes, next cursor, has more)``.
+        """
+        log = self.table
+        oldest = self.db.session.execute(select(func.min(log.c.seq))).scalar()
+        if oldest is not None and since < oldest - 1:
+            raise CursorExpired()
+
+        entries = self.db.session.execute(
+            select(log.c.seq, log.c.tableName, log.c.rowId, log.c.operation, log.c.changedAt)
+            .where(log.c.seq > since).order_by(log.c.seq).limit(limit + 1)
+        ).all()
+        has_more = len(entries) > limit
+        entries = entries[:limit]
+        settled = self._settled(entries, since, datetime.utcnow() - self.visibility_lag)
+        if len(settled) < len(entries):
+            # The rest waits for the hole before it to commit or age out
+            entries, has_more = settled, False
+        if not entries:
+            return [], since, False
+
+        # Last entry per row, in the order of those last entries; remember
+        # whether the row was created inside this page
+        latest, inserted = {}, set()
+        for seq, table_name, row_id, operation, _ in entries:
+            key = (table_name, row_id)
+            latest.pop(key, None)
+            latest[key] = (seq, operation)
+            if operation == INSERT:
+                inserted.add(key)
+
+        # Current state of every upserted row: one IN query per table
+        rows = {}
+        for table_name, model in self.models.items():
+            ids = [row_id for (name, row_id), (_, operation) in latest.items() if name == table_name and operation != DELETE]
+            if ids:
+                rows.update({(table_name, obj.id): obj.to_dict() for obj in model.query.filter(model.id.in_(ids))})
+
+        changes = []
+        for key, (seq, operation) in latest.items():
+            data = rows.get(key)
+            if operation != DELETE and data is None:
+                # Deleted since, by a writer that did not log it
+                operation = DELETE
+            elif operation == UPDATE and key in inserted:
+                operation = INSERT
+            changes.append({'seq': seq, 'table': key[0], 'id': key[1], 'operation': operation,
+                            'data': data if operation != DELETE else None})
+        return changes, entries[-1][0], has_more
+
+    def prune(self, before):
+        """Delete log rows older than ``before``; cursors from before then expire."""
+        with self.db.engine.begin() as connection:
+            return connection.execute(self.table.delete().where(self.table.c.changedAt < before)).rowcount
@@ -0,0 +1,36 @@
+import json
+
+from sqlalchemy.types import Text, TypeDecorator
+
+# Column types shared by the models and the migration scripts. Kept free of
+# app imports so migrations can load them without building the Flask app.
+
+
+# Helper classes for SQLite JSON storage
+class MedicalConditionList(TypeDecorator):
+    impl = Text
+    cache_ok = True
+    
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return '[]'
+        return json.dumps(value)
+    
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return []
+        return json.loads(value)
+
+class AllergiesList(TypeDecorator):
+    impl = Text
+    cache_ok = True
+    
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return '[]'
+        return json.dumps(value)
+    
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return []
+        return json.loads(value)
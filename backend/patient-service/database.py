@@ -0,0 +1,523 @@
+import os
+import re
+import json
+import time
+import asyncio
+import itertools
+import logging
+import threading
+import weakref
+
+try:
+    import fcntl
+except ImportError:  # Windows: the thread lock still serializes each process
+    fcntl = None
+
+from flask import g, has_request_context, request
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import event, orm
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.util import await_only
+
+logger = logging.getLogger(__name__)
+
+
+def _env_bool(environ, name, default):
+    return environ.get(name, str(default)).lower() in ('1', 'true', 'yes')
+
+
+def engine_options_from_env(database_uri, environ=os.environ):
+    """Build SQLALCHEMY_ENGINE_OPTIONS from DB_POOL_* environment variables.
+
+    | Variable             | Default | Meaning                                        |
+    |----------------------|---------|------------------------------------------------|
+    | DB_POOL_SIZE         | 5       | Persistent connections per worker process      |
+    | DB_MAX_OVERFLOW      | 10      | Extra connections allowed under burst load     |
+    | DB_POOL_TIMEOUT      | 30      | Seconds to wait for a free connection          |
+    | DB_POOL_PRE_PING     | true    | Test connections on checkout (survives failover) |
+    | DB_POOL_RECYCLE      | 1800    | Replace connections older than this (seconds)  |
+
+    Each gunicorn worker owns its own pool, so the server-side connection
+    budget is ``workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW)``.
+    """
+    if make_url(database_uri).get_backend_name() == 'sqlite':
+        return sqlite_engine_options(database_uri, environ)
+
+    return {
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': int(environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': float(environ.get('DB_POOL_TIMEOUT', 30)),
+        'pool_pre_ping': _env_bool(environ, 'DB_POOL_PRE_PING', True),
+        'pool_recycle': int(environ.get('DB_POOL_RECYCLE', 1800)),
+    }
+
+
+def _sqlite_is_file(url):
+    return url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:')
+
+
+def sqlite_engine_options(database_uri, environ=os.environ):
+    """Engine options for file-based SQLite when SQLITE_PROFILE is enabled.
+
+    Connections are pooled and shared across threads (the pysqlite default of
+    one connection per thread does not suit gthread workers), and the driver
+    waits ``SQLITE_BUSY_TIMEOUT`` ms for locks instead of failing with
+    "database is locked". Pragmas are applied by ``configure_sqlite_engine``.
+    """
+    if not _env_bool(environ, 'SQLITE_PROFILE', True) or not _sqlite_is_file(make_url(database_uri)):
+        return {}
+    return {
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': int(environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': float(environ.get('DB_POOL_TIMEOUT', 30)),
+        'connect_args': {
+            'check_same_thread': False,
+            'timeout': int(environ.get('SQLITE_BUSY_TIMEOUT', 10000)) / 1000.0,
+        },
+    }
+
+
+def sqlite_pragmas_from_env(environ=os.environ):
+    """PRAGMAs run on every new SQLite connection.
+
+    | Variable              | Default     | Meaning                                       |
+    |-----------------------|-------------|-----------------------------------------------|
+    | SQLITE_JOURNAL_MODE   | WAL         | Readers never block the writer and vice versa |
+    | SQLITE_SYNCHRONOUS    | NORMAL      | Safe with WAL; fsync only at checkpoints      |
+    | SQLITE_BUSY_TIMEOUT   | 10000       | Milliseconds to wait for a lock               |
+    | SQLITE_CACHE_SIZE     | -65536      | Page cache per connection (negative = KiB)    |
+    | SQLITE_MMAP_SIZE      | 268435456   | Bytes of the file read through mmap           |
+    """
+    return [
+        ('journal_mode', environ.get('SQLITE_JOURNAL_MODE', 'WAL')),
+        ('synchronous', environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')),
+        ('busy_timeout', int(environ.get('SQLITE_BUSY_TIMEOUT', 10000))),
+        ('cache_size', int(environ.get('SQLITE_CACHE_SIZE', -65536))),
+        ('mmap_size', int(environ.get('SQLITE_MMAP_SIZE', 268435456))),
+        ('temp_store', 'MEMORY'),
+    ]
+
+
+class SQLiteWriteLock:
+    """Serializes SQLite write transactions across threads and processes.
+
+    SQLite allows one writer at a time; without coordination, concurrent
+    gunicorn workers race for the write lock and the losers spin in the busy
+    handler or fail. Writers instead queue on a thread lock plus an exclusive
+    ``flock`` on ``<database>-writer.lock`` from their first write until
+    commit or rollback, while reads continue concurrently under WAL.
+
+    The lock is reentrant within a thread, so a connection that writes while
+    the same thread's session holds it (a job reporting progress) does not
+    wait on itself.
+    """
+
+    def __init__(self, database_path, timeout=10.0):
+        self.path = database_path + '-writer.lock'
+        self.timeout = timeout
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+        self._pid = None
+
+    def _file(self):
+        # flock is shared with forked children through the inherited file
+        # description, so every process opens its own
+        if self._pid != os.getpid():
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            self._pid = os.getpid()
+        return self._fd
+
+    def acquire(self):
+        deadline = time.monotonic() + self.timeout
+        if not self._thread_lock.acquire(timeout=self.timeout):
+            return False
+        self._depth += 1
+        if fcntl is None or self._depth > 1:
+            return True
+        delay = 0.001
+        while True:
+            try:
+                fcntl.flock(self._file(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    self._depth -= 1
+                    self._thread_lock.release()
+                    return False
+                time.sleep(delay)
+                delay = min(delay * 2, 0.02)
+
+    def release(self):
+        self._depth -= 1
+        if fcntl is not None and self._depth == 0:
+            fcntl.flock(self._file(), fcntl.LOCK_UN)
+        self._thread_lock.release()
+
+
+class AsyncSQLiteWriteLock(SQLiteWriteLock):
+    """SQLiteWriteLock for the sync side of an asyncio engine (asgi.py).
+
+    Its writers are coroutines on one event loop thread, so they queue on an
+    asyncio.Lock instead of a thread lock, and the flock is polled with
+    asyncio.sleep; a writer waiting for another process parks its coroutine
+    instead of blocking the loop. ``acquire`` is called from the engine's
+    execute hook, which runs in SQLAlchemy's greenlet and so can await.
+    """
+
+    def __init__(self, database_path, timeout=10.0):
+        super().__init__(database_path, timeout)
+        self._async_lock = asyncio.Lock()
+
+    def acquire(self):
+        return await_only(self._acquire())
+
+    async def _acquire(self):
+        deadline = time.monotonic() + self.timeout
+        try:
+            await asyncio.wait_for(self._async_lock.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            return False
+        if fcntl is None:
+            return True
+        delay = 0.001
+        while True:
+            try:
+                fcntl.flock(self._file(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    self._async_lock.release()
+                    return False
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 0.02)
+
+    def release(self):
+        if fcntl is not None:
+            fcntl.flock(self._file(), fcntl.LOCK_UN)
+        self._async_lock.release()
+
+
+_WRITE_STATEMENT_RE = re.compile(r'\s*(INSERT|UPDATE|DELETE|REPLACE)\b', re.IGNORECASE)
+
+
+def configure_sqlite_engine(engine, environ=os.environ, lock_class=SQLiteWriteLock):
+    """Apply the SQLite profile (pragmas and write serialization) to an engine;
+    for an asyncio engine, pass its ``sync_engine`` and AsyncSQLiteWriteLock."""
+    if not _env_bool(environ, 'SQLITE_PROFILE', True) or not _sqlite_is_file(engine.url):
+        return
+    pragmas = sqlite_pragmas_from_env(environ)
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas:
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+
+    if _env_bool(environ, 'SQLITE_WRITE_LOCK', True):
+        timeout = int(environ.get('SQLITE_BUSY_TIMEOUT', 10000)) / 1000.0
+        serialize_sqlite_writes(engine, lock_class(os.path.abspath(engine.url.database), timeout))
+
+
+def serialize_sqlite_writes(engine, lock):
+    """Hold ``lock`` from a connection's first write statement until the
+    connection goes back to the pool, which is after its commit or rollback.
+
+    These are engine events, so ORM sessions and Core writes through
+    ``engine.begin()`` (jobs, outbox, change log pruning) take the same lock.
+    Read-only transactions never take it.
+    """
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def acquire_for_write(connection, cursor, statement, parameters, context, executemany):
+        if 'sqlite_write_lock' in connection.info or not _WRITE_STATEMENT_RE.match(statement):
+            return
+        if lock.acquire():
+            connection.info['sqlite_write_lock'] = lock
+        else:
+            # Fall back to SQLite's own busy handling rather than failing here
+            logger.warning('Timed out waiting for the SQLite writer lock')
+
+    @event.listens_for(engine, 'checkin')
+    def release_after_transaction(dbapi_connection, connection_record):
+        held = connection_record.info.pop('sqlite_write_lock', None)
+        if held is not None:
+            held.release()
+
+
+class PoolStats:
+    """Checkout counters for one pool. Updated under a lock; reads are snapshots."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, wait, timed_out=False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.total_wait += wait
+            if wait > self.max_wait:
+                self.max_wait = wait
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'wait_seconds_total': round(self.total_wait, 6),
+                'wait_seconds_max': round(self.max_wait, 6),
+                'wait_seconds_avg': round(self.total_wait / (self.checkouts + self.timeouts), 6) if self.checkouts + self.timeouts else 0.0,
+            }
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records how long checkouts wait for a connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.stats.record(time.perf_counter() - start, timed_out=True)
+            raise
+        self.stats.record(time.perf_counter() - start)
+        return connection
+
+
+def pool_statistics(engine):
+    """Live statistics for an engine's pool, for the admin endpoint."""
+    pool = engine.pool
+    stats = {
+        'url': engine.url.render_as_string(hide_password=True),
+        'pool_class': type(pool).__name__,
+    }
+    if isinstance(pool, QueuePool):
+        stats.update({
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': pool.overflow(),
+            'max_overflow': pool._max_overflow,
+            'timeout': pool.timeout(),
+        })
+    if isinstance(pool, InstrumentedQueuePool):
+        stats.update(pool.stats.snapshot())
+    stats['pid'] = os.getpid()
+    return stats
+
+
+READ_ONLY_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS'])
+# Routes that are GET but write (development seeding)
+WRITE_PATHS = frozenset(['/api/seed'])
+_GRAPHQL_MUTATION_RE = re.compile(r'\bmutation\b')
+PRIMARY_COOKIE = 'db_primary_until'
+
+
+def graphql_queries():
+    """Query documents of a GraphQL request, read from the body the way
+    flask_graphql does (JSON object or batched list, ``application/graphql``,
+    form) with the ``query`` URL parameter as fallback; None when a query
+    cannot be found."""
+    content_type = request.mimetype
+    if content_type == 'application/graphql':
+        batch = [{'query': request.get_data(as_text=True)}]
+    elif content_type == 'application/json':
+        try:
+            data = json.loads(request.get_data(as_text=True))
+        except ValueError:
+            return None
+        batch = data if isinstance(data, list) else [data]
+    elif content_type in ('application/x-www-form-urlencoded', 'multipart/form-data'):
+        batch = [request.form]
+    else:
+        batch = [{}]
+
+    queries = []
+    for params in batch:
+        if not hasattr(params, 'get'):
+            return None
+        query = params.get('query') or request.args.get('query')
+        if not isinstance(query, str):
+            return None
+        queries.append(query)
+    return queries
+
+
+class ReplicaRouter:
+    """Chooses a read replica for read-only requests.
+
+    Replicas are used round-robin; one that fails with a connection error is
+    ejected for ``eject_seconds`` and then tried again. After a client writes,
+    a cookie keeps its reads on the primary for ``sticky_seconds`` so it
+    always sees its own changes despite replication lag.
+    """
+
+    def __init__(self, db, urls, eject_seconds=30, sticky_seconds=5):
+        self.db = db
+        self.urls = urls
+        self.eject_seconds = eject_seconds
+        self.sticky_seconds = sticky_seconds
+        self._engines = None
+        self._ejected_until = {}
+        self._verified = set()
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    @property
+    def engines(self):
+        if self._engines is None:
+            with self._lock:
+                if self._engines is None:
+                    engines = []
+                    for url in self.urls:
+                        engine = self.db.create_engine(make_url(url), engine_options_from_env(url))
+                        event.listen(engine, 'handle_error', self._on_error)
+                        engines.append(engine)
+                    self._engines = engines
+        return self._engines
+
+    def _on_error(self, context):
+        if context.is_disconnect or context.connection is None:
+            self.eject(context.engine)
+
+    def eject(self, engine):
+        logger.warning('Ejecting read replica %s for %ss', engine.url.render_as_string(hide_password=True), self.eject_seconds)
+        self._ejected_until[engine] = time.monotonic() + self.eject_seconds
+        self._verified.discard(engine)
+
+    def _verify(self, engine):
+        # Probe a replica before its first use (and after each ejection) so an
+        # unreachable one falls back to the primary instead of failing a request
+        if engine in self._verified:
+            return True
+        try:
+            engine.connect().close()
+        except Exception:
+            return False
+        self._verified.add(engine)
+        return True
+
+    def choose(self):
+        """Next healthy replica, or None to fall back to the primary."""
+        engines = self.engines
+        for _ in range(len(engines)):
+            engine = engines[next(self._counter) % len(engines)]
+            if self._ejected_until.get(engine, 0) <= time.monotonic() and self._verify(engine):
+                return engine
+        return None
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+
+    def _before_request(self):
+        g.db_read_only = self.request_is_read_only()
+
+    def request_is_read_only(self):
+        try:
+            if float(request.cookies.get(PRIMARY_COOKIE, 0)) > time.time():
+                return False
+        except ValueError:
+            pass
+        if request.path in WRITE_PATHS:
+            return False
+        if request.path == '/graphql' and request.method == 'POST':
+            queries = graphql_queries()
+            # An operation we cannot read might be a mutation
+            return bool(queries) and not any(_GRAPHQL_MUTATION_RE.search(query) for query in queries)
+        return request.method in READ_ONLY_METHODS
+
+    def _after_request(self, response):
+        # Read-your-writes: pin this client to the primary for a short window
+        if not g.get('db_read_only', True) and response.status_code < 400 and self.sticky_seconds:
+            until = time.time() + self.sticky_seconds
+            response.set_cookie(PRIMARY_COOKIE, str(until), max_age=self.sticky_seconds, httponly=True, samesite='Lax')
+        return response
+
+
+class RoutingSession(SignallingSession):
+    """Session that sends reads of read-only requests to a replica.
+
+    Writes, row locks, anything after the session has flushed, and all work
+    outside a request (CLI commands, jobs) stay on the primary.
+    """
+
+    def __init__(self, db, **options):
+        self.db = db
+        SignallingSession.__init__(self, db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        bind = SignallingSession.get_bind(self, mapper, clause)
+        router = self.db.replica_router
+        if router is None or bind is not self.db.get_engine(self.app) or not self._can_use_replica(clause):
+            return bind
+        return router.choose() or bind
+
+    def _can_use_replica(self, clause):
+        if not has_request_context() or not g.get('db_read_only', False):
+            return False
+        if self.info.get('wrote'):
+            return False
+        if clause is not None and (getattr(clause, 'is_dml', False) or getattr(clause, '_for_update_arg', None) is not None):
+            return False
+        return True
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _mark_session_wrote(session, flush_context):
+    session.info['wrote'] = True
+
+
+class PooledSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy that keeps track of its engines so they can be reset
+    in a forked worker and reported by the pool statistics endpoint, and
+    that can route read-only requests to replicas."""
+
+    def __init__(self, *args, **kwargs):
+        self.engines = weakref.WeakSet()
+        self.replica_router = None
+        super().__init__(*args, **kwargs)
+
+    def create_engine(self, sa_url, engine_opts):
+        engine = super().create_engine(sa_url, engine_opts)
+        configure_sqlite_engine(engine)
+        self.engines.add(engine)
+        return engine
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def enable_replicas(self, app, urls, eject_seconds=30, sticky_seconds=5):
+        self.replica_router = ReplicaRouter(self, urls, eject_seconds, sticky_seconds)
+        self.replica_router.init_app(app)
+
+    def dispose_engines(self, close=True):
+        for engine in list(self.engines):
+            engine.dispose(close=close)
+
+    def dispose_engines_after_fork(self):
+        # close=False: the parent still owns those sockets, so the child just
+        # forgets them and opens fresh connections on first use
+        self.dispose_engines(close=False)
+
+
+def register_fork_safety(db):
+    """Reset connection pools in every forked child (gunicorn workers, or any
+    other fork) so parent and child never share a database socket."""
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=db.dispose_engines_after_fork)
@@ -0,0 +1,301 @@
+import io
+import csv
+import json
+import time
+import uuid
+import random
+import multiprocessing
+from datetime import date, datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from sqlalchemy import MetaData, Table, create_engine
+
+from duplicates import blocking_keys
+
+# Synthetic data for load and performance testing. Each chunk of patients is
+# generated from its own RNG seeded with (seed, chunk), so the output depends
+# only on the seed, patient count and chunk size, not on the number of
+# workers or on the order in which chunks finish.
+
+FIRST_NAMES = [
+    'James', 'Mary', 'Robert', 'Patricia', 'John', 'Jennifer', 'Michael', 'Linda', 'David', 'Elizabeth',
+    'William', 'Barbara', 'Richard', 'Susan', 'Joseph', 'Jessica', 'Thomas', 'Sarah', 'Charles', 'Karen',
+    'Amara', 'Chinedu', 'Wei', 'Mei', 'Arjun', 'Priya', 'Carlos', 'Lucia', 'Omar', 'Fatima',
+    'Hiroshi', 'Yuki', 'Kwame', 'Ama', 'Ivan', 'Olga', 'Liam', 'Emma', 'Noah', 'Olivia',
+]
+LAST_NAMES = [
+    'Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis', 'Rodriguez', 'Martinez',
+    'Hernandez', 'Lopez', 'Wilson', 'Anderson', 'Thomas', 'Taylor', 'Moore', 'Jackson', 'Martin', 'Lee',
+    'Okafor', 'Adeyemi', 'Chen', 'Wang', 'Patel', 'Sharma', 'Silva', 'Santos', 'Haddad', 'Khan',
+    'Tanaka', 'Sato', 'Mensah', 'Boateng', 'Ivanov', 'Petrova', 'Murphy', 'Kelly', 'Nguyen', 'Kim',
+]
+STREETS = ['Main St', 'Oak Ave', 'Pine Rd', 'Maple Dr', 'Cedar Ln', 'Elm St', 'Park Ave', 'Lake Rd', 'Hill St', 'River Rd']
+CITIES = [
+    ('Springfield', 'IL'), ('Riverside', 'CA'), ('Franklin', 'TN'), ('Greenville', 'SC'), ('Madison', 'WI'),
+    ('Salem', 'OR'), ('Fairview', 'TX'), ('Clinton', 'NY'), ('Georgetown', 'KY'), ('Arlington', 'VA'),
+]
+GENDERS = ['Male', 'Female', 'Other']
+GENDER_WEIGHTS = [49, 49, 2]
+CONDITIONS = [
+    'Hypertension', 'Type 2 Diabetes', 'Asthma', 'Hyperlipidemia', 'Osteoarthritis', 'Hypothyroidism',
+    'COPD', 'Depression', 'Anxiety', 'Migraine', 'GERD', 'Atrial Fibrillation', 'Chronic Kidney Disease',
+]
+ALLERGIES = ['Penicillin', 'Sulfa', 'Aspirin', 'Ibuprofen', 'Latex', 'Peanuts', 'Shellfish', 'Codeine', 'Eggs', 'Pollen']
+MEDICATIONS = [
+    ('Lisinopril', '10mg', 'Once daily'), ('Metformin', '500mg', 'Twice daily'), ('Atorvastatin', '20mg', 'Once daily at bedtime'),
+    ('Levothyroxine', '50mcg', 'Once daily before breakfast'), ('Albuterol', '90mcg', 'Every 4-6 hours as needed'),
+    ('Amlodipine', '5mg', 'Once daily'), ('Omeprazole', '20mg', 'Once daily'), ('Sertraline', '50mg', 'Once daily'),
+    ('Metoprolol', '25mg', 'Twice daily'), ('Amoxicillin', '500mg', 'Three times daily for 10 days'),
+]
+APPOINTMENT_STATUSES = ['Scheduled', 'Completed', 'Canceled', 'No-Show']
+APPOINTMENT_STATUS_WEIGHTS = [25, 60, 10, 5]
+VISIT_REASONS = ['Annual physical', 'Follow-up', 'Medication review', 'Lab results', 'New symptoms', 'Vaccination', 'Consultation']
+COMPLAINTS = [
+    ('Headache', 'Tension headache', 'Rest, hydration and ibuprofen as needed'),
+    ('Cough', 'Acute bronchitis', 'Fluids, rest and cough suppressant'),
+    ('Chest tightness', 'Asthma exacerbation', 'Increase inhaler use and follow up in one week'),
+    ('Elevated blood pressure', 'Uncontrolled hypertension', 'Adjust antihypertensive dose'),
+    ('Fatigue', 'Iron deficiency anemia', 'Oral iron supplementation'),
+    ('Joint pain', 'Osteoarthritis of the knee', 'Physical therapy and NSAIDs'),
+    ('Sore throat', 'Viral pharyngitis', 'Symptomatic treatment'),
+]
+IMAGE_TYPES = ['X-ray', 'MRI', 'CT', 'Ultrasound', 'Photo']
+
+# Average child rows per patient
+DEFAULT_RATIOS = {
+    'appointments': 4,
+    'medications': 2,
+    'medical_records': 3,
+    'medical_images': 1,
+}
+
+# Insert order respects the foreign keys
+TABLES = ['patients', 'appointments', 'medications', 'medical_records', 'medical_images']
+
+
+def _uuid(rng):
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def _count(rng, average):
+    return rng.randint(0, 2 * average) if average else 0
+
+
+def _day(rng, start, span_days):
+    return (start + timedelta(days=rng.randrange(span_days))).isoformat()
+
+
+def generate_doctors(seed, count):
+    """Deterministic doctor users for the generated rows to reference."""
+    rng = random.Random(f'{seed}:doctors')
+    now = datetime.utcnow()
+    doctors = []
+    for i in range(count):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        doctors.append({
+            'id': _uuid(rng),
+            'username': f'doctor-{seed}-{i}',
+            'password': 'doctor123',
+            'firstName': first,
+            'lastName': last,
+            'email': f'doctor-{seed}-{i}@synthetic.example',
+            'role': 'DOCTOR',
+            'createdAt': now,
+            'updatedAt': now,
+        })
+    return doctors
+
+
+def generate_chunk(seed, chunk, chunk_size, count, doctor_ids, ratios=DEFAULT_RATIOS):
+    """Rows for ``count`` patients starting at patient number ``chunk * chunk_size``,
+    as a dict of table name -> list of row dicts."""
+    rng = random.Random(f'{seed}:{chunk}')
+    now = datetime.utcnow()
+    today = date.today()
+    rows = {table: [] for table in TABLES}
+
+    for i in range(chunk * chunk_size, chunk * chunk_size + count):
+        patient_id = _uuid(rng)
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        city, state = rng.choice(CITIES)
+        date_of_birth = _day(rng, date(1930, 1, 1), 34000)
+        gender = rng.choices(GENDERS, GENDER_WEIGHTS)[0]
+        phone = f'555-{rng.randrange(1000):03d}-{rng.randrange(10000):04d}'
+        rows['patients'].append({
+            'id': patient_id,
+            'firstName': first,
+            'lastName': last,
+            'dateOfBirth': date_of_birth,
+            'gender': gender,
+            # The patient number keeps emails unique; the seed keeps them unique across runs
+            'email': f'{first}.{last}.{seed}-{i}@synthetic.example'.lower(),
+            'phone': phone,
+            'address': f'{rng.randint(1, 9999)} {rng.choice(STREETS)}, {city}, {state} {rng.randrange(10000, 99999)}',
+            'insuranceId': f'INS{rng.randrange(10 ** 9):09d}' if rng.random() < 0.9 else None,
+            'medicalConditions': json.dumps(rng.sample(CONDITIONS, _count(rng, 1))),
+            'allergies': json.dumps(rng.sample(ALLERGIES, _count(rng, 1))),
+            'notes': None,
+            'profileImageUrl': None,
+            'createdAt': now,
+            'updatedAt': now,
+            'createdBy': rng.choice(doctor_ids),
+            **blocking_keys(last, date_of_birth, phone),
+        })
+
+        for _ in range(_count(rng, ratios['appointments'])):
+            hour = rng.randint(8, 16)
+            rows['appointments'].append({
+                'id': _uuid(rng),
+                'patientId': patient_id,
+                'doctorId': rng.choice(doctor_ids),
+                'appointmentDate': _day(rng, today - timedelta(days=730), 1095),
+                'startTime': f'{hour:02d}:{rng.choice((0, 30)):02d}:00',
+                'endTime': f'{hour + 1:02d}:00:00',
+                'status': rng.choices(APPOINTMENT_STATUSES, APPOINTMENT_STATUS_WEIGHTS)[0],
+                'reason': rng.choice(VISIT_REASONS),
+                'notes': None,
+                'createdAt': now,
+                'updatedAt': now,
+            })
+
+        for _ in range(_count(rng, ratios['medications'])):
+            name, dosage, frequency = rng.choice(MEDICATIONS)
+            started = today - timedelta(days=rng.randrange(1825))
+            rows['medications'].append({
+                'id': _uuid(rng),
+                'patientId': patient_id,
+                'name': name,
+                'dosage': dosage,
+                'frequency': frequency,
+                'startDate': started.isoformat(),
+                'endDate': (started + timedelta(days=rng.randint(10, 365))).isoformat() if rng.random() < 0.4 else None,
+                'prescribedBy': rng.choice(doctor_ids),
+                'notes': None,
+                'createdAt': now,
+                'updatedAt': now,
+            })
+
+        for _ in range(_count(rng, ratios['medical_records'])):
+            complaint, diagnosis, plan = rng.choice(COMPLAINTS)
+            rows['medical_records'].append({
+                'id': _uuid(rng),
+                'patientId': patient_id,
+                'doctorId': rng.choice(doctor_ids),
+                'visitDate': _day(rng, today - timedelta(days=1825), 1825),
+                'chiefComplaint': complaint,
+                'diagnosis': diagnosis,
+                'treatmentPlan': plan,
+                'followUpNeeded': rng.random() < 0.3,
+                'notes': None,
+                'createdAt': now,
+                'updatedAt': now,
+            })
+
+        for _ in range(_count(rng, ratios['medical_images'])):
+            image_id = _uuid(rng)
+            rows['medical_images'].append({
+                'id': image_id,
+                'patientId': patient_id,
+                # Metadata only: nothing is uploaded for synthetic images
+                'imageUrl': f'https://synthetic.example/images/{image_id}.jpg',
+                'imageType': rng.choice(IMAGE_TYPES),
+                'description': None,
+                'uploadedAt': now,
+                'uploadedBy': rng.choice(doctor_ids),
+                'blobDigest': None,
+                'thumbnailUrl': None,
+                'previewUrl': None,
+            })
+    return rows
+
+
+# Insertion
+
+_engine = None
+_tables = {}
+
+
+def _worker_engine(url):
+    global _engine
+    if _engine is None:
+        connect_args = {'timeout': 300} if url.startswith('sqlite') else {}
+        _engine = create_engine(url, connect_args=connect_args)
+        metadata = MetaData()
+        for name in TABLES + ['users']:
+            _tables[name] = Table(name, metadata, autoload_with=_engine)
+    return _engine
+
+
+def _copy_rows(connection, table, rows):
+    """PostgreSQL COPY: several times faster than multi-row INSERT."""
+    columns = list(rows[0])
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        # \N is COPY's NULL marker in CSV mode with the NULL option below
+        writer.writerow(['\\N' if row[column] is None else row[column] for column in columns])
+    buffer.seek(0)
+    column_list = ', '.join(f'"{column}"' for column in columns)
+    cursor = connection.connection.cursor()
+    cursor.copy_expert(f"COPY {table.name} ({column_list}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buffer)
+
+
+def insert_rows(engine, tables, rows):
+    with engine.begin() as connection:
+        for name in TABLES + ['users']:
+            batch = rows.get(name)
+            if not batch:
+                continue
+            if engine.dialect.name == 'postgresql':
+                _copy_rows(connection, tables[name], batch)
+            else:
+                # executemany of a Core insert; no ORM unit of work per row
+                connection.execute(tables[name].insert(), batch)
+
+
+def load_chunk(url, seed, chunk, chunk_size, count, doctor_ids, ratios):
+    """Generate and insert one chunk. Runs in a pool process."""
+    engine = _worker_engine(url)
+    started = time.perf_counter()
+    rows = generate_chunk(seed, chunk, chunk_size, count, doctor_ids, ratios)
+    generated = time.perf_counter()
+    insert_rows(engine, _tables, rows)
+    return {
+        'chunk': chunk,
+        'rows': {name: len(batch) for name, batch in rows.items()},
+        'generateSeconds': generated - started,
+        'insertSeconds': time.perf_counter() - generated,
+    }
+
+
+def generate(url, patients, seed=42, chunk_size=5000, workers=None, doctors=50, ratios=DEFAULT_RATIOS, on_progress=None):
+    """Generate ``patients`` patients and their child rows into the database at ``url``.
+
+    Chunks are generated and inserted in parallel by ``workers`` processes.
+    ``on_progress(result, total_rows, elapsed)`` is called as each chunk
+    finishes. Returns the row count per table and the elapsed seconds.
+    """
+    engine = _worker_engine(url)
+    doctor_rows = generate_doctors(seed, doctors)
+    insert_rows(engine, _tables, {'users': doctor_rows})
+    doctor_ids = [doctor['id'] for doctor in doctor_rows]
+
+    chunks = -(-patients // chunk_size)
+    totals = {'users': len(doctor_rows)}
+    started = time.perf_counter()
+    workers = workers or multiprocessing.cpu_count()
+    # spawn keeps pool processes free of the parent's DB connections and threads
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = [
+            pool.submit(load_chunk, url, seed, chunk, chunk_size, min(chunk_size, patients - chunk * chunk_size),
+                        doctor_ids, ratios)
+            for chunk in range(chunks)
+        ]
+        for future in as_completed(futures):
+            result = future.result()
+            for name, count in result['rows'].items():
+                totals[name] = totals.get(name, 0) + count
+            if on_progress:
+                on_progress(result, sum(totals.values()), time.perf_counter() - started)
+    return totals, time.perf_counter() - started
+
@@ -0,0 +1,154 @@
+import re
+import json
+import unicodedata
+from datetime import date
+from functools import lru_cache
+
+from sqlalchemy import or_, select
+
+# Allergy entries that mean the patient has none
+NO_ALLERGIES = {'none', 'nka', 'nkda', 'no known allergies', 'no known drug allergies'}
+
+# Warning severities, worst first
+SEVERITIES = ('high', 'moderate', 'low')
+
+
+def normalize(name):
+    """Lower case ASCII words: 'Amoxicillin 500mg (Trihydrate)' -> 'amoxicillin 500mg trihydrate'"""
+    text = unicodedata.normalize('NFKD', name or '').encode('ascii', 'ignore').decode('ascii').lower()
+    return ' '.join(re.sub(r'[^a-z0-9]+', ' ', text).split())
+
+
+def load_drug_classes(path):
+    """The drug class mapping (drug_classes.json): ``classes`` of drug names,
+    ``aliases`` (brand names, singular forms) pointing to a drug or class,
+    and ``crossReactive`` classes."""
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compile_index(drug_classes):
+    """``(index, related)``: normalized drug, class and alias name ->
+    ``(drugs, classes)`` it stands for, and class -> cross-reactive classes."""
+    classes = drug_classes.get('classes', {})
+    members = {}
+    for class_name, drugs in classes.items():
+        for drug in drugs:
+            members.setdefault(normalize(drug), set()).add(class_name)
+    index = {drug: (frozenset([drug]), frozenset(names)) for drug, names in members.items()}
+    for class_name in classes:
+        index[normalize(class_name)] = (frozenset(), frozenset([class_name]))
+    for alias, target in drug_classes.get('aliases', {}).items():
+        if normalize(target) not in index:
+            raise ValueError(f"Alias '{alias}' points to unknown drug or class '{target}'")
+        index[normalize(alias)] = index[normalize(target)]
+    related = {class_name: frozenset(others) for class_name, others in drug_classes.get('crossReactive', {}).items()}
+    return index, related
+
+
+class AllergyChecker:
+    """Conflicts between prescribed medications and patient allergies.
+
+    The drug class mapping is compiled once into a hash map from normalized
+    name to the drugs and classes it stands for, so an allergy to
+    'Penicillin' (a class) flags 'Amoxicillin 500mg', and an allergy to
+    'Aspirin' flags ibuprofen (both NSAIDs). Names are resolved through an
+    LRU cache; checking a prescription is a few dictionary lookups and set
+    intersections, with no database query beyond the patient's allergies.
+
+    Warnings only inform the prescriber; nothing is rejected.
+    """
+
+    def __init__(self, db, medication_model, patient_model, drug_classes, cache_size=4096):
+        self.db = db
+        self.medication_model = medication_model
+        self.patient_model = patient_model
+        self.index, self.related = compile_index(drug_classes)
+        self._resolve = lru_cache(maxsize=cache_size)(self._resolve_name)
+
+    def _resolve_name(self, name):
+        # The whole name if it is known, otherwise its known words
+        # ('Tylenol with Codeine' -> codeine); an unknown name stands for itself
+        key = normalize(name)
+        if key in NO_ALLERGIES:
+            return frozenset(), frozenset()
+        if key in self.index:
+            return self.index[key]
+        drugs, classes = set(), set()
+        for word in key.split():
+            word_drugs, word_classes = self.index.get(word, ((), ()))
+            drugs.update(word_drugs)
+            classes.update(word_classes)
+        if not drugs and not classes and key:
+            drugs.add(key)
+        return frozenset(drugs), frozenset(classes)
+
+    def _conflict(self, medication, drugs, classes, allergy):
+        allergy_drugs, allergy_classes = self._resolve(allergy)
+        if allergy_drugs & drugs:
+            return {'allergy': allergy, 'severity': 'high', 'drugClass': None,
+                    'reason': f'{medication} matches the allergy to {allergy}'}
+        shared = sorted(allergy_classes & classes)
+        if shared and not allergy_drugs:
+            return {'allergy': allergy, 'severity': 'high', 'drugClass': shared[0],
+                    'reason': f'{medication} belongs to {shared[0]}'}
+        if shared:
+            return {'allergy': allergy, 'severity': 'moderate', 'drugClass': shared[0],
+                    'reason': f'{medication} and {allergy} are both {shared[0]}'}
+        for allergy_class in sorted(allergy_classes):
+            related = sorted(self.related.get(allergy_class, frozenset()) & classes)
+            if related:
+                return {'allergy': allergy, 'severity': 'low', 'drugClass': related[0],
+                        'reason': f'{related[0]} can cross-react with {allergy_class} ({allergy})'}
+        return None
+
+    def check(self, medication_name, allergies):
+        """Warnings for ``medication_name`` against a list of allergies, worst
+        first, as ``{'allergy', 'severity', 'drugClass', 'reason'}``."""
+        drugs, classes = self._resolve(medication_name or '')
+        warnings = []
+        for allergy in allergies or []:
+            if isinstance(allergy, str):
+                warning = self._conflict(medication_name, drugs, classes, allergy)
+                if warning:
+                    warnings.append(warning)
+        warnings.sort(key=lambda warning: SEVERITIES.index(warning['severity']))
+        return warnings
+
+    def check_medication(self, medication, session=None):
+        """Warnings for a medication against its patient's allergies."""
+        session = session or self.db.session
+        patients = self.patient_model.__table__
+        allergies = session.execute(
+            select(patients.c.allergies).where(patients.c.id == medication.patientId)
+        ).scalar()
+        return self.check(medication.name, allergies)
+
+    def audit(self, session=None, prescribed_by=None, today=None):
+        """``(medications checked, conflicts)`` for every active medication (no
+        end date, or one not yet past) of a patient with allergies, read in
+        one streamed pass over medications joined to patients."""
+        session = session or self.db.session
+        medications, patients = self.medication_model.__table__, self.patient_model.__table__
+        today = (today or date.today()).isoformat()
+        query = (
+            select(medications.c.id, medications.c.patientId, medications.c.name,
+                   medications.c.prescribedBy, patients.c.allergies)
+            .join(patients, patients.c.id == medications.c.patientId)
+            .where(or_(medications.c.endDate.is_(None), medications.c.endDate == '', medications.c.endDate >= today),
+                   patients.c.allergies != [])
+        )
+        if prescribed_by:
+            query = query.where(medications.c.prescribedBy == prescribed_by)
+        result = session.execute(query.execution_options(stream_results=True, max_row_buffer=2000))
+
+        checked, conflicts = 0, []
+        for row in result:
+            checked += 1
+            warnings = self.check(row.name, row.allergies)
+            if warnings:
+                conflicts.append({'medicationId': row.id, 'patientId': row.patientId, 'medication': row.name,
+                                  'prescribedBy': row.prescribedBy, 'warnings': warnings})
+        conflicts.sort(key=lambda conflict: (SEVERITIES.index(conflict['warnings'][0]['severity']),
+                                             conflict['patientId'], conflict['medication']))
+        return checked, conflicts
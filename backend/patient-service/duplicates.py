@@ -0,0 +1,304 @@
+import re
+import logging
+import unicodedata
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from sqlalchemy import bindparam, event, func, or_, select
+
+logger = logging.getLogger(__name__)
+
+# Fields compared between two patients and their share of the score
+WEIGHTS = {'firstName': 0.15, 'lastName': 0.2, 'dateOfBirth': 0.3, 'phone': 0.2, 'email': 0.1, 'address': 0.05}
+
+# Patients scoring at least this against each other are possible duplicates
+DEFAULT_THRESHOLD = 0.85
+
+# A field this similar is listed in ``matchedOn``
+MATCH_SIMILARITY = 0.9
+
+# Patients sharing a key beyond this many are not one person but a shared
+# placeholder (a clinic's phone number); such blocks are not compared
+MAX_BLOCK_SIZE = 200
+
+# Blocking key columns of the patients table
+KEY_COLUMNS = ('nameBlockKey', 'phoneBlockKey')
+
+_SOUNDEX = {letter: digit for digit, letters in
+            {'1': 'BFPV', '2': 'CGJKQSXZ', '3': 'DT', '4': 'L', '5': 'MN', '6': 'R'}.items() for letter in letters}
+
+
+def _fold(text):
+    """Upper case ASCII letters, digits and spaces: 'José-Luis ' -> 'JOSE LUIS'"""
+    text = unicodedata.normalize('NFKD', text or '').encode('ascii', 'ignore').decode('ascii').upper()
+    return ' '.join(re.sub(r'[^A-Z0-9]+', ' ', text).split())
+
+
+def soundex(name):
+    """American Soundex code of a name, e.g. Robert and Rupert -> R163; '' without letters."""
+    letters = [letter for letter in _fold(name) if 'A' <= letter <= 'Z']
+    if not letters:
+        return ''
+    code, previous = letters[0], _SOUNDEX.get(letters[0], '')
+    for letter in letters[1:]:
+        digit = _SOUNDEX.get(letter, '')
+        if digit and digit != previous:
+            code += digit
+            if len(code) == 4:
+                break
+        # H and W do not separate letters with the same code; vowels do
+        if letter not in 'HW':
+            previous = digit
+    return code.ljust(4, '0')
+
+
+def normalize_phone(phone):
+    """The last 10 digits of a phone number, without a leading 1 country code;
+    None for fewer than 7 digits."""
+    digits = re.sub(r'\D', '', phone or '')
+    if len(digits) == 11 and digits.startswith('1'):
+        digits = digits[1:]
+    return digits[-10:] if len(digits) >= 7 else None
+
+
+def blocking_keys(last_name, date_of_birth, phone):
+    """Column values that put a patient in the same blocks as their likely duplicates:
+    the Soundex of the last name with the birth date, and the normalized phone."""
+    name_code = soundex(last_name)
+    return {
+        'nameBlockKey': f'{name_code}:{date_of_birth}' if name_code and date_of_birth else None,
+        'phoneBlockKey': normalize_phone(phone),
+    }
+
+
+def jaro_winkler(a, b, prefix_scale=0.1):
+    if a == b:
+        return 1.0 if a else 0.0
+    if not a or not b:
+        return 0.0
+    window = max(max(len(a), len(b)) // 2 - 1, 0)
+    matched_b = [False] * len(b)
+    matches_a = []
+    for i, char in enumerate(a):
+        for j in range(max(0, i - window), min(len(b), i + window + 1)):
+            if not matched_b[j] and b[j] == char:
+                matched_b[j] = True
+                matches_a.append(char)
+                break
+    if not matches_a:
+        return 0.0
+    matches_b = [char for char, matched in zip(b, matched_b) if matched]
+    transpositions = sum(x != y for x, y in zip(matches_a, matches_b)) / 2
+    m = len(matches_a)
+    jaro = (m / len(a) + m / len(b) + (m - transpositions) / m) / 3
+    prefix = 0
+    for x, y in zip(a[:4], b[:4]):
+        if x != y:
+            break
+        prefix += 1
+    return jaro + prefix * prefix_scale * (1 - jaro)
+
+
+def _date_similarity(a, b):
+    if not a or not b:
+        return 0.0
+    if a == b:
+        return 1.0
+    a_parts, b_parts = a.split('-'), b.split('-')
+    if len(a_parts) != 3 or len(b_parts) != 3:
+        return 0.0
+    if a_parts[0] == b_parts[0] and a_parts[1:] == b_parts[:0:-1]:
+        return 0.8  # day and month swapped
+    if sum(x == y for x, y in zip(a_parts, b_parts)) == 2:
+        return 0.5  # one typo
+    return 0.0
+
+
+def _field_similarity(field, a, b):
+    if field == 'dateOfBirth':
+        return _date_similarity(a, b)
+    if field == 'phone':
+        a, b = normalize_phone(a), normalize_phone(b)
+        return 1.0 if a and a == b else 0.0
+    if field == 'email':
+        a, b = (a or '').lower(), (b or '').lower()
+        if a and a == b:
+            return 1.0
+        # Different addresses of one person tend to share the local part
+        return jaro_winkler(a.split('@')[0], b.split('@')[0])
+    return jaro_winkler(_fold(a), _fold(b))
+
+
+def score(a, b):
+    """``(score between 0 and 1, fields that match)`` of two patients (dicts)."""
+    total, matched = 0.0, []
+    for field, weight in WEIGHTS.items():
+        similarity = _field_similarity(field, a.get(field), b.get(field))
+        total += weight * similarity
+        if similarity >= MATCH_SIMILARITY:
+            matched.append(field)
+    return total, matched
+
+
+def score_blocks(blocks, threshold=DEFAULT_THRESHOLD):
+    """Pairs of possible duplicates within each block (a list of patient
+    dicts), as ``(older id, newer id, score, matched fields)``. Runs in scan
+    pool processes."""
+    pairs = []
+    for block in blocks:
+        block = sorted(block, key=lambda patient: (str(patient['createdAt']), patient['id']))
+        for i, a in enumerate(block):
+            for b in block[i + 1:]:
+                value, matched = score(a, b)
+                if value >= threshold:
+                    pairs.append((a['id'], b['id'], value, matched))
+    return pairs
+
+
+class DuplicateFinder:
+    """Possible duplicates of patients, found through blocking keys.
+
+    Comparing a patient with every other one does not scale, so each patient
+    carries two indexed keys (``blocking_keys()``), kept up to date on every
+    ORM insert and update. Only patients sharing a key are compared, with a
+    weighted score of name, birth date, phone, email and address similarity.
+    ``candidates()`` does this for one patient with a single indexed query;
+    ``scan()`` compares all blocks of the table in parallel processes.
+    """
+
+    def __init__(self, db, patient_model, threshold=DEFAULT_THRESHOLD, limit=5):
+        self.db = db
+        self.patient_model = patient_model
+        self.threshold = threshold
+        self.limit = limit
+        event.listen(patient_model, 'before_insert', self._set_keys)
+        event.listen(patient_model, 'before_update', self._set_keys)
+
+    @property
+    def table(self):
+        return self.patient_model.__table__
+
+    def _columns(self):
+        return [self.table.c.id, self.table.c.createdAt] + [self.table.c[field] for field in WEIGHTS]
+
+    def _set_keys(self, mapper, connection, target):
+        for column, value in blocking_keys(target.lastName, target.dateOfBirth, target.phone).items():
+            setattr(target, column, value)
+
+    def candidates(self, patient, session=None):
+        """Up to ``limit`` other patients that may be the same person, best first."""
+        session = session or self.db.session
+        keys = blocking_keys(patient.lastName, patient.dateOfBirth, patient.phone)
+        conditions = [self.table.c[column] == value for column, value in keys.items() if value]
+        if not conditions:
+            return []
+        rows = session.execute(
+            select(*self._columns()).where(or_(*conditions), self.table.c.id != patient.id).limit(MAX_BLOCK_SIZE)
+        ).mappings().all()
+        this = {field: getattr(patient, field) for field in WEIGHTS}
+        scored = []
+        for row in rows:
+            value, matched = score(this, row)
+            if value >= self.threshold:
+                scored.append({'id': row['id'], 'firstName': row['firstName'], 'lastName': row['lastName'],
+                               'dateOfBirth': row['dateOfBirth'], 'score': round(value, 3), 'matchedOn': matched})
+        scored.sort(key=lambda candidate: candidate['score'], reverse=True)
+        return scored[:self.limit]
+
+    def fill_missing_keys(self, batch_size=1000):
+        """Compute the keys of patients written without them (by Core inserts
+        from older code, or before the keys existed); returns how many."""
+        patients = self.table
+        missing = (patients.c.nameBlockKey.is_(None), patients.c.phoneBlockKey.is_(None))
+        update = patients.update().where(patients.c.id == bindparam('_id')).values(
+            nameBlockKey=bindparam('nameBlockKey'), phoneBlockKey=bindparam('phoneBlockKey'))
+        filled, last_id = 0, ''
+        while True:
+            rows = self.db.session.execute(
+                select(patients.c.id, patients.c.lastName, patients.c.dateOfBirth, patients.c.phone)
+                .where(*missing, patients.c.id > last_id).order_by(patients.c.id).limit(batch_size)
+            ).all()
+            if not rows:
+                return filled
+            values = [dict(blocking_keys(row.lastName, row.dateOfBirth, row.phone), _id=row.id) for row in rows]
+            values = [value for value in values if value['nameBlockKey'] or value['phoneBlockKey']]
+            if values:
+                self.db.session.execute(update, values)
+            self.db.session.commit()
+            filled += len(values)
+            last_id = rows[-1].id
+
+    def _blocks(self, column_name):
+        """Blocks of patients sharing a value of ``column_name``, streamed in key order."""
+        column = self.table.c[column_name]
+        shared = select(column).where(column.isnot(None)).group_by(column).having(func.count() > 1)
+        result = self.db.session.execute(
+            select(column.label('_key'), *self._columns()).where(column.in_(shared)).order_by(column, self.table.c.id)
+            .execution_options(stream_results=True, max_row_buffer=2000)
+        ).mappings()
+        block, key = [], None
+        for row in result:
+            if row['_key'] != key and block:
+                yield key, block
+                block = []
+            key = row['_key']
+            block.append({name: value for name, value in row.items() if name != '_key'})
+        if block:
+            yield key, block
+
+    def _work(self, batch_records=2000):
+        """Blocks grouped into units of about ``batch_records`` patients per pool task."""
+        unit, size = [], 0
+        for column_name in KEY_COLUMNS:
+            for key, block in self._blocks(column_name):
+                if len(block) > MAX_BLOCK_SIZE:
+                    logger.warning('Skipping %s block of %d patients', column_name, len(block))
+                    continue
+                unit.append(block)
+                size += len(block)
+                if size >= batch_records:
+                    yield unit, size
+                    unit, size = [], 0
+        if unit:
+            yield unit, size
+
+    def scan(self, processes=None, on_progress=None):
+        """Every pair of possible duplicates in the table, best first, as
+        ``{'patientId', 'duplicateId', 'score', 'matchedOn'}`` where the
+        patient is the older record of the two (the one to keep when merging).
+
+        Blocks are read with one streaming query per key and scored by
+        ``processes`` pool processes. ``on_progress(compared, pairs)`` is
+        called as units of blocks finish.
+        """
+        self.fill_missing_keys()
+        pairs, compared = {}, 0
+
+        def collect(futures):
+            nonlocal compared
+            for future in futures:
+                for keep, duplicate, value, matched in future.result():
+                    # A pair can share both keys; keep one entry
+                    if (keep, duplicate) not in pairs or pairs[(keep, duplicate)][0] < value:
+                        pairs[(keep, duplicate)] = (value, matched)
+                compared += sizes.pop(future)
+                if on_progress:
+                    on_progress(compared, len(pairs))
+
+        processes = processes or multiprocessing.cpu_count()
+        sizes = {}
+        # spawn keeps pool processes free of the parent's DB connections and threads
+        with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('spawn')) as pool:
+            for unit, size in self._work():
+                sizes[pool.submit(score_blocks, unit, self.threshold)] = size
+                # Bounded: blocks are read only as fast as they are scored
+                if len(sizes) >= processes * 2:
+                    finished, _ = wait(list(sizes), return_when=FIRST_COMPLETED)
+                    collect(finished)
+            collect(wait(list(sizes)).done)
+        self.db.session.remove()
+
+        worklist = [{'patientId': keep, 'duplicateId': duplicate, 'score': round(value, 3), 'matchedOn': matched}
+                    for (keep, duplicate), (value, matched) in pairs.items()]
+        worklist.sort(key=lambda entry: entry['score'], reverse=True)
+        return worklist
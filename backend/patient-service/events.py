@@ -0,0 +1,265 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import deque
+
+from sqlalchemy import event
+
+from changes import DELETE, CursorExpired, flushed_changes
+
+logger = logging.getLogger(__name__)
+
+# Tables whose changes can be streamed; also the SSE event names
+TOPICS = ('appointments', 'patients')
+# Sent instead of events a subscriber lost; the client should reload its data
+RESYNC = 'resync'
+# Appointment fields the stream can be filtered on, kept for deletes too
+FILTER_FIELDS = ('doctorId', 'appointmentDate')
+
+
+def subscription_options(args):
+    """Topics and filters from query parameters (``topics``, ``doctorId``,
+    ``date``); raises ValueError for unknown topics."""
+    topics = [topic.strip() for topic in (args.get('topics') or ','.join(TOPICS)).split(',') if topic.strip()]
+    unknown = set(topics) - set(TOPICS)
+    if unknown:
+        raise ValueError(f"topics must be among: {', '.join(TOPICS)}")
+    return {'topics': topics, 'doctor_id': args.get('doctorId') or None, 'date': args.get('date') or None}
+
+
+def format_event(event):
+    """One event in text/event-stream format."""
+    if event['operation'] == RESYNC:
+        return f'event: {RESYNC}\ndata: {{}}\n\n'
+    payload = {key: event[key] for key in ('seq', 'table', 'id', 'operation', 'data')}
+    event_id = f"id: {event['seq']}\n" if event['seq'] is not None else ''
+    return f"event: {event['table']}\n{event_id}data: {json.dumps(payload, default=str)}\n\n"
+
+
+class Subscription:
+    """One client's queue of events, bounded at ``max_queue``.
+
+    A slow client never holds up publishers: when its queue is full the
+    queued events are dropped and the next ``drain()`` starts with a resync
+    marker. ``wakeup`` is called after each new event (asgi.py uses it to
+    wake its event loop); threads block in ``wait()`` instead.
+    """
+
+    def __init__(self, topics=TOPICS, doctor_id=None, date=None, max_queue=100, wakeup=None):
+        self.topics = set(topics)
+        self.doctor_id = doctor_id
+        self.date = date
+        self.max_queue = max_queue
+        self.wakeup = wakeup
+        self.overflowed = False
+        self._events = deque()
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+
+    def matches(self, event):
+        if event['operation'] == RESYNC:
+            return True
+        if event['table'] not in self.topics:
+            return False
+        if event['table'] != 'appointments':
+            return True
+        # Remote deletes carry no fields; they go to every appointment subscriber
+        fields = event.get('fields')
+        if fields is None:
+            return True
+        if self.doctor_id and fields.get('doctorId') != self.doctor_id:
+            return False
+        if self.date and fields.get('appointmentDate') != self.date:
+            return False
+        return True
+
+    def push(self, event):
+        with self._lock:
+            if len(self._events) >= self.max_queue:
+                self.overflowed = True
+                self._events.clear()
+            else:
+                self._events.append(event)
+        self._ready.set()
+        if self.wakeup is not None:
+            try:
+                self.wakeup()
+            except RuntimeError:  # the subscriber's event loop is closed
+                pass
+
+    def drain(self):
+        """Queued events, oldest first."""
+        with self._lock:
+            events = list(self._events)
+            self._events.clear()
+            overflowed, self.overflowed = self.overflowed, False
+            self._ready.clear()
+        if overflowed:
+            events.insert(0, {'seq': None, 'table': None, 'operation': RESYNC})
+        return events
+
+    def wait(self, timeout):
+        self._ready.wait(timeout)
+        return self.drain()
+
+
+class EventBroker:
+    """In-process fan-out of committed changes to stream subscribers.
+
+    Writes through a tracked session are published right after they commit,
+    with the row as ``to_dict()`` returns it. Other processes (gunicorn
+    workers, job workers, CLI imports) are picked up from ``change_log``:
+    while anyone is subscribed, a poller thread reads new entries every
+    ``poll_interval`` seconds and publishes those this process has not.
+    Nothing is collected while there are no subscribers.
+    """
+
+    def __init__(self, app, db, change_tracker, models, max_queue=100, poll_interval=1.0):
+        self.app = app
+        self.db = db
+        self.change_tracker = change_tracker
+        self.table_names = {model.__tablename__ for model in models}
+        self.max_queue = max_queue
+        self.poll_interval = poll_interval
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        # Log entries already published from local commits, until the poller passes them
+        self._published = set()
+        self._cursor = None
+        self._poller = None
+        self.track(db.session)
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def track(self, target):
+        """Publish the commits of another session (class or factory), e.g. asgi.py's.
+        Must be called after ``ChangeTracker.track`` for the same target."""
+        event.listen(target, 'after_flush', self._after_flush)
+        event.listen(target, 'after_commit', self._after_commit)
+        event.listen(target, 'after_transaction_end', self._after_transaction_end)
+
+    # Subscribers
+
+    def subscribe(self, topics=TOPICS, doctor_id=None, date=None, wakeup=None):
+        subscription = Subscription(topics, doctor_id, date, self.max_queue, wakeup)
+        with self._lock:
+            self._subscribers.add(subscription)
+            if self._poller is None:
+                self._poller = threading.Thread(target=self._poll, name='event-broker-poller', daemon=True)
+                self._poller.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def publish(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            if subscription.matches(event):
+                subscription.push(event)
+
+    def replay(self, since, limit=1000):
+        """Events after log entry ``since`` (a client's Last-Event-ID), or None
+        when they are no longer all available and the client must resync."""
+        events = []
+        with self.app.app_context():
+            try:
+                while len(events) < limit:
+                    changes, since, has_more = self.change_tracker.changes_since(since, limit=500)
+                    events += [self._from_change(change) for change in changes if change['table'] in self.table_names]
+                    if not has_more:
+                        return events
+            except CursorExpired:
+                pass
+            finally:
+                self.db.session.remove()
+        return None
+
+    # Local commits
+
+    def _after_flush(self, session, flush_context):
+        if not self._subscribers:
+            return
+        pending = session.info.setdefault('pending_events', {})
+        for table_name, obj, operation in flushed_changes(session, self.table_names):
+            if operation == DELETE:
+                # Only what is still loaded: the row is gone
+                data, fields = None, {field: vars(obj).get(field) for field in FILTER_FIELDS}
+            else:
+                data = obj.to_dict()
+                fields = {field: data.get(field) for field in FILTER_FIELDS}
+            pending[(table_name, obj.id)] = {'seq': None, 'table': table_name, 'id': obj.id,
+                                             'operation': operation, 'data': data, 'fields': fields}
+        # Set by ChangeTracker.record for this flush; the poller must skip these entries
+        seqs = session.info.get('change_seqs', {})
+        with self._lock:
+            self._published.update(seqs[key] for key in pending if key in seqs)
+
+    def _after_commit(self, session):
+        pending = session.info.pop('pending_events', None)
+        if not pending:
+            return
+        seqs = session.info.get('change_seqs', {})
+        for key, event in pending.items():
+            event['seq'] = seqs.get(key)
+        for event in sorted(pending.values(), key=lambda event: event['seq'] or 0):
+            self.publish(event)
+
+    def _after_transaction_end(self, session, transaction):
+        if transaction.parent is None:
+            session.info.pop('pending_events', None)
+
+    # Other processes
+
+    def _from_change(self, change):
+        data = change['data']
+        fields = {field: data.get(field) for field in FILTER_FIELDS} if data is not None else None
+        return dict(change, fields=fields)
+
+    def _poll(self):
+        while True:
+            with self._lock:
+                if not self._subscribers:
+                    # Start from the end of the log again when the next client subscribes
+                    self._poller = self._cursor = None
+                    self._published.clear()
+                    return
+            try:
+                with self.app.app_context():
+                    self._poll_once()
+            except Exception:
+                logger.exception('Reading the change log for event subscribers failed')
+            finally:
+                self.db.session.remove()
+            time.sleep(self.poll_interval)
+
+    def _poll_once(self):
+        if self._cursor is None:
+            self._cursor = self.change_tracker.latest_cursor()
+            return
+        has_more = True
+        while has_more:
+            try:
+                changes, cursor, has_more = self.change_tracker.changes_since(self._cursor, limit=500)
+            except CursorExpired:
+                self._cursor = self.change_tracker.latest_cursor()
+                self.publish({'seq': None, 'table': None, 'operation': RESYNC, 'fields': None})
+                return
+            with self._lock:
+                published = self._published
+                self._published = {seq for seq in published if seq > cursor}
+            for change in changes:
+                if change['table'] in self.table_names and change['seq'] not in published:
+                    self.publish(self._from_change(change))
+            self._cursor = cursor
+
+    def _after_fork(self):
+        # The parent's poller thread and subscribers do not exist in the child
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._published = set()
+        self._cursor = self._poller = None
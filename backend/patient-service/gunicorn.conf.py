@@ -0,0 +1,123 @@
+"""Production gunicorn profile: ``gunicorn -c gunicorn.conf.py wsgi:app``.
+
+The app is imported once in the master (``preload_app``) so workers share
+its memory copy-on-write. The master checks the schema and warms caches
+before any worker forks; each worker then drops the database connections
+and storage clients it inherited.
+
+| Variable               | Default          | Meaning                                   |
+|------------------------|------------------|-------------------------------------------|
+| PORT                   | 3001             | Port to bind on all interfaces            |
+| WEB_CONCURRENCY        | CPU count + 1    | Worker processes                          |
+| GUNICORN_WORKER_CLASS  | gthread          | ``sync`` for one request per worker       |
+| GUNICORN_THREADS       | 4                | Threads per gthread worker                |
+| GUNICORN_TIMEOUT       | 60               | Seconds before a silent worker is killed  |
+| GUNICORN_MAX_REQUESTS  | 0 (disabled)     | Recycle workers after this many requests  |
+| GUNICORN_WARMUP        | true             | Run warm-up requests in the master        |
+"""
+import os
+import shutil
+import tempfile
+import multiprocessing
+
+# Workers share one metrics directory and one profile directory, scoped to this master
+os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), f'patient-service-metrics-{os.getpid()}'))
+os.environ.setdefault('PROFILER_DIR', os.path.join(tempfile.gettempdir(), f'patient-service-profiles-{os.getpid()}'))
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '3001')}"
+preload_app = True
+
+_cpus = multiprocessing.cpu_count()
+workers = int(os.environ.get('WEB_CONCURRENCY', _cpus + 1))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+# Threads overlap I/O waits (database, S3) inside each worker
+threads = int(os.environ.get('GUNICORN_THREADS', 4)) if worker_class == 'gthread' else 1
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = 30
+keepalive = 5
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = max_requests // 10
+
+accesslog = '-'
+errorlog = '-'
+
+# Read-only requests that touch the ORM mappers, the SQL compilation cache
+# and the GraphQL schema, so workers start with them already built
+WARMUP_PATHS = [
+    '/health',
+    '/api/patients?per_page=1',
+    '/api/appointments?per_page=1',
+    '/api/medications?per_page=1',
+    '/api/medical-records?per_page=1',
+]
+
+
+def on_starting(server):
+    # Runs once in the master; the app is already preloaded at this point
+    from app import app, db, partitions
+
+    # Counters and profiles from a previous run of this master must not leak into this one
+    shutil.rmtree(os.environ['METRICS_DIR'], ignore_errors=True)
+    shutil.rmtree(os.environ['PROFILER_DIR'], ignore_errors=True)
+
+    with app.app_context():
+        # The schema is Alembic's alone: create_all() here would create new
+        # tables (unpartitioned, on PostgreSQL) that `flask db upgrade` then
+        # fails on
+        _check_migrations(server, app, db)
+        try:
+            created = partitions.ensure_future_partitions()
+            if created:
+                server.log.info('Created partitions: %s', ', '.join(created))
+        except Exception as e:
+            server.log.warning('Creating future partitions failed: %s', e)
+    # Nothing opened here may be inherited by the workers
+    db.dispose_engines()
+
+
+def _check_migrations(server, app, db):
+    from alembic.migration import MigrationContext
+    from alembic.script import ScriptDirectory
+
+    directory = os.path.join(app.root_path, 'migrations')
+    if not os.path.isdir(directory):
+        return
+    heads = set(ScriptDirectory(directory).get_heads())
+    with db.engine.connect() as connection:
+        current = set(MigrationContext.configure(connection).get_current_heads())
+    if not current:
+        # No tables to serve from; a database created without migrations
+        # needs 'flask db stamp <revision>' first
+        raise RuntimeError("Database has no schema revision; run 'flask db upgrade' before starting the server")
+    if current != heads:
+        server.log.warning(
+            "Database schema is at revision %s but the code expects %s; run 'flask db upgrade'",
+            ', '.join(sorted(current)) or 'none', ', '.join(sorted(heads))
+        )
+
+
+def when_ready(server):
+    if os.environ.get('GUNICORN_WARMUP', 'true').lower() != 'true':
+        return
+    from app import app, db, metrics
+
+    client = app.test_client()
+    for path in WARMUP_PATHS:
+        try:
+            response = client.get(path)
+            server.log.info('Warm-up %s -> %s', path, response.status_code)
+        except Exception as e:
+            server.log.warning('Warm-up %s failed: %s', path, e)
+    client.post('/graphql', json={'query': '{ __typename }'})
+    db.dispose_engines()
+    # Warm-up requests are not traffic
+    metrics.reset()
+
+
+def post_fork(server, worker):
+    from app import db, storage, metrics
+
+    # Fork safety: forget the master's pooled connections and S3 clients
+    db.dispose_engines_after_fork()
+    storage.reset()
+    metrics.reset()
@@ -0,0 +1,125 @@
+import io
+import csv
+import json
+
+from sqlalchemy import func
+
+from jobs import job_handler
+from app import db, duplicate_finder, Patient, Appointment, Medication, MedicalRecord
+
+# Tables that can be exported, with their models
+EXPORT_TABLES = {
+    'patients': Patient,
+    'appointments': Appointment,
+    'medications': Medication,
+    'medical_records': MedicalRecord,
+}
+EXPORT_FORMATS = ('csv', 'ndjson')
+EXPORT_PAGE_SIZE = 1000
+
+
+def _pages(model, page_size=EXPORT_PAGE_SIZE):
+    # Keyset pagination on the primary key: every page is an index range scan,
+    # unlike OFFSET which re-reads all earlier rows
+    last_id = None
+    while True:
+        query = model.query.order_by(model.id)
+        if last_id is not None:
+            query = query.filter(model.id > last_id)
+        rows = query.limit(page_size).all()
+        if not rows:
+            return
+        last_id = rows[-1].id
+        yield [row.to_dict() for row in rows]
+        # Drop the loaded objects so memory stays flat on large tables
+        db.session.expunge_all()
+
+
+def _csv_value(value):
+    # Lists are written as "a; b", the form bulk imports read back
+    if isinstance(value, list):
+        return '; '.join(str(item) for item in value)
+    return value
+
+
+# Export a whole table to a CSV or NDJSON file
+@job_handler('export')
+def export_table(context, params):
+    table = params.get('table', 'patients')
+    fmt = params.get('format', 'csv')
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"table must be one of: {', '.join(EXPORT_TABLES)}")
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"format must be one of: {', '.join(EXPORT_FORMATS)}")
+
+    model = EXPORT_TABLES[table]
+    total = model.query.count()
+    exported = 0
+    context.progress(0.0, f'Exporting {total} {table}', force=True)
+
+    with context.temporary_file() as output:
+        text = io.TextIOWrapper(output, encoding='utf-8', newline='')
+        writer = None
+        for page in _pages(model):
+            if fmt == 'csv':
+                if writer is None:
+                    writer = csv.DictWriter(text, fieldnames=list(page[0]))
+                    writer.writeheader()
+                writer.writerows({key: _csv_value(value) for key, value in row.items()} for row in page)
+            else:
+                for row in page:
+                    text.write(json.dumps(row) + '\n')
+            exported += len(page)
+            context.progress(exported / total if total else 1.0, f'Exported {exported} of {total} {table}')
+        text.flush()
+
+        content_type = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+        context.save_result(output, f'{table}.{fmt}', content_type=content_type)
+        text.detach()
+
+
+# Worklist of possible duplicate patients, compared in parallel processes
+@job_handler('duplicates-scan')
+def duplicates_scan(context, params):
+    context.progress(0.0, 'Comparing patients', force=True)
+    worklist = duplicate_finder.scan(
+        processes=params.get('processes'),
+        on_progress=lambda compared, pairs: context.progress(0.0, f'Compared {compared} patients, {pairs} possible duplicates')
+    )
+    context.progress(0.99, f'Writing {len(worklist)} pairs', force=True)
+
+    with context.temporary_file() as output:
+        text = io.TextIOWrapper(output, encoding='utf-8', newline='')
+        writer = csv.writer(text)
+        writer.writerow(['patientId', 'duplicateId', 'score', 'matchedOn'])
+        writer.writerows([entry['patientId'], entry['duplicateId'], entry['score'], ' '.join(entry['matchedOn'])]
+                         for entry in worklist)
+        text.flush()
+        context.save_result(output, 'duplicates.csv', content_type='text/csv')
+        text.detach()
+
+
+# Appointment counts per month, status and doctor
+@job_handler('appointments-report')
+def appointments_report(context, params):
+    date_from, date_to = params.get('from'), params.get('to')
+    month = func.substr(Appointment.appointmentDate, 1, 7)  # YYYY-MM
+
+    query = db.session.query(month, Appointment.status, Appointment.doctorId, func.count(Appointment.id))
+    if date_from:
+        query = query.filter(Appointment.appointmentDate >= date_from)
+    if date_to:
+        query = query.filter(Appointment.appointmentDate <= date_to)
+    context.progress(0.1, 'Counting appointments', force=True)
+    rows = query.group_by(month, Appointment.status, Appointment.doctorId).all()
+
+    report = {'from': date_from, 'to': date_to, 'total': 0, 'months': {}}
+    for month_key, status, doctor_id, count in rows:
+        entry = report['months'].setdefault(month_key, {'total': 0, 'byStatus': {}, 'byDoctor': {}})
+        entry['total'] += count
+        entry['byStatus'][status] = entry['byStatus'].get(status, 0) + count
+        entry['byDoctor'][doctor_id] = entry['byDoctor'].get(doctor_id, 0) + count
+        report['total'] += count
+
+    context.save_result(json.dumps(report, indent=2).encode('utf-8'), 'appointments-report.json',
+                        content_type='application/json')
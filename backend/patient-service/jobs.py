@@ -0,0 +1,300 @@
+import os
+import time
+import signal
+import socket
+import logging
+import tempfile
+import threading
+import traceback
+import multiprocessing
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+logger = logging.getLogger(__name__)
+
+# Job states. A job goes queued -> running -> succeeded | failed | canceled;
+# a failed attempt goes back to queued until it has used up maxAttempts.
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELED = 'queued', 'running', 'succeeded', 'failed', 'canceled'
+FINISHED = (SUCCEEDED, FAILED, CANCELED)
+
+# Dialects with row locks that support SKIP LOCKED
+SKIP_LOCKED_DIALECTS = ('postgresql', 'mysql', 'mariadb')
+
+# kind -> handler(context, params)
+HANDLERS = {}
+
+
+def job_handler(kind):
+    """Register ``func(context, params)`` as the handler for jobs of ``kind``."""
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+    return register
+
+
+class JobCanceled(Exception):
+    """Raised inside a handler once its job was canceled or taken over by another worker."""
+
+
+class JobContext:
+    """What a handler gets: its params, progress reporting and result storage."""
+
+    def __init__(self, queue, job_id, worker_id, params):
+        self.queue = queue
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.params = params
+        self.canceled = threading.Event()
+        self.result = None
+        self._last_progress = 0.0
+
+    def progress(self, fraction, message=None, force=False):
+        """Record progress (0.0-1.0). Writes are throttled to one per
+        ``progress_interval`` seconds; raises JobCanceled if the job was canceled."""
+        if self.canceled.is_set():
+            raise JobCanceled()
+        now = time.monotonic()
+        if not force and now - self._last_progress < self.queue.progress_interval:
+            return
+        self._last_progress = now
+        values = {'progress': max(0.0, min(1.0, fraction))}
+        if message is not None:
+            values['progressMessage'] = message[:200]
+        if not self.queue.touch(self.job_id, self.worker_id, **values):
+            self.canceled.set()
+            raise JobCanceled()
+
+    def save_result(self, data, filename, content_type='application/octet-stream'):
+        """Store the job's result file (bytes or a binary file object) on the storage backend."""
+        key = f'job-results/{self.job_id}/{filename}'
+        if isinstance(data, (bytes, bytearray)):
+            size = len(data)
+        else:
+            data.seek(0, os.SEEK_END)
+            size = data.tell()
+            data.seek(0)
+        self.queue.storage.save(key, data, content_type=content_type)
+        self.result = {'resultKey': key, 'resultName': filename, 'resultContentType': content_type, 'resultSize': size}
+        return key
+
+    def temporary_file(self):
+        """A scratch file for building large results without holding them in memory."""
+        return tempfile.TemporaryFile(prefix=f'job-{self.job_id}-')
+
+
+class JobQueue:
+    """Persistent job queue on the ``jobs`` table.
+
+    Workers claim the oldest queued job with ``SELECT ... FOR UPDATE SKIP
+    LOCKED`` where the database supports it, so concurrent workers never wait
+    on each other. SQLite has no row locks; there a job is claimed with a
+    conditional ``UPDATE ... WHERE status = 'queued'`` and a worker that loses
+    the race moves on to the next candidate.
+
+    While a job runs, a heartbeat thread refreshes ``heartbeatAt``. Jobs
+    whose worker died (no heartbeat for ``stale_seconds``) are queued again.
+    """
+
+    def __init__(self, db, job_model, storage, heartbeat_interval=10.0, stale_seconds=120.0, progress_interval=1.0):
+        self.db = db
+        self.job_model = job_model
+        self.storage = storage
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_seconds = stale_seconds
+        self.progress_interval = progress_interval
+
+    @property
+    def table(self):
+        return self.job_model.__table__
+
+    @property
+    def engine(self):
+        return self.db.engine
+
+    def submit(self, kind, params=None, created_by=None, max_attempts=3):
+        if kind not in HANDLERS:
+            raise ValueError(f"Unknown job kind '{kind}'; use one of: {', '.join(sorted(HANDLERS))}")
+        job = self.job_model(kind=kind, params=params or {}, status=QUEUED, createdBy=created_by, maxAttempts=max_attempts)
+        self.db.session.add(job)
+        self.db.session.commit()
+        return job
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job; a running handler stops at its next progress call."""
+        jobs = self.table
+        with self.engine.begin() as connection:
+            result = connection.execute(
+                jobs.update()
+                .where(jobs.c.id == job_id, jobs.c.status.in_((QUEUED, RUNNING)))
+                .values(status=CANCELED, finishedAt=datetime.utcnow())
+            )
+        return result.rowcount == 1
+
+    # Claiming
+
+    def claim(self, worker_id):
+        """Mark the oldest queued job as running for ``worker_id``; return its id or None."""
+        jobs = self.table
+        claimed = {
+            'status': RUNNING, 'workerId': worker_id, 'startedAt': datetime.utcnow(),
+            'heartbeatAt': datetime.utcnow(), 'attempts': jobs.c.attempts + 1,
+        }
+        oldest = select(jobs.c.id).where(jobs.c.status == QUEUED).order_by(jobs.c.createdAt)
+
+        if self.engine.dialect.name in SKIP_LOCKED_DIALECTS:
+            with self.engine.begin() as connection:
+                job_id = connection.execute(oldest.limit(1).with_for_update(skip_locked=True)).scalar()
+                if job_id is not None:
+                    connection.execute(jobs.update().where(jobs.c.id == job_id).values(**claimed))
+                return job_id
+
+        with self.engine.connect() as connection:
+            candidates = connection.execute(oldest.limit(5)).scalars().all()
+        for job_id in candidates:
+            with self.engine.begin() as connection:
+                result = connection.execute(
+                    jobs.update().where(jobs.c.id == job_id, jobs.c.status == QUEUED).values(**claimed)
+                )
+            if result.rowcount == 1:
+                return job_id
+        return None
+
+    def touch(self, job_id, worker_id, **values):
+        """Heartbeat (plus any progress values); False once the job is no longer ours."""
+        jobs = self.table
+        with self.engine.begin() as connection:
+            result = connection.execute(
+                jobs.update()
+                .where(jobs.c.id == job_id, jobs.c.workerId == worker_id, jobs.c.status == RUNNING)
+                .values(heartbeatAt=datetime.utcnow(), **values)
+            )
+        return result.rowcount == 1
+
+    def _finish(self, job_id, worker_id, **values):
+        self.touch(job_id, worker_id, finishedAt=datetime.utcnow(), **values)
+
+    def requeue_stale(self):
+        """Requeue jobs whose worker stopped sending heartbeats, or fail them
+        when they have no attempts left. Returns the number of jobs touched."""
+        jobs = self.table
+        cutoff = datetime.utcnow() - timedelta(seconds=self.stale_seconds)
+        stale = (jobs.c.status == RUNNING) & (jobs.c.heartbeatAt < cutoff)
+        with self.engine.begin() as connection:
+            requeued = connection.execute(
+                jobs.update().where(stale, jobs.c.attempts < jobs.c.maxAttempts)
+                .values(status=QUEUED, workerId=None)
+            ).rowcount
+            failed = connection.execute(
+                jobs.update().where(stale, jobs.c.attempts >= jobs.c.maxAttempts)
+                .values(status=FAILED, error='Worker stopped responding', finishedAt=datetime.utcnow())
+            ).rowcount
+        return requeued + failed
+
+    # Running
+
+    def run_one(self, worker_id):
+        """Claim and run one job. Returns False when the queue was empty."""
+        job_id = self.claim(worker_id)
+        if job_id is None:
+            return False
+
+        job = self.db.session.get(self.job_model, job_id)
+        kind, params, attempts, max_attempts = job.kind, job.params or {}, job.attempts, job.maxAttempts
+        self.db.session.remove()
+
+        context = JobContext(self, job_id, worker_id, params)
+        stop_heartbeat = threading.Event()
+        heartbeat = threading.Thread(
+            target=self._heartbeat, args=(context, stop_heartbeat), name=f'job-heartbeat-{job_id}', daemon=True
+        )
+        heartbeat.start()
+        started = time.perf_counter()
+        try:
+            handler = HANDLERS.get(kind)
+            if handler is None:
+                raise ValueError(f"No handler registered for job kind '{kind}'")
+            handler(context, params)
+        except JobCanceled:
+            logger.info('Job %s (%s) canceled', job_id, kind)
+        except Exception as e:
+            logger.exception('Job %s (%s) failed on attempt %d', job_id, kind, attempts)
+            error = ''.join(traceback.format_exception_only(type(e), e)).strip()[:2000]
+            if attempts < max_attempts:
+                self.touch(job_id, worker_id, status=QUEUED, workerId=None, error=error)
+            else:
+                self._finish(job_id, worker_id, status=FAILED, error=error)
+        else:
+            logger.info('Job %s (%s) succeeded in %.1fs', job_id, kind, time.perf_counter() - started)
+            self._finish(job_id, worker_id, status=SUCCEEDED, progress=1.0, error=None, **(context.result or {}))
+        finally:
+            stop_heartbeat.set()
+            heartbeat.join()
+            self.db.session.remove()
+        return True
+
+    def _heartbeat(self, context, stop):
+        while not stop.wait(self.heartbeat_interval):
+            try:
+                if not self.touch(context.job_id, context.worker_id):
+                    context.canceled.set()
+                    return
+            except Exception:
+                logger.exception('Heartbeat for job %s failed', context.job_id)
+
+    def work(self, worker_id, stop, poll_interval=2.0, burst=False):
+        """Run jobs until ``stop`` is set (or, with ``burst``, until the queue is empty)."""
+        next_reclaim = 0.0
+        while not stop.is_set():
+            if time.monotonic() >= next_reclaim:
+                requeued = self.requeue_stale()
+                if requeued:
+                    logger.warning('Requeued or failed %d stale jobs', requeued)
+                next_reclaim = time.monotonic() + self.stale_seconds / 4
+            try:
+                ran = self.run_one(worker_id)
+            except Exception:
+                # e.g. the database is unreachable; back off and retry
+                logger.exception('Worker %s could not claim a job', worker_id)
+                ran = False
+            if not ran:
+                if burst:
+                    return
+                stop.wait(poll_interval)
+
+
+def _worker_process(index, poll_interval, burst):
+    from app import app, job_queue
+    import job_handlers  # noqa: F401 - registers the handlers
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    worker_id = f'{socket.gethostname()}:{os.getpid()}'
+    logger.info('Job worker %s started', worker_id)
+    with app.app_context():
+        job_queue.work(worker_id, stop, poll_interval=poll_interval, burst=burst)
+
+
+def run_workers(processes, poll_interval=2.0, burst=False):
+    """Run ``processes`` worker processes until SIGTERM/SIGINT. A worker
+    finishes its current job before exiting."""
+    if processes <= 1:
+        _worker_process(0, poll_interval, burst)
+        return
+
+    # spawn keeps workers free of the parent's DB connections and threads
+    context = multiprocessing.get_context('spawn')
+    workers = [context.Process(target=_worker_process, args=(i, poll_interval, burst), name=f'job-worker-{i}')
+               for i in range(processes)]
+    for worker in workers:
+        worker.start()
+
+    def forward(signum, frame):
+        for worker in workers:
+            if worker.is_alive():
+                os.kill(worker.pid, signal.SIGTERM)
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+    for worker in workers:
+        worker.join()
@@ -0,0 +1,201 @@
+import os
+import re
+import sys
+import json
+import queue
+import random
+import atexit
+import logging
+import logging.handlers
+from datetime import datetime, timezone
+
+from flask import g, has_request_context, request
+
+# Extra fields holding patient data; their values never reach the log output
+REDACTED_FIELDS = frozenset({
+    'firstName', 'lastName', 'dateOfBirth', 'email', 'phone', 'address', 'insuranceId',
+    'medicalConditions', 'allergies', 'notes', 'diagnosis', 'chiefComplaint', 'treatmentPlan',
+    'password', 'authorization', 'cookie', 'x-user-id', 'headers', 'body',
+})
+REDACTED = '[REDACTED]'
+
+# Third-party loggers that are too chatty below WARNING
+QUIET_LOGGERS = ('botocore', 'boto3', 's3transfer', 'urllib3', 'PIL')
+
+# PHI that slips into message text
+_TEXT_PATTERNS = (
+    re.compile(r'[\w.+-]+@[\w-]+(?:\.[\w-]+)+'),                # email addresses
+    re.compile(r'\b\d{3}-\d{2}-\d{4}\b'),                       # SSNs
+    re.compile(r'(?<!\d)(?:\+?1[ .-]?)?\(?\d{3}\)?[ .-]\d{3}[ .-]\d{4}(?!\d)'),  # phone numbers
+)
+
+# Attributes every LogRecord has; anything else came from ``extra=``
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+
+def redact_text(text):
+    for pattern in _TEXT_PATTERNS:
+        text = pattern.sub(REDACTED, text)
+    return text
+
+
+def redact(value, fields=REDACTED_FIELDS):
+    """Copy of ``value`` with the values of PHI keys replaced, at any depth."""
+    if isinstance(value, dict):
+        return {key: REDACTED if str(key).lower() in fields or key in fields else redact(item, fields)
+                for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(item, fields) for item in value]
+    if isinstance(value, str):
+        return redact_text(value)
+    return value
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: timestamp, level, logger, message, the request's
+    method and route, and any ``extra=`` fields, with patient data redacted."""
+
+    def __init__(self, redact_fields=REDACTED_FIELDS):
+        super().__init__()
+        self.redact_fields = redact_fields
+
+    def format(self, record):
+        entry = {
+            'timestamp': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': redact_text(record.getMessage()),
+            'process': record.process,
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = REDACTED if key in self.redact_fields else redact(value, self.redact_fields)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Plain text for local development; message text is still redacted."""
+
+    def format(self, record):
+        return redact_text(super().format(record))
+
+
+class RouteSampler(logging.Filter):
+    """Keep a share of the DEBUG/INFO records logged while handling a request.
+
+    ``rates`` maps ``'METHOD /route'``, ``'/route'`` (Flask rule, e.g.
+    ``/api/patients/<string:id>``) or ``'*'`` to a rate between 0 and 1. The
+    decision is made once per request, so a request's records are kept or
+    dropped together. Warnings and errors are always kept. Also attaches the
+    request's method and route to each record.
+    """
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+
+    def rate_for(self, method, route):
+        for key in (f'{method} {route}', route, '*'):
+            if key in self.rates:
+                return self.rates[key]
+        return 1.0
+
+    def filter(self, record):
+        if not has_request_context():
+            return True
+        route = request.url_rule.rule if request.url_rule else request.path
+        record.method, record.route = request.method, route
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        sampled = g.get('_log_sampled')
+        if sampled is None:
+            rate = self.rate_for(request.method, route)
+            sampled = g._log_sampled = rate >= 1.0 or random.random() < rate
+        return sampled
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    # The stock handler formats the whole record on the calling thread. Only
+    # merge the message arguments here (so later changes to them don't show up
+    # in the log); JSON encoding, redaction and tracebacks happen on the listener.
+    def prepare(self, record):
+        record = logging.makeLogRecord(vars(record))
+        record.msg, record.args = record.getMessage(), None
+        return record
+
+
+def parse_sample_rates(value):
+    """``'GET /api/patients=0.1,/health=0'`` -> ``{'GET /api/patients': 0.1, '/health': 0.0}``"""
+    rates = {}
+    for item in (value or '').split(','):
+        if '=' in item:
+            key, rate = item.rsplit('=', 1)
+            rates[key.strip()] = max(0.0, min(1.0, float(rate)))
+    return rates
+
+
+class LogPipeline:
+    """Root logging through a queue: callers only enqueue records, and a
+    listener thread formats and writes them, so log I/O never blocks a request.
+    Restarted in forked children (gunicorn workers), which do not inherit the thread."""
+
+    def __init__(self, level='INFO', fmt='json', sample_rates=None, stream=None):
+        if fmt == 'json':
+            formatter = JsonFormatter()
+        else:
+            formatter = TextFormatter('%(asctime)s %(levelname)s [%(name)s] %(message)s')
+        self.output = logging.StreamHandler(stream or sys.stderr)
+        self.output.setFormatter(formatter)
+        self.handler = _QueueHandler(queue.SimpleQueue())
+        self.handler.addFilter(RouteSampler(sample_rates or {}))
+        self.level = level
+        self.listener = None
+
+    def install(self, app=None):
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(self.handler)
+        root.setLevel(self.level)
+        for name in QUIET_LOGGERS:
+            logging.getLogger(name).setLevel(logging.WARNING)
+        if app is not None:
+            # Flask's own handler would write app.logger records a second time
+            from flask.logging import default_handler
+            app.logger.removeHandler(default_handler)
+        self.start()
+        atexit.register(self.stop)
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def start(self):
+        self.listener = logging.handlers.QueueListener(self.handler.queue, self.output, respect_handler_level=True)
+        self.listener.start()
+
+    def stop(self):
+        if self.listener is not None:
+            self.listener.stop()  # drains the queue first
+            self.listener = None
+
+    def _after_fork(self):
+        # The parent's listener thread does not exist here, and its queue may
+        # have been locked mid-operation when the fork happened
+        self.handler.queue = queue.SimpleQueue()
+        self.listener = None
+        self.start()
+
+
+def configure_logging(app=None, level=None, fmt=None, sample_rates=None):
+    """Install the logging pipeline from LOG_LEVEL, LOG_FORMAT (json or text)
+    and LOG_SAMPLE_RATES unless given explicitly."""
+    pipeline = LogPipeline(
+        level=(level or os.environ.get('LOG_LEVEL', 'INFO')).upper(),
+        fmt=fmt or os.environ.get('LOG_FORMAT', 'json'),
+        sample_rates=sample_rates if sample_rates is not None else parse_sample_rates(os.environ.get('LOG_SAMPLE_RATES')),
+    )
+    pipeline.install(app)
+    return pipeline
@@ -0,0 +1,94 @@
+import json
+from datetime import datetime
+
+from sqlalchemy import select
+
+from changes import UPDATE
+
+# Patient fields taken from the merged patient when the kept one has none
+FILLED_FIELDS = ('insuranceId', 'profileImageUrl', 'externalId')
+# JSON list fields combined from both patients
+LIST_FIELDS = ('medicalConditions', 'allergies')
+
+
+def merge_lists(kept, merged):
+    """``kept`` followed by the items of ``merged`` it lacks (strings compared case-insensitively)."""
+    def key(item):
+        return item.strip().lower() if isinstance(item, str) else json.dumps(item, sort_keys=True)
+
+    seen = {key(item) for item in kept or []}
+    result = list(kept or [])
+    for item in merged or []:
+        if key(item) not in seen:
+            seen.add(key(item))
+            result.append(item)
+    return result
+
+
+class PatientMerger:
+    """Merges a duplicate patient (the source) into the patient to keep (the target).
+
+    The source's child rows are re-parented with one set-based UPDATE per
+    table instead of being loaded and saved one by one, so a patient with
+    years of history merges in a handful of statements. Those UPDATEs bypass
+    the ORM flush, so their change log entries and webhook events are
+    recorded explicitly. The two patients' lists and empty fields are
+    combined, the source is deleted, and an audit row keeps its last state.
+
+    Runs in the caller's transaction; the caller commits.
+    """
+
+    def __init__(self, db, audit_model, child_models, change_tracker, outbox):
+        self.db = db
+        self.audit_model = audit_model
+        self.child_models = child_models
+        self.change_tracker = change_tracker
+        self.outbox = outbox
+
+    def merge(self, target, source, merged_by=None):
+        session = self.db.session
+        now = datetime.utcnow()
+        snapshot = source.to_dict()
+
+        moved, changes = {}, []
+        for model in self.child_models:
+            table = model.__table__
+            ids = session.execute(select(table.c.id).where(table.c.patientId == source.id)).scalars().all()
+            moved[table.name] = len(ids)
+            if not ids:
+                continue
+            values = {'patientId': target.id}
+            if 'updatedAt' in table.c:
+                values['updatedAt'] = now
+            session.execute(table.update().where(table.c.patientId == source.id).values(**values))
+            if table.name in self.change_tracker.models:
+                changes += [(table.name, id, UPDATE) for id in ids]
+            if table.name in self.outbox.event_names and self.outbox.destinations:
+                rows = model.query.filter(model.id.in_(ids)).populate_existing()
+                self.outbox.record_changes(session, [(table.name, row, UPDATE) for row in rows])
+        if changes:
+            self.change_tracker.record(session, changes)
+
+        # Deleted first: the target may take over its unique externalId
+        session.delete(source)
+        session.flush()
+
+        for field in LIST_FIELDS:
+            setattr(target, field, merge_lists(getattr(target, field), snapshot[field]))
+        for field in FILLED_FIELDS:
+            if not getattr(target, field) and snapshot.get(field):
+                setattr(target, field, snapshot[field])
+        if snapshot.get('notes') and snapshot['notes'] not in (target.notes or ''):
+            target.notes = f"{target.notes}\n\n{snapshot['notes']}" if target.notes else snapshot['notes']
+
+        merge = self.audit_model(
+            targetPatientId=target.id,
+            sourcePatientId=source.id,
+            sourceSnapshot=snapshot,
+            movedRows=moved,
+            mergedBy=merged_by,
+            mergedAt=now,
+        )
+        session.add(merge)
+        session.flush()
+        return merge
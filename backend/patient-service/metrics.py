@@ -0,0 +1,344 @@
+import os
+import json
+import time
+import bisect
+import logging
+import tempfile
+import threading
+
+from flask import g, request
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process deployments only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Histogram bucket upper bounds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+UNMATCHED_ROUTE = '<unmatched>'
+ARCHIVE_FILE = 'archive.json'
+
+
+class _Shard:
+    """One thread's private counters. Only its owner thread writes to it."""
+
+    def __init__(self):
+        self.requests = {}    # (route, method, status) -> count
+        self.durations = {}   # (route, method) -> [bucket counts, sum, count]
+        self.sizes = {}       # (route, method) -> [bucket counts, sum, count]
+        self.in_flight = {}   # (route, method) -> gauge
+
+
+def _observe(histograms, key, buckets, value):
+    histogram = histograms.get(key)
+    if histogram is None:
+        histogram = histograms[key] = [[0] * (len(buckets) + 1), 0.0, 0]
+    histogram[0][bisect.bisect_left(buckets, value)] += 1
+    histogram[1] += value
+    histogram[2] += 1
+
+
+class RequestMetrics:
+    """Per-route request metrics, exposed in Prometheus text format.
+
+    Requests are recorded into per-thread shards, so the hot path takes no
+    locks; shards are only merged when metrics are read. With ``directory``
+    set (one per gunicorn master), each worker periodically writes its
+    snapshot to ``worker-<pid>.json`` and ``/metrics`` merges every worker's
+    file, so any worker can answer a scrape for the whole server. Counters
+    of workers that exited are folded into ``archive.json`` so totals never
+    go backwards.
+    """
+
+    def __init__(self, app=None, directory=None, flush_interval=5.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()
+        self._flusher_pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+    # Recording
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = _Shard()
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def _before_request(self):
+        route = request.url_rule.rule if request.url_rule else UNMATCHED_ROUTE
+        key = (route, request.method)
+        self._ensure_flusher()
+        shard = self._shard()
+        shard.in_flight[key] = shard.in_flight.get(key, 0) + 1
+        g.metrics_key = key
+        g.metrics_started = time.perf_counter()
+
+    def _after_request(self, response):
+        key = g.pop('metrics_key', None)
+        if key is not None:
+            # Streamed bodies (generators) are not buffered just to be measured
+            size = (response.content_length if response.is_streamed else response.calculate_content_length()) or 0
+            self.observe(key[0], key[1], response.status_code, time.perf_counter() - g.metrics_started, size)
+            self._shard().in_flight[key] -= 1
+        return response
+
+    def _teardown_request(self, exc):
+        # after_request did not run (the request failed before a response existed)
+        key = g.pop('metrics_key', None)
+        if key is not None:
+            self.observe(key[0], key[1], 500, time.perf_counter() - g.metrics_started, 0)
+            self._shard().in_flight[key] -= 1
+
+    def observe(self, route, method, status, seconds, size):
+        shard = self._shard()
+        key = (route, method, str(status))
+        shard.requests[key] = shard.requests.get(key, 0) + 1
+        _observe(shard.durations, (route, method), LATENCY_BUCKETS, seconds)
+        _observe(shard.sizes, (route, method), SIZE_BUCKETS, size)
+
+    def reset(self):
+        """Forget everything recorded so far, e.g. warm-up requests inherited from the gunicorn master."""
+        with self._lock:
+            self._shards = []
+        self._local = threading.local()
+        self._flusher_pid = None
+        if self.directory:
+            try:
+                os.unlink(os.path.join(self.directory, f'worker-{os.getpid()}.json'))
+            except FileNotFoundError:
+                pass
+
+    # Snapshots
+
+    def snapshot(self):
+        """Merge this process's shards into a JSON-serializable dict."""
+        with self._lock:
+            shards = list(self._shards)
+        merged = _Merged()
+        for shard in shards:
+            # dict() copies are atomic under the GIL, so writers are never blocked
+            merged.add_requests(dict(shard.requests).items())
+            merged.add_histograms(merged.durations, dict(shard.durations).items())
+            merged.add_histograms(merged.sizes, dict(shard.sizes).items())
+            merged.add_in_flight(dict(shard.in_flight).items())
+        return merged.to_json(os.getpid())
+
+    def _ensure_flusher(self):
+        if not self.directory or self._flusher_pid == os.getpid():
+            return
+        self._flusher_pid = os.getpid()
+        thread = threading.Thread(target=self._flush_forever, name='metrics-flush', daemon=True)
+        thread.start()
+
+    def _flush_forever(self):
+        pid = os.getpid()
+        while True:
+            time.sleep(self.flush_interval)
+            if self._flusher_pid != pid:
+                return
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Failed to write metrics snapshot')
+
+    def flush(self):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f'worker-{os.getpid()}.json')
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.worker-')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, path)
+
+    def _collect(self):
+        """Snapshots of every live worker plus the archive of exited ones,
+        and the number of live workers."""
+        self.flush()
+        with _DirectoryLock(self.directory):
+            archive_path = os.path.join(self.directory, ARCHIVE_FILE)
+            archive = _Merged.from_json(_read_json(archive_path))
+            archived = False
+            snapshots = []
+            for name in os.listdir(self.directory):
+                if not (name.startswith('worker-') and name.endswith('.json')):
+                    continue
+                path = os.path.join(self.directory, name)
+                snapshot = _read_json(path)
+                if snapshot is None:
+                    continue
+                if _pid_alive(snapshot['pid']):
+                    snapshots.append(snapshot)
+                else:
+                    snapshot['in_flight'] = []
+                    archive.merge(_Merged.from_json(snapshot))
+                    os.unlink(path)
+                    archived = True
+            if archived:
+                _write_json(archive_path, archive.to_json(None))
+        workers = len(snapshots)
+        snapshots.append(archive.to_json(None))
+        return snapshots, workers
+
+    # Exposition
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        if self.directory:
+            snapshots, workers = self._collect()
+        else:
+            snapshots, workers = [self.snapshot()], 1
+        merged = _Merged()
+        for snapshot in snapshots:
+            merged.merge(_Merged.from_json(snapshot))
+
+        lines = [
+            '# HELP http_requests_total HTTP requests by route, method and status code.',
+            '# TYPE http_requests_total counter',
+        ]
+        for (route, method, status), count in sorted(merged.requests.items()):
+            lines.append(f'http_requests_total{_labels(route=route, method=method, status=status)} {count}')
+
+        lines += [
+            '# HELP http_requests_in_flight Requests currently being served.',
+            '# TYPE http_requests_in_flight gauge',
+        ]
+        for (route, method), count in sorted(merged.in_flight.items()):
+            lines.append(f'http_requests_in_flight{_labels(route=route, method=method)} {count}')
+
+        lines += _render_histogram(
+            'http_request_duration_seconds', 'Request latency by route and method.', merged.durations, LATENCY_BUCKETS
+        )
+        lines += _render_histogram(
+            'http_response_size_bytes', 'Response body size by route and method.', merged.sizes, SIZE_BUCKETS
+        )
+        lines.append('# HELP http_metrics_workers Worker processes reporting metrics.')
+        lines.append('# TYPE http_metrics_workers gauge')
+        lines.append(f'http_metrics_workers {workers}')
+        return '\n'.join(lines) + '\n'
+
+
+class _Merged:
+    def __init__(self):
+        self.requests = {}
+        self.durations = {}
+        self.sizes = {}
+        self.in_flight = {}
+
+    def add_requests(self, items):
+        for key, count in items:
+            self.requests[key] = self.requests.get(key, 0) + count
+
+    def add_histograms(self, target, items):
+        for key, (buckets, total, count) in items:
+            histogram = target.get(key)
+            if histogram is None:
+                target[key] = [list(buckets), total, count]
+            else:
+                histogram[0] = [a + b for a, b in zip(histogram[0], buckets)]
+                histogram[1] += total
+                histogram[2] += count
+
+    def add_in_flight(self, items):
+        for key, count in items:
+            self.in_flight[key] = self.in_flight.get(key, 0) + count
+
+    def merge(self, other):
+        self.add_requests(other.requests.items())
+        self.add_histograms(self.durations, other.durations.items())
+        self.add_histograms(self.sizes, other.sizes.items())
+        self.add_in_flight(other.in_flight.items())
+
+    def to_json(self, pid):
+        return {
+            'pid': pid,
+            'requests': [[*key, count] for key, count in self.requests.items()],
+            'durations': [[*key, *histogram] for key, histogram in self.durations.items()],
+            'sizes': [[*key, *histogram] for key, histogram in self.sizes.items()],
+            'in_flight': [[*key, count] for key, count in self.in_flight.items()],
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        merged = cls()
+        if not data:
+            return merged
+        merged.requests = {(route, method, status): count for route, method, status, count in data['requests']}
+        merged.durations = {(route, method): [b, s, c] for route, method, b, s, c in data['durations']}
+        merged.sizes = {(route, method): [b, s, c] for route, method, b, s, c in data['sizes']}
+        merged.in_flight = {(route, method): count for route, method, count in data['in_flight']}
+        return merged
+
+
+def _render_histogram(name, help_text, histograms, buckets):
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+    for (route, method), (counts, total, count) in sorted(histograms.items()):
+        cumulative = 0
+        for bound, bucket_count in zip(list(buckets) + ['+Inf'], counts):
+            cumulative += bucket_count
+            lines.append(f'{name}_bucket{_labels(route=route, method=method, le=bound)} {cumulative}')
+        lines.append(f'{name}_sum{_labels(route=route, method=method)} {total}')
+        lines.append(f'{name}_count{_labels(route=route, method=method)} {count}')
+    return lines
+
+
+def _labels(**labels):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{key}="{escape(value)}"' for key, value in labels.items()) + '}'
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _write_json(path, data):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.archive-')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+class _DirectoryLock:
+    """Exclusive lock so two workers never archive the same dead worker twice."""
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, '.lock')
+
+    def __enter__(self):
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        if fcntl is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        os.close(self.fd)
@@ -0,0 +1,41 @@
+"""Add users
+
+The initial migration was generated against a database that already had
+the users table, so a fresh database had nothing for its foreign keys to
+reference. Databases at any later revision already have the table.
+
+Revision ID: 0d4a7e19c3b6
+Revises: 
+Create Date: 2026-10-19 10:02:17.530914
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0d4a7e19c3b6'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('users',
+    sa.Column('id', sa.String(length=36), nullable=False),
+    sa.Column('username', sa.String(length=50), nullable=False),
+    sa.Column('password', sa.String(length=100), nullable=False),
+    sa.Column('firstName', sa.String(length=50), nullable=False),
+    sa.Column('lastName', sa.String(length=50), nullable=False),
+    sa.Column('email', sa.String(length=100), nullable=False),
+    sa.Column('role', sa.String(length=20), nullable=False),
+    sa.Column('createdAt', sa.DateTime(), nullable=True),
+    sa.Column('updatedAt', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('email'),
+    sa.UniqueConstraint('username')
+    )
+
+
+def downgrade():
+    op.drop_table('users')
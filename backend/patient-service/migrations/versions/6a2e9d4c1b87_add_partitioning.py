@@ -0,0 +1,151 @@
+"""Partition appointments and medical records by month
+
+Revision ID: 6a2e9d4c1b87
+Revises: 3f9d2c7a8e15
+Create Date: 2026-10-19 19:02:41.508113
+
+On PostgreSQL, appointments and medical_records become tables range
+partitioned by month of appointmentDate / visitDate, with one partition per
+month that has rows, the current and next 3 months, and a default partition
+for anything else; later months are added by `flask ensure-partitions`. The
+primary keys include the partition column, as PostgreSQL requires. Other
+databases keep plain tables and only get the date indexes.
+
+"""
+from datetime import date
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6a2e9d4c1b87'
+down_revision = '3f9d2c7a8e15'
+branch_labels = None
+depends_on = None
+
+# Partitioned table -> the YYYY-MM-DD column it is partitioned on
+PARTITION_KEYS = {'appointments': 'appointmentDate', 'medical_records': 'visitDate'}
+MONTHS_AHEAD = 3
+
+
+def _columns(table_name, partitioned):
+    # "C" collation: the partition bounds compare like the ISO dates they are
+    date_type = sa.String(length=10, collation='C') if partitioned else sa.String(length=10)
+    if table_name == 'appointments':
+        return [
+            sa.Column('id', sa.String(length=36), nullable=False),
+            sa.Column('patientId', sa.String(length=36), nullable=False),
+            sa.Column('doctorId', sa.String(length=36), nullable=False),
+            sa.Column('appointmentDate', date_type, nullable=False),
+            sa.Column('startTime', sa.String(length=8), nullable=False),
+            sa.Column('endTime', sa.String(length=8), nullable=False),
+            sa.Column('status', sa.String(length=20), nullable=False),
+            sa.Column('reason', sa.String(length=200), nullable=False),
+            sa.Column('notes', sa.Text(), nullable=True),
+            sa.Column('createdAt', sa.DateTime(), nullable=True),
+            sa.Column('updatedAt', sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(['doctorId'], ['users.id'], ),
+            sa.ForeignKeyConstraint(['patientId'], ['patients.id'], ),
+        ]
+    return [
+        sa.Column('id', sa.String(length=36), nullable=False),
+        sa.Column('patientId', sa.String(length=36), nullable=False),
+        sa.Column('doctorId', sa.String(length=36), nullable=False),
+        sa.Column('visitDate', date_type, nullable=False),
+        sa.Column('chiefComplaint', sa.String(length=200), nullable=False),
+        sa.Column('diagnosis', sa.Text(), nullable=False),
+        sa.Column('treatmentPlan', sa.Text(), nullable=False),
+        sa.Column('followUpNeeded', sa.Boolean(), nullable=True),
+        sa.Column('notes', sa.Text(), nullable=True),
+        sa.Column('createdAt', sa.DateTime(), nullable=True),
+        sa.Column('updatedAt', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['doctorId'], ['users.id'], ),
+        sa.ForeignKeyConstraint(['patientId'], ['patients.id'], ),
+    ]
+
+
+def _add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _copy(source, target, table_name):
+    names = ', '.join(f'"{column.name}"' for column in _columns(table_name, False) if isinstance(column, sa.Column))
+    op.execute(f'INSERT INTO "{target}" ({names}) SELECT {names} FROM "{source}"')
+
+
+def _partition(table_name, key):
+    old = f'{table_name}_unpartitioned'
+    op.rename_table(table_name, old)
+    op.execute(f'ALTER INDEX "{table_name}_pkey" RENAME TO "{old}_pkey"')
+    op.create_table(table_name, *_columns(table_name, True),
+                    sa.PrimaryKeyConstraint('id', key),
+                    postgresql_partition_by=f'RANGE ("{key}")')
+
+    months = op.get_bind().execute(sa.text(
+        f'SELECT DISTINCT substr("{key}", 1, 7) FROM "{old}" WHERE "{key}" ~ :pattern'
+    ), {'pattern': r'^\d{4}-(0[1-9]|1[0-2])-\d{2}$'}).scalars().all()
+    first = date.today().replace(day=1)
+    months = {date.fromisoformat(f'{month}-01') for month in months}
+    months.update(_add_months(first, offset) for offset in range(MONTHS_AHEAD + 1))
+    for month in sorted(months):
+        op.execute(
+            f'CREATE TABLE "{table_name}_{month:%Y_%m}" PARTITION OF "{table_name}" '
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_add_months(month, 1).isoformat()}')"
+        )
+    op.execute(f'CREATE TABLE "{table_name}_default" PARTITION OF "{table_name}" DEFAULT')
+
+    _copy(old, table_name, table_name)
+    op.drop_table(old)
+
+
+def _unpartition(table_name):
+    # Partitions detached into the archive schema are left where they are
+    old = f'{table_name}_partitioned'
+    op.rename_table(table_name, old)
+    op.execute(f'ALTER INDEX "{table_name}_pkey" RENAME TO "{old}_pkey"')
+    op.create_table(table_name, *_columns(table_name, False), sa.PrimaryKeyConstraint('id'))
+    _copy(old, table_name, table_name)
+    op.execute(f'DROP TABLE "{old}" CASCADE')
+
+
+def upgrade():
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.create_table('archived_months',
+    sa.Column('id', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'), autoincrement=True, nullable=False),
+    sa.Column('tableName', sa.String(length=50), nullable=False),
+    sa.Column('month', sa.String(length=7), nullable=False),
+    sa.Column('rowCount', sa.Integer(), nullable=False),
+    sa.Column('data', sa.LargeBinary(), nullable=False),
+    sa.Column('archivedAt', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('tableName', 'month', name='uq_archived_months_table_month')
+    )
+    # ### end Alembic commands ###
+
+    if op.get_bind().dialect.name == 'postgresql':
+        for table_name, key in PARTITION_KEYS.items():
+            _partition(table_name, key)
+
+    with op.batch_alter_table('appointments', schema=None) as batch_op:
+        batch_op.create_index('ix_appointments_appointmentDate_startTime', ['appointmentDate', 'startTime'], unique=False)
+
+    with op.batch_alter_table('medical_records', schema=None) as batch_op:
+        batch_op.create_index('ix_medical_records_visitDate', ['visitDate'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('medical_records', schema=None) as batch_op:
+        batch_op.drop_index('ix_medical_records_visitDate')
+
+    with op.batch_alter_table('appointments', schema=None) as batch_op:
+        batch_op.drop_index('ix_appointments_appointmentDate_startTime')
+
+    if op.get_bind().dialect.name == 'postgresql':
+        for table_name in PARTITION_KEYS:
+            _unpartition(table_name)
+
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.drop_table('archived_months')
+    # ### end Alembic commands ###
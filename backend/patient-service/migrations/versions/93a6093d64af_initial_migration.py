@@ -1,18 +1,18 @@
 """Initial migration
 
 Revision ID: 93a6093d64af
-Revises: 
+Revises: 0d4a7e19c3b6
 Create Date: 2025-04-21 22:40:21.634061
 
 """
 from alembic import op
 import sqlalchemy as sa
-from app import MedicalConditionList, AllergiesList
+from column_types import MedicalConditionList, AllergiesList
 
 
 # revision identifiers, used by Alembic.
 revision = '93a6093d64af'
-down_revision = None
+down_revision = '0d4a7e19c3b6'
 branch_labels = None
 depends_on = None
 
@@ -0,0 +1,289 @@
+import hmac
+import json
+import time
+import random
+import hashlib
+import logging
+import fnmatch
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from sqlalchemy import event, func, select
+
+from changes import INSERT, UPDATE, DELETE, flushed_changes
+
+logger = logging.getLogger(__name__)
+
+# Outbox event states
+PENDING, DELIVERED, DEAD = 'pending', 'delivered', 'dead'
+
+# Event type suffix per change operation, e.g. appointment.created
+EVENT_ACTIONS = {INSERT: 'created', UPDATE: 'updated', DELETE: 'deleted'}
+
+# Client errors that retrying will not fix; anything else is retried
+RETRYABLE_CLIENT_ERRORS = (408, 425, 429)
+
+
+def parse_destinations(value):
+    """WEBHOOK_DESTINATIONS: a JSON object of name -> {url, events, secret}.
+
+    ``events`` are patterns such as ``appointment.*`` (default: every event);
+    with a ``secret`` each request is signed (X-HMS-Signature). The
+    shorthand ``{"billing": "https://..."}`` subscribes a URL to everything.
+    """
+    destinations = {}
+    for name, config in (json.loads(value) if value else {}).items():
+        if isinstance(config, str):
+            config = {'url': config}
+        if not config.get('url'):
+            raise ValueError(f"Webhook destination '{name}' has no url")
+        destinations[name] = {'url': config['url'], 'events': config.get('events') or ['*'], 'secret': config.get('secret')}
+    return destinations
+
+
+def sign(secret, body):
+    return 'sha256=' + hmac.new(secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+
+
+class Outbox:
+    """Writes an outbox row per destination for every committed change of
+    the given models, in the transaction that made the change.
+
+    The entity and its events commit or roll back together, and no HTTP
+    call happens on the request path; OutboxDispatcher delivers them later.
+    """
+
+    def __init__(self, db, outbox_model, destinations, models):
+        self.db = db
+        self.outbox_model = outbox_model
+        self.destinations = destinations
+        # Table name -> event type prefix, e.g. medical_records -> medical_record
+        self.event_names = {model.__tablename__: model.__tablename__.removesuffix('s') for model in models}
+        self.track(db.session)
+
+    @property
+    def table(self):
+        return self.outbox_model.__table__
+
+    def track(self, target):
+        """Also write events for another session (class or factory), e.g. asgi.py's."""
+        event.listen(target, 'after_flush', self._after_flush)
+
+    def subscribers(self, event_type):
+        return [name for name, destination in self.destinations.items()
+                if any(fnmatch.fnmatchcase(event_type, pattern) for pattern in destination['events'])]
+
+    def _after_flush(self, session, flush_context):
+        if self.destinations:
+            self.record_changes(session, flushed_changes(session, self.event_names))
+
+    def record_changes(self, session, changes):
+        """Queue events for ``(table name, object, operation)`` changes. Writers
+        that bypass the unit of work (set-based UPDATEs) pass the rows they
+        changed, loaded afterwards."""
+        events = []
+        for table_name, obj, operation in changes:
+            if table_name not in self.event_names:
+                continue
+            if operation == DELETE:
+                # The row is gone; send what identifies it
+                data = {'id': obj.id, 'patientId': vars(obj).get('patientId')}
+            else:
+                data = obj.to_dict()
+            events.append((f'{self.event_names[table_name]}.{EVENT_ACTIONS[operation]}', obj.id, data))
+        if events:
+            self.record(session, events)
+
+    def record(self, session, events):
+        """Queue ``(event type, aggregate id, data)`` events in the session's transaction."""
+        now = datetime.utcnow()
+        rows = [
+            {'destination': destination, 'eventType': event_type, 'aggregateId': aggregate_id, 'payload': data,
+             'status': PENDING, 'attempts': 0, 'nextAttemptAt': now, 'createdAt': now}
+            for event_type, aggregate_id, data in events
+            for destination in self.subscribers(event_type)
+        ]
+        if rows:
+            session.execute(self.table.insert(), rows)
+
+
+class OutboxDispatcher:
+    """Delivers pending outbox events to their webhook destinations.
+
+    Each round reads up to ``batch_size`` pending events of every destination
+    and POSTs them as batches of ``max_batch_events``. Destinations
+    are served concurrently over one pooled ``requests.Session``; within a
+    destination, batches go out in order. A failed batch is retried with
+    exponential backoff and jitter until ``max_attempts``, then marked dead.
+    Events of a destination wait behind its failed ones, so receivers see
+    them in order. Delivery is at least once: receivers should skip event
+    ids they have already processed.
+
+    Run a single dispatcher per database.
+    """
+
+    def __init__(self, db, outbox_model, destinations, batch_size=500, max_batch_events=50, concurrency=4,
+                 max_attempts=10, backoff_base=2.0, backoff_max=3600.0, timeout=10.0):
+        self.db = db
+        self.outbox_model = outbox_model
+        self.destinations = destinations
+        self.batch_size = batch_size
+        self.max_batch_events = max_batch_events
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.session = requests.Session()
+        # Keep-alive connections for every destination served concurrently
+        adapter = HTTPAdapter(pool_connections=max(len(destinations), 1), pool_maxsize=concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    @property
+    def table(self):
+        return self.outbox_model.__table__
+
+    def _due(self, now):
+        """Pending events per destination, oldest first, up to the first one not due yet.
+
+        Each destination is read on its own (an index range scan), so one whose
+        backlog waits for a retry cannot fill the round and starve the others.
+        """
+        outbox = self.table
+        columns = (outbox.c.id, outbox.c.destination, outbox.c.eventType, outbox.c.aggregateId,
+                   outbox.c.payload, outbox.c.attempts, outbox.c.nextAttemptAt, outbox.c.createdAt)
+        due = {}
+        for name in self.destinations:
+            rows = self.db.session.execute(
+                select(*columns).where(outbox.c.destination == name, outbox.c.status == PENDING)
+                .order_by(outbox.c.id).limit(self.batch_size)
+            ).all()
+            for row in rows:
+                if row.nextAttemptAt > now:
+                    break
+                due.setdefault(name, []).append(row)
+        return due
+
+    def expire_unknown(self):
+        """Mark dead the pending events of destinations no longer configured; returns how many."""
+        outbox = self.table
+        with self.db.engine.begin() as connection:
+            return connection.execute(
+                outbox.update().where(outbox.c.status == PENDING, outbox.c.destination.notin_(list(self.destinations)))
+                .values(status=DEAD, lastError='Destination is no longer configured')
+            ).rowcount
+
+    def dispatch_once(self):
+        """Run one round; returns ``{'delivered': n, 'failed': n, 'dead': n}``."""
+        now = datetime.utcnow()
+        due = self._due(now)
+        self.db.session.rollback()  # no transaction left open during HTTP calls
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            results = list(pool.map(lambda item: self._deliver(*item), due.items()))
+
+        counts = {'delivered': 0, 'failed': 0, 'dead': 0}
+        outbox = self.table
+        with self.db.engine.begin() as connection:
+            for delivered, failed, error, retry_after in results:
+                if delivered:
+                    connection.execute(outbox.update().where(outbox.c.id.in_([row.id for row in delivered]))
+                                       .values(status=DELIVERED, attempts=outbox.c.attempts + 1, deliveredAt=datetime.utcnow()))
+                    counts['delivered'] += len(delivered)
+                if failed:
+                    attempts = max(row.attempts for row in failed) + 1
+                    if attempts >= self.max_attempts or retry_after is None:
+                        values = {'status': DEAD}
+                        counts['dead'] += len(failed)
+                    else:
+                        values = {'nextAttemptAt': datetime.utcnow() + timedelta(seconds=retry_after)}
+                        counts['failed'] += len(failed)
+                    connection.execute(outbox.update().where(outbox.c.id.in_([row.id for row in failed]))
+                                       .values(attempts=outbox.c.attempts + 1, lastError=error[:2000], **values))
+        return counts
+
+    def _deliver(self, name, rows):
+        """POST a destination's events batch by batch; stops at the first failed
+        batch, whose events then block the rest of the destination's queue.
+        Returns ``(delivered rows, failed batch, error, retry delay or None if permanent)``."""
+        destination = self.destinations[name]
+        delivered = []
+        for start in range(0, len(rows), self.max_batch_events):
+            batch = rows[start:start + self.max_batch_events]
+            body = json.dumps({'events': [{
+                'id': row.id,
+                'type': row.eventType,
+                'aggregateId': row.aggregateId,
+                'occurredAt': row.createdAt.isoformat(),
+                'data': row.payload,
+            } for row in batch]}, default=str).encode('utf-8')
+            headers = {'Content-Type': 'application/json'}
+            if destination['secret']:
+                headers['X-HMS-Signature'] = sign(destination['secret'], body)
+
+            try:
+                response = self.session.post(destination['url'], data=body, headers=headers, timeout=self.timeout)
+            except requests.RequestException as e:
+                logger.warning('Webhook delivery to %s failed: %s', name, e)
+                return delivered, batch, f'{type(e).__name__}: {e}', self._backoff(batch)
+            if 200 <= response.status_code < 300:
+                delivered += batch
+                continue
+
+            error = f'HTTP {response.status_code}: {response.text[:500]}'
+            logger.warning('Webhook delivery to %s failed: %s', name, error)
+            if 400 <= response.status_code < 500 and response.status_code not in RETRYABLE_CLIENT_ERRORS:
+                # Rejected: retrying the same batch would fail again
+                return delivered, batch, error, None
+            retry_after = response.headers.get('Retry-After', '')
+            delay = float(retry_after) if retry_after.isdigit() else self._backoff(batch)
+            return delivered, batch, error, delay
+        return delivered, [], None, None
+
+    def _backoff(self, batch):
+        attempts = max(row.attempts for row in batch) + 1
+        return min(self.backoff_max, self.backoff_base * 2 ** (attempts - 1)) * random.uniform(0.5, 1.0)
+
+    def prune(self, before):
+        """Delete delivered events older than ``before``."""
+        outbox = self.table
+        with self.db.engine.begin() as connection:
+            return connection.execute(
+                outbox.delete().where(outbox.c.status == DELIVERED, outbox.c.createdAt < before)
+            ).rowcount
+
+    def stats(self):
+        outbox = self.table
+        rows = self.db.session.execute(
+            select(outbox.c.destination, outbox.c.status, func.count(), func.min(outbox.c.createdAt))
+            .group_by(outbox.c.destination, outbox.c.status)
+        ).all()
+        stats = {}
+        for destination, status, count, oldest in rows:
+            stats.setdefault(destination, {})[status] = {'count': count, 'oldest': oldest.isoformat() if oldest else None}
+        return stats
+
+    def run(self, stop, poll_interval=2.0, retention_days=7):
+        """Dispatch until ``stop`` is set; idles ``poll_interval`` seconds when nothing was sent."""
+        next_prune = 0.0
+        while not stop.is_set():
+            try:
+                counts = self.dispatch_once()
+                if any(counts.values()):
+                    logger.info('Outbox: %(delivered)d delivered, %(failed)d to retry, %(dead)d dead', counts)
+                if time.monotonic() >= next_prune:
+                    expired = self.expire_unknown()
+                    if expired:
+                        logger.warning('Outbox: %d events of unconfigured destinations marked dead', expired)
+                    self.prune(datetime.utcnow() - timedelta(days=retention_days))
+                    next_prune = time.monotonic() + 3600
+            except Exception:
+                logger.exception('Outbox dispatch failed')
+                counts = {}
+            finally:
+                self.db.session.remove()
+            if not counts.get('delivered'):
+                stop.wait(poll_interval)
@@ -0,0 +1,197 @@
+import re
+import json
+import zlib
+import logging
+from datetime import date, datetime
+
+from sqlalchemy import func, select, text
+
+logger = logging.getLogger(__name__)
+
+# Partitioned table -> the YYYY-MM-DD column its rows are split on by month
+PARTITION_KEYS = {'appointments': 'appointmentDate', 'medical_records': 'visitDate'}
+
+# Arbitrary key of the PostgreSQL advisory lock that serializes partition maintenance
+PARTITION_LOCK_KEY = 7305116
+
+# Schema that detached partitions are moved to
+ARCHIVE_SCHEMA = 'archive'
+
+_BOUND = re.compile(r"FROM \('(\d{4}-\d{2}-\d{2})'\) TO \('(\d{4}-\d{2}-\d{2})'\)")
+_MONTH = re.compile(r'^\d{4}-(0[1-9]|1[0-2])$')
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table_name, month):
+    return f'{table_name}_{month:%Y_%m}'
+
+
+class PartitionManager:
+    """Monthly partitions of the tables in ``partition_keys``.
+
+    On PostgreSQL these tables are range partitioned by month of their date
+    column (see the add_partitioning migration), so a query filtered on the
+    date only reads the matching partitions. Rows of a month without a
+    partition go to ``<table>_default``. ``ensure_future_partitions()``
+    creates the partitions of the current and next ``months_ahead`` months,
+    moving their rows out of the default partition. ``archive()`` detaches
+    the partitions of months before a cutoff and moves them to the
+    ``archive`` schema, where they stay queryable but are no longer scanned.
+
+    Other databases have no partitions: ``ensure_future_partitions()`` does
+    nothing and ``archive()`` moves old rows into ``archived_months``, one
+    zlib-compressed NDJSON blob per table and month.
+    """
+
+    def __init__(self, db, archive_model, partition_keys=PARTITION_KEYS, months_ahead=3, lock_timeout=5.0):
+        self.db = db
+        self.archive_model = archive_model
+        self.partition_keys = partition_keys
+        self.months_ahead = months_ahead
+        self.lock_timeout = lock_timeout
+
+    @property
+    def is_postgresql(self):
+        return self.db.engine.dialect.name == 'postgresql'
+
+    def _lock(self, connection):
+        connection.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': PARTITION_LOCK_KEY})
+        # Attaching and detaching lock the tables briefly; a queued lock would
+        # stall all queries behind a long transaction, so give up instead
+        connection.execute(text(f"SET LOCAL lock_timeout = '{int(self.lock_timeout * 1000)}ms'"))
+
+    def partitions(self, connection, table_name):
+        """``[(first day, day after, partition name)]`` of a partitioned table,
+        without the default partition; None if the table is not partitioned."""
+        partitioned = connection.execute(
+            text('SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table)'), {'table': table_name}
+        ).first()
+        if not partitioned:
+            return None
+        rows = connection.execute(text(
+            'SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i '
+            'JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = to_regclass(:table)'
+        ), {'table': table_name})
+        partitions = []
+        for name, bound in rows:
+            match = _BOUND.search(bound)
+            if match:
+                partitions.append((date.fromisoformat(match.group(1)), date.fromisoformat(match.group(2)), name))
+        return sorted(partitions)
+
+    def ensure_future_partitions(self, today=None):
+        """Create missing partitions up to ``months_ahead`` months from now; returns their names."""
+        if not self.is_postgresql:
+            return []
+        first = (today or date.today()).replace(day=1)
+        created = []
+        with self.db.engine.begin() as connection:
+            self._lock(connection)
+            for table_name, column in self.partition_keys.items():
+                partitions = self.partitions(connection, table_name)
+                if partitions is None:
+                    logger.warning("Table %s is not partitioned; run 'flask db upgrade'", table_name)
+                    continue
+                for offset in range(self.months_ahead + 1):
+                    month = add_months(first, offset)
+                    if not any(lower <= month < upper for lower, upper, _ in partitions):
+                        created.append(self._create_partition(connection, table_name, column, month))
+        return created
+
+    def _create_partition(self, connection, table_name, column, month):
+        # Built detached and attached afterwards, so rows of the month that are
+        # already in the default partition can be moved into it first
+        name = partition_name(table_name, month)
+        lower, upper = month.isoformat(), add_months(month, 1).isoformat()
+        connection.execute(text(f'CREATE TABLE "{name}" (LIKE "{table_name}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'))
+        default = f'{table_name}_default'
+        if connection.execute(text('SELECT to_regclass(:name)'), {'name': default}).scalar():
+            moved = connection.execute(text(
+                f'WITH moved AS (DELETE FROM "{default}" WHERE "{column}" >= :lower AND "{column}" < :upper RETURNING *) '
+                f'INSERT INTO "{name}" SELECT * FROM moved'
+            ), {'lower': lower, 'upper': upper}).rowcount
+            if moved:
+                logger.info('Moved %d rows from %s to %s', moved, default, name)
+        connection.execute(text(f"ALTER TABLE \"{table_name}\" ATTACH PARTITION \"{name}\" FOR VALUES FROM ('{lower}') TO ('{upper}')"))
+        return name
+
+    def archive(self, before, dry_run=False):
+        """Archive the months before ``before`` (a date; its month is kept).
+
+        Returns ``[(table name, 'YYYY-MM', rows, where they went)]``. With
+        ``dry_run`` everything is rolled back after counting.
+        """
+        before = before.replace(day=1)
+        if self.is_postgresql:
+            return self._detach_partitions(before, dry_run)
+        archived = []
+        for table_name, column in self.partition_keys.items():
+            archived += self._archive_rows(table_name, column, before, dry_run)
+        return archived
+
+    def _detach_partitions(self, before, dry_run):
+        archived = []
+        with self.db.engine.connect() as connection:
+            transaction = connection.begin()
+            self._lock(connection)
+            connection.execute(text(f'CREATE SCHEMA IF NOT EXISTS "{ARCHIVE_SCHEMA}"'))
+            for table_name in self.partition_keys:
+                for lower, upper, name in self.partitions(connection, table_name) or []:
+                    if upper > before:
+                        continue
+                    rows = connection.execute(text(f'SELECT count(*) FROM "{name}"')).scalar()
+                    connection.execute(text(f'ALTER TABLE "{table_name}" DETACH PARTITION "{name}"'))
+                    connection.execute(text(f'ALTER TABLE "{name}" SET SCHEMA "{ARCHIVE_SCHEMA}"'))
+                    archived.append((table_name, f'{lower:%Y-%m}', rows, f'{ARCHIVE_SCHEMA}.{name}'))
+            if dry_run:
+                transaction.rollback()
+            else:
+                transaction.commit()
+        return archived
+
+    def _archive_rows(self, table_name, column_name, before, dry_run):
+        table = self.db.metadata.tables[table_name]
+        column = table.c[column_name]
+        archive = self.archive_model.__table__
+        session = self.db.session
+        months = session.execute(
+            select(func.substr(column, 1, 7)).distinct().where(column < before.isoformat())
+        ).scalars().all()
+
+        archived = []
+        for month in sorted(months):
+            if not _MONTH.match(month or ''):
+                continue  # not a date; left in place
+            first = date.fromisoformat(f'{month}-01')
+            in_month = (column >= first.isoformat(), column < add_months(first, 1).isoformat())
+            # One transaction per month (through the session, so it queues on
+            # the SQLite writer lock) keeps writers from waiting long
+            try:
+                rows = session.execute(select(table).where(*in_month).order_by(column)).mappings().all()
+                existing = session.execute(
+                    select(archive.c.id, archive.c.data, archive.c.rowCount)
+                    .where(archive.c.tableName == table_name, archive.c.month == month)
+                ).first()
+                # Rows archived for this month by an earlier run come first
+                lines = zlib.decompress(existing.data) if existing else b''
+                lines += b''.join(json.dumps(dict(row), default=str).encode('utf-8') + b'\n' for row in rows)
+                values = {'rowCount': (existing.rowCount if existing else 0) + len(rows),
+                          'data': zlib.compress(lines, 9), 'archivedAt': datetime.utcnow()}
+                if existing:
+                    session.execute(archive.update().where(archive.c.id == existing.id).values(**values))
+                else:
+                    session.execute(archive.insert().values(tableName=table_name, month=month, **values))
+                session.execute(table.delete().where(*in_month))
+                if dry_run:
+                    session.rollback()
+                else:
+                    session.commit()
+            except Exception:
+                session.rollback()
+                raise
+            archived.append((table_name, month, len(rows), archive.name))
+        return archived
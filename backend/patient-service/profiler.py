@@ -0,0 +1,228 @@
+import io
+import os
+import hmac
+import json
+import time
+import uuid
+import random
+import marshal
+import pstats
+import cProfile
+import tempfile
+import threading
+from collections import deque
+
+from flask import g, request
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_QUERY_PARAM = '__profile'
+# Profiling these would only profile the profiler
+EXCLUDED_PATHS = ('/metrics', '/api/admin/profiles')
+
+
+class RequestProfiler:
+    """Runs cProfile around individual requests and keeps the latest results.
+
+    A request is profiled when it carries ``X-Profile: <token>`` (or
+    ``?__profile=<token>``) matching ``token``, or when it is picked by the
+    random ``sample_rate``. The last ``buffer_size`` profiles are kept in
+    memory, or with ``directory`` set, as files shared by every gunicorn
+    worker so any worker can serve any profile.
+    """
+
+    def __init__(self, app=None, token=None, sample_rate=0.0, buffer_size=50, directory=None):
+        self.token = token
+        self.sample_rate = sample_rate
+        self.buffer_size = buffer_size
+        self.directory = directory
+        self._profiles = deque(maxlen=buffer_size)
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+    # Recording
+
+    def _trigger(self):
+        if request.path.startswith(EXCLUDED_PATHS):
+            return None
+        requested = request.headers.get(PROFILE_HEADER) or request.args.get(PROFILE_QUERY_PARAM)
+        # On-demand profiling is for admins only: it needs the PROFILER_TOKEN secret
+        if requested and self.token and hmac.compare_digest(requested, self.token):
+            return 'requested'
+        if self.sample_rate and random.random() < self.sample_rate:
+            return 'sampled'
+        return None
+
+    def _before_request(self):
+        trigger = self._trigger()
+        if trigger is None:
+            return
+        g.profile = {'id': uuid.uuid4().hex, 'trigger': trigger, 'status': 500}
+        g.profile_started = time.perf_counter()
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+    def _after_request(self, response):
+        if 'profiler' in g:
+            g.profile['status'] = response.status_code
+            response.headers['X-Profile-Id'] = g.profile['id']
+        return response
+
+    def _teardown_request(self, exc):
+        # Teardown also runs for failed requests, so the profiler is always stopped
+        profiler = g.pop('profiler', None)
+        if profiler is None:
+            return
+        profiler.disable()
+        profiler.create_stats()
+        entry = dict(
+            g.profile,
+            method=request.method,
+            path=request.path,
+            route=request.url_rule.rule if request.url_rule else None,
+            durationMs=round((time.perf_counter() - g.profile_started) * 1000, 2),
+            timestamp=time.time(),
+            pid=os.getpid(),
+        )
+        self._store(entry, profiler.stats)
+
+    def _store(self, entry, stats):
+        if not self.directory:
+            with self._lock:
+                self._profiles.append((entry, stats))
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        # Stats first: an entry is only listed once its stats are readable
+        _write_atomic(os.path.join(self.directory, f"{entry['id']}.prof"), marshal.dumps(stats))
+        _write_atomic(os.path.join(self.directory, f"{entry['id']}.json"), json.dumps(entry).encode())
+        for old in self._read_entries()[self.buffer_size:]:
+            for suffix in ('.json', '.prof'):
+                try:
+                    os.unlink(os.path.join(self.directory, old['id'] + suffix))
+                except FileNotFoundError:
+                    pass
+
+    # Reading
+
+    def _read_entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    entries.append(json.load(f))
+            except (FileNotFoundError, ValueError):
+                continue
+        return sorted(entries, key=lambda entry: entry['timestamp'], reverse=True)
+
+    def list(self):
+        """Newest first."""
+        if self.directory:
+            if not os.path.isdir(self.directory):
+                return []
+            return self._read_entries()
+        with self._lock:
+            return [dict(entry) for entry, _ in reversed(self._profiles)]
+
+    def get(self, profile_id):
+        """The ``(entry, stats)`` of a profile, or ``(None, None)``."""
+        if self.directory:
+            # Profile ids become file names
+            if not _is_profile_id(profile_id):
+                return None, None
+            try:
+                with open(os.path.join(self.directory, f'{profile_id}.json')) as f:
+                    entry = json.load(f)
+                with open(os.path.join(self.directory, f'{profile_id}.prof'), 'rb') as f:
+                    return entry, marshal.load(f)
+            except (FileNotFoundError, ValueError):
+                return None, None
+        with self._lock:
+            for entry, stats in self._profiles:
+                if entry['id'] == profile_id:
+                    return entry, stats
+        return None, None
+
+
+def _is_profile_id(value):
+    try:
+        return uuid.UUID(hex=value).hex == value
+    except ValueError:
+        return False
+
+
+def _write_atomic(path, data):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.profile-')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+# Output formats
+
+class _CollectedStats:
+    """Lets pstats.Stats load a stats dict that was already collected."""
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+def format_pstats(stats, sort='cumulative', limit=50):
+    out = io.StringIO()
+    pstats.Stats(_CollectedStats(stats), stream=out).sort_stats(sort).print_stats(limit)
+    return out.getvalue()
+
+
+def format_raw(stats):
+    """Marshalled stats, the format of ``cProfile -o``: open with pstats, snakeviz or gprof2dot."""
+    return marshal.dumps(stats)
+
+
+def _frame_name(func):
+    filename, line, name = func
+    label = name if filename == '~' else f'{os.path.basename(filename)}:{line}({name})'
+    # ';' separates frames and the last space separates the sample count
+    return label.replace(';', ':').replace(' ', '_')
+
+
+def format_collapsed(stats, max_depth=64):
+    """Collapsed stacks (``a;b;c <microseconds>``) for flamegraph.pl or speedscope.
+
+    cProfile only records caller/callee pairs, not whole stacks, so each
+    function's time is split across its callers in proportion to the time
+    spent on each call edge.
+    """
+    children = {}
+    for func, (_, _, _, _, callers) in stats.items():
+        for caller, edge in callers.items():
+            children.setdefault(caller, []).append((func, edge[3]))
+    roots = [func for func, (_, _, _, _, callers) in stats.items() if not callers]
+    samples = {}
+
+    def walk(func, stack, share):
+        stack = stack + [_frame_name(func)]
+        own = int(stats[func][2] * share * 1_000_000)
+        if own > 0:
+            key = ';'.join(stack)
+            samples[key] = samples.get(key, 0) + own
+        if len(stack) >= max_depth:
+            return
+        for child, edge_time in children.get(func, ()):
+            child_time = stats[child][3]
+            # Recursive calls are already counted in the frame above
+            if child_time <= 0 or _frame_name(child) in stack:
+                continue
+            walk(child, stack, share * edge_time / child_time)
+
+    for root in roots:
+        walk(root, [], 1.0)
+    return ''.join(f'{stack} {count}\n' for stack, count in sorted(samples.items()))
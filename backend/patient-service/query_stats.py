@@ -0,0 +1,95 @@
+import time
+import logging
+from collections import Counter
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger('sql')
+
+
+def parameter_shape(parameters):
+    """Describe bound parameters by type only, never by value (they hold PHI)."""
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (dict, list, tuple)):
+            # executemany: one shape for the batch
+            return {'rows': len(parameters), 'row': parameter_shape(parameters[0])}
+        return [type(value).__name__ for value in parameters]
+    return type(parameters).__name__
+
+
+class QueryStats:
+    """Per-request SQL statistics from SQLAlchemy cursor events.
+
+    Counts statements and database time for each request and reports them
+    in a ``Server-Timing`` header. Statements slower than
+    ``slow_query_ms`` are logged with their parameter shapes, and a
+    statement run ``n_plus_one_threshold`` or more times in one request is
+    logged as a probable N+1 query.
+    """
+
+    def __init__(self, app=None, slow_query_ms=200, n_plus_one_threshold=5, server_timing=True):
+        self.slow_query_seconds = slow_query_ms / 1000.0
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.server_timing = server_timing
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # Listening on the Engine class covers the primary, replicas and any
+        # engine created later
+        event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+
+    def _before_request(self):
+        g.sql_started = time.perf_counter()
+        g.sql_count = 0
+        g.sql_seconds = 0.0
+        g.sql_statements = Counter()
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        # The execution context lives for exactly one statement, so a failed
+        # statement leaves nothing behind
+        context._query_started = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context._query_started
+        in_request = has_request_context() and 'sql_statements' in g
+        if in_request:
+            g.sql_count += 1
+            g.sql_seconds += elapsed
+            g.sql_statements[statement] += 1
+
+        if elapsed >= self.slow_query_seconds:
+            logger.warning(
+                'Slow query (%.1f ms)%s: %s | parameters: %s',
+                elapsed * 1000,
+                f' in {request.method} {request.path}' if in_request else '',
+                ' '.join(statement.split()),
+                parameter_shape(parameters)
+            )
+
+    def _after_request(self, response):
+        if 'sql_statements' not in g:
+            return response
+
+        for statement, count in g.sql_statements.items():
+            if count >= self.n_plus_one_threshold:
+                logger.warning(
+                    'Probable N+1: statement ran %d times in %s %s: %s',
+                    count, request.method, request.url_rule.rule if request.url_rule else request.path,
+                    ' '.join(statement.split())
+                )
+
+        if self.server_timing:
+            total_ms = (time.perf_counter() - g.sql_started) * 1000
+            response.headers.add(
+                'Server-Timing',
+                f'db;desc="{g.sql_count} statements";dur={g.sql_seconds * 1000:.1f}, app;dur={total_ms:.1f}'
+            )
+        return response
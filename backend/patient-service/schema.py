@@ -1,6 +1,9 @@
 import graphene
 from graphene_sqlalchemy import SQLAlchemyObjectType, SQLAlchemyConnectionField
-from app import db, User, Patient, MedicalImage, Appointment, Medication, MedicalRecord
+from app import (
+    db, User, Patient, MedicalImage, Appointment, Medication, MedicalRecord, presigned_get_url, storage,
+    new_medication_allergy_warnings,
+)
 
 # Define GraphQL Types based on SQLAlchemy Models
 class UserType(SQLAlchemyObjectType):
@@ -9,15 +12,36 @@ class UserType(SQLAlchemyObjectType):
         interfaces = (graphene.relay.Node,)
         exclude_fields = ('password',)  # Don't expose passwords
 
+# Stored image URLs are not readable by clients; these are signed for display,
+# like the viewUrl fields of the REST API
+def signed_view_url(url):
+    if not url:
+        return None
+    return presigned_get_url(storage.key_from_url(url)) or url
+
 class PatientType(SQLAlchemyObjectType):
     class Meta:
         model = Patient
         interfaces = (graphene.relay.Node,)
+    
+    profile_image_view_url = graphene.String()
+    
+    def resolve_profile_image_view_url(self, info):
+        return signed_view_url(self.profileImageUrl)
         
 class MedicalImageType(SQLAlchemyObjectType):
     class Meta:
         model = MedicalImage
         interfaces = (graphene.relay.Node,)
+    
+    view_url = graphene.String()
+    thumbnail_view_url = graphene.String()
+    
+    def resolve_view_url(self, info):
+        return signed_view_url(self.imageUrl)
+    
+    def resolve_thumbnail_view_url(self, info):
+        return signed_view_url(self.thumbnailUrl)
 
 class AppointmentType(SQLAlchemyObjectType):
     class Meta:
@@ -292,11 +316,20 @@ class CreateAppointment(graphene.Mutation):
         
         return CreateAppointment(appointment=appointment)
 
+# Conflict between a prescription and the patient's allergies (drug_safety.py)
+class AllergyWarningType(graphene.ObjectType):
+    allergy = graphene.String()
+    severity = graphene.String()  # high, moderate or low
+    drug_class = graphene.String()
+    reason = graphene.String()
+
 class CreateMedication(graphene.Mutation):
     class Arguments:
         medication_data = MedicationInput(required=True)
     
     medication = graphene.Field(lambda: MedicationType)
+    # Saved anyway; the prescriber decides whether the conflict matters
+    allergy_warnings = graphene.List(AllergyWarningType)
     
     def mutate(self, info, medication_data):
         medication = Medication(
@@ -313,7 +346,12 @@ class CreateMedication(graphene.Mutation):
         db.session.add(medication)
         db.session.commit()
         
-        return CreateMedication(medication=medication)
+        warnings = [
+            AllergyWarningType(allergy=warning['allergy'], severity=warning['severity'],
+                               drug_class=warning['drugClass'], reason=warning['reason'])
+            for warning in new_medication_allergy_warnings(medication)
+        ]
+        return CreateMedication(medication=medication, allergy_warnings=warnings)
 
 class CreateMedicalRecord(graphene.Mutation):
     class Arguments:
@@ -0,0 +1,421 @@
+import os
+import re
+import base64
+import hashlib
+import hmac
+import tempfile
+import threading
+import time
+from urllib.parse import quote, unquote, urlencode
+
+# Signing secret for local-storage URLs (shared by all workers)
+STORAGE_SIGNING_KEY = os.environ.get('STORAGE_SIGNING_KEY', os.environ.get('SECRET_KEY', 'dev-storage-signing-key'))
+
+HASH_CHUNK_SIZE = 1024 * 1024
+# Uploads up to this size are hashed in memory, larger ones spill to disk
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
+CONTENT_TYPE_EXTENSIONS = {
+    'image/jpeg': 'jpg',
+    'image/png': 'png',
+    'image/gif': 'gif',
+    'image/webp': 'webp',
+    'image/tiff': 'tif',
+    'application/dicom': 'dcm',
+}
+
+_BLOB_KEY_RE = re.compile(r'/[0-9a-f]{2}/([0-9a-f]{64})(\.[A-Za-z0-9]+)?$')
+
+
+def blob_key(folder, digest, content_type):
+    """Content-addressed key: identical bytes always map to the same object."""
+    ext = CONTENT_TYPE_EXTENSIONS.get(content_type, 'bin')
+    return f"{folder}/{digest[:2]}/{digest}.{ext}"
+
+
+def digest_from_key(key):
+    match = _BLOB_KEY_RE.search(key or '')
+    return match.group(1) if match else None
+
+
+def hash_stream(fileobj):
+    """Hash a stream while copying it into a spooled temp file.
+
+    Returns ``(digest, size, spool)``; the spool is rewound and ready to upload.
+    """
+    sha256 = hashlib.sha256()
+    size = 0
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    while True:
+        chunk = fileobj.read(HASH_CHUNK_SIZE)
+        if not chunk:
+            break
+        sha256.update(chunk)
+        spool.write(chunk)
+        size += len(chunk)
+    spool.seek(0)
+    return sha256.hexdigest(), size, spool
+
+
+def sha256_hex_to_base64(digest):
+    return base64.b64encode(bytes.fromhex(digest)).decode('ascii')
+
+
+class SignedUrlCache:
+    """Caches signed download URLs until half their lifetime has passed, so a
+    gallery page listing 100 images reuses signatures instead of re-signing.
+
+    Entries are ``(url, reuse until, expires at)`` on the monotonic clock.
+    """
+
+    def __init__(self, max_size=4096):
+        self.max_size = max_size
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """``(url, seconds until it expires)``, or None when not cached."""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached and cached[1] > now:
+                return cached[0], int(cached[2] - now)
+        return None
+
+    def put(self, key, url, expires_in):
+        now = time.monotonic()
+        with self._lock:
+            if len(self._entries) >= self.max_size:
+                # Drop expired entries first, then the oldest ones
+                for cached_key in [k for k, v in self._entries.items() if v[1] <= now]:
+                    del self._entries[cached_key]
+                while len(self._entries) >= self.max_size:
+                    del self._entries[next(iter(self._entries))]
+            self._entries[key] = (url, now + expires_in / 2, now + expires_in)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class StorageBackend:
+    """Interface shared by the storage implementations.
+
+    Objects are addressed by a key such as ``medical-images/<patient>/<name>``;
+    ``url_for`` returns the URL stored on the model rows.
+    """
+
+    name = 'none'
+
+    def __init__(self, presign_expires=900, cache_size=4096):
+        self.presign_expires = presign_expires
+        self.url_cache = SignedUrlCache(cache_size)
+
+    def save(self, key, data, content_type='application/octet-stream', sha256=None):
+        """Store bytes or a file object under ``key`` and return its URL.
+
+        When ``sha256`` is given, content that does not match raises ValueError.
+        """
+        raise NotImplementedError
+
+    def exists(self, key):
+        raise NotImplementedError
+
+    def head(self, key):
+        """``{'size', 'contentType'}`` of a stored object, or None if it does not exist."""
+        raise NotImplementedError
+
+    def open(self, key):
+        """Return a readable binary file object for ``key``."""
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def url_for(self, key):
+        raise NotImplementedError
+
+    def key_from_url(self, url):
+        raise NotImplementedError
+
+    def sign_get_url(self, key, expires_in):
+        raise NotImplementedError
+
+    def sign_put_url(self, key, content_type, expires_in, sha256=None):
+        raise NotImplementedError
+
+    def save_content_addressed(self, folder, data, content_type='application/octet-stream'):
+        """Store bytes or a stream under its SHA-256 key, skipping the upload
+        when an identical object already exists.
+
+        Returns ``(key, digest, size)``.
+        """
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            digest, size, body = hashlib.sha256(data).hexdigest(), len(data), data
+        else:
+            digest, size, body = hash_stream(data)
+
+        key = blob_key(folder, digest, content_type)
+        try:
+            if not self.exists(key):
+                self.save(key, body, content_type=content_type)
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+        return key, digest, size
+
+    def presigned_get_url(self, key):
+        url, _ = self.presigned_get_url_with_expiry(key)
+        return url
+
+    def presigned_get_url_with_expiry(self, key):
+        """``(url, expires_in)``: a cached URL may already be up to half its
+        lifetime old, so ``expires_in`` is what is left of it."""
+        if not key:
+            return None, None
+        cached = self.url_cache.get(key)
+        if cached is None:
+            url = self.sign_get_url(key, self.presign_expires)
+            self.url_cache.put(key, url, self.presign_expires)
+            return url, self.presign_expires
+        return cached
+
+    def presigned_put_url(self, key, content_type, sha256=None):
+        """Return ``(url, headers)`` for a direct upload. When ``sha256`` is
+        given the backend rejects bodies whose digest does not match."""
+        return self.sign_put_url(key, content_type, self.presign_expires, sha256=sha256)
+
+    def reset(self):
+        """Drop per-process state (clients, caches), e.g. after a fork."""
+        self.url_cache.clear()
+
+
+class S3Storage(StorageBackend):
+    name = 's3'
+
+    def __init__(self, bucket, region, access_key, secret_key, public_read=False, **kwargs):
+        super().__init__(**kwargs)
+        self.bucket = bucket
+        self.region = region
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.public_read = public_read
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    @property
+    def client(self):
+        # boto3 takes ~100ms to import and build a client, so both wait for
+        # the first storage call instead of slowing down app import
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = self._create_client()
+        return self._client
+
+    def _create_client(self):
+        import boto3
+
+        return boto3.client(
+            's3',
+            region_name=self.region,
+            aws_access_key_id=self.access_key,
+            aws_secret_access_key=self.secret_key
+        )
+
+    def save(self, key, data, content_type='application/octet-stream', sha256=None):
+        extra_args = {'ContentType': content_type}
+        if self.public_read:
+            extra_args['ACL'] = 'public-read'
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            if sha256:
+                extra_args['ChecksumSHA256'] = sha256_hex_to_base64(sha256)
+            self.client.put_object(Body=bytes(data), Bucket=self.bucket, Key=key, **extra_args)
+        else:
+            self.client.upload_fileobj(data, self.bucket, key, ExtraArgs=extra_args)
+        return self.url_for(key)
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+            return True
+        except self.client.exceptions.ClientError:
+            return False
+
+    def head(self, key):
+        try:
+            response = self.client.head_object(Bucket=self.bucket, Key=key)
+        except self.client.exceptions.ClientError:
+            return None
+        return {'size': response['ContentLength'], 'contentType': response.get('ContentType') or 'application/octet-stream'}
+
+    def open(self, key):
+        return self.client.get_object(Bucket=self.bucket, Key=key)['Body']
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def url_for(self, key):
+        return f"https://{self.bucket}.s3.amazonaws.com/{key}"
+
+    def key_from_url(self, url):
+        prefix = f"https://{self.bucket}.s3.amazonaws.com/"
+        if url and url.startswith(prefix):
+            return url[len(prefix):]
+        return None
+
+    def sign_get_url(self, key, expires_in):
+        return self.client.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': self.bucket, 'Key': key},
+            ExpiresIn=expires_in
+        )
+
+    def sign_put_url(self, key, content_type, expires_in, sha256=None):
+        params = {'Bucket': self.bucket, 'Key': key, 'ContentType': content_type}
+        headers = {'Content-Type': content_type}
+        if sha256:
+            # S3 verifies the body against this checksum and rejects mismatches
+            params['ChecksumSHA256'] = sha256_hex_to_base64(sha256)
+            headers['x-amz-checksum-sha256'] = params['ChecksumSHA256']
+        url = self.client.generate_presigned_url('put_object', Params=params, ExpiresIn=expires_in)
+        return url, headers
+
+    def reset(self):
+        super().reset()
+        # boto3 clients hold connection pools that must not be shared across forks
+        self._client = None
+
+
+class LocalStorage(StorageBackend):
+    """Stores objects on the local filesystem and serves them from ``/files``.
+
+    Signed URLs carry an HMAC over method, key and expiry so the same
+    presigned upload/download flow works without S3.
+    """
+
+    name = 'local'
+    chunk_size = 1024 * 1024
+
+    def __init__(self, root, base_url='', signing_key=STORAGE_SIGNING_KEY, **kwargs):
+        super().__init__(**kwargs)
+        self.root = os.path.abspath(root)
+        self.base_url = base_url.rstrip('/')
+        self.signing_key = signing_key.encode('utf-8')
+        os.makedirs(self.root, exist_ok=True)
+
+    def path_for(self, key):
+        path = os.path.abspath(os.path.join(self.root, key))
+        if not path.startswith(self.root + os.sep):
+            raise ValueError(f"Invalid storage key: {key}")
+        return path
+
+    def save(self, key, data, content_type='application/octet-stream', sha256=None):
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temp file and rename so readers never see partial files
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.upload-')
+        try:
+            digest = hashlib.sha256()
+            with os.fdopen(fd, 'wb') as out:
+                if isinstance(data, (bytes, bytearray, memoryview)):
+                    digest.update(data)
+                    out.write(data)
+                else:
+                    while True:
+                        chunk = data.read(self.chunk_size)
+                        if not chunk:
+                            break
+                        digest.update(chunk)
+                        out.write(chunk)
+            if sha256 and digest.hexdigest() != sha256:
+                raise ValueError('Uploaded content does not match its SHA-256 digest')
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return self.url_for(key)
+
+    def exists(self, key):
+        return os.path.isfile(self.path_for(key))
+
+    def head(self, key):
+        try:
+            size = os.stat(self.path_for(key)).st_size
+        except FileNotFoundError:
+            return None
+        # Files keep no metadata; the extension was chosen from the content type
+        ext = os.path.splitext(key)[1].lstrip('.')
+        content_type = next((type_ for type_, type_ext in CONTENT_TYPE_EXTENSIONS.items() if type_ext == ext),
+                            'application/octet-stream')
+        return {'size': size, 'contentType': content_type}
+
+    def open(self, key):
+        return open(self.path_for(key), 'rb')
+
+    def delete(self, key):
+        try:
+            os.unlink(self.path_for(key))
+        except FileNotFoundError:
+            pass
+
+    def url_for(self, key):
+        return f"{self.base_url}/files/{quote(key)}"
+
+    def key_from_url(self, url):
+        prefix = f"{self.base_url}/files/"
+        if url and url.startswith(prefix):
+            # url_for() quotes the key
+            return unquote(url[len(prefix):].split('?', 1)[0])
+        return None
+
+    def signature(self, method, key, expires):
+        message = f"{method}\n{key}\n{expires}".encode('utf-8')
+        return hmac.new(self.signing_key, message, hashlib.sha256).hexdigest()
+
+    def verify_signature(self, method, key, expires, signature):
+        try:
+            if int(expires) < time.time():
+                return False
+        except (TypeError, ValueError):
+            return False
+        return hmac.compare_digest(self.signature(method, key, expires), signature or '')
+
+    def _signed_url(self, method, key, expires_in):
+        expires = int(time.time()) + expires_in
+        query = urlencode({'expires': expires, 'signature': self.signature(method, key, expires)})
+        return f"{self.url_for(key)}?{query}"
+
+    def sign_get_url(self, key, expires_in):
+        return self._signed_url('GET', key, expires_in)
+
+    def sign_put_url(self, key, content_type, expires_in, sha256=None):
+        # Content-addressed keys are verified against their digest on receipt
+        return self._signed_url('PUT', key, expires_in), {'Content-Type': content_type}
+
+
+def create_storage(config):
+    """Build the configured storage backend.
+
+    ``STORAGE_BACKEND`` selects ``s3`` or ``local``; when unset, S3 is used if
+    credentials are configured and the local filesystem otherwise.
+    """
+    options = {
+        'presign_expires': config['S3_PRESIGN_EXPIRES'],
+        'cache_size': config['S3_PRESIGN_CACHE_SIZE'],
+    }
+    backend = config.get('STORAGE_BACKEND') or ('s3' if config['S3_ACCESS_KEY'] and config['S3_SECRET_KEY'] else 'local')
+
+    if backend == 's3':
+        return S3Storage(
+            config['S3_BUCKET'],
+            config['S3_REGION'],
+            config['S3_ACCESS_KEY'],
+            config['S3_SECRET_KEY'],
+            public_read=config.get('S3_PUBLIC_READ', False),
+            **options
+        )
+    if backend == 'local':
+        return LocalStorage(config['LOCAL_STORAGE_ROOT'], base_url=config.get('LOCAL_STORAGE_BASE_URL', ''), **options)
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
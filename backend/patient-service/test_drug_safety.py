@@ -0,0 +1,62 @@
+import os
+
+import pytest
+
+from drug_safety import AllergyChecker, compile_index, load_drug_classes, normalize
+
+DRUG_CLASSES = load_drug_classes(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'drug_classes.json'))
+
+
+@pytest.fixture
+def checker():
+    # check() only uses the compiled index; the database is for check_medication and audit
+    return AllergyChecker(None, None, None, DRUG_CLASSES)
+
+
+def test_normalize():
+    assert normalize('Amoxicillin 500mg (Trihydrate)') == 'amoxicillin 500mg trihydrate'
+    assert normalize('  Céfazolin ') == 'cefazolin'
+    assert normalize(None) == ''
+
+
+def test_class_allergy_flags_member_drug(checker):
+    warnings = checker.check('amoxicillin', ['Penicillin'])
+    assert len(warnings) == 1
+    assert warnings[0]['severity'] == 'high'
+    assert warnings[0]['drugClass'] == 'penicillins'
+
+
+def test_drug_name_with_dose_and_brand_alias(checker):
+    assert checker.check('Amoxicillin 500mg capsules', ['PCN'])[0]['severity'] == 'high'
+    assert checker.check('Augmentin', ['amoxicillin'])[0]['severity'] == 'high'
+
+
+def test_same_class_different_drug_is_moderate(checker):
+    warning, = checker.check('Ibuprofen', ['Aspirin'])
+    assert warning['severity'] == 'moderate'
+    assert warning['drugClass'] == 'nsaids'
+
+
+def test_cross_reactive_class_is_low(checker):
+    warning, = checker.check('Cephalexin', ['Penicillin'])
+    assert warning['severity'] == 'low'
+    assert warning['drugClass'] == 'cephalosporins'
+
+
+@pytest.mark.parametrize('allergies', [['NKDA'], ['No known allergies'], ['none'], [], None])
+def test_no_known_allergies(checker, allergies):
+    assert checker.check('Amoxicillin', allergies) == []
+
+
+def test_unrelated_allergy(checker):
+    assert checker.check('Lisinopril', ['Latex', 'Penicillin']) == []
+
+
+def test_warnings_worst_first(checker):
+    warnings = checker.check('Amoxicillin', ['Cephalosporins', 'Amoxicillin'])
+    assert [warning['severity'] for warning in warnings] == ['high', 'low']
+
+
+def test_unknown_alias_target():
+    with pytest.raises(ValueError, match='unknown drug or class'):
+        compile_index({'classes': {'statins': ['atorvastatin']}, 'aliases': {'lipitor': 'atorvastatn'}})
@@ -0,0 +1,66 @@
+import pytest
+
+from duplicates import WEIGHTS, _date_similarity, jaro_winkler, normalize_phone, score, soundex
+
+
+@pytest.mark.parametrize('name, code', [
+    ('Robert', 'R163'),
+    ('Rupert', 'R163'),
+    ('Ashcraft', 'A261'),  # H does not separate the S and C
+    ('Tymczak', 'T522'),
+    ('Pfister', 'P236'),
+    ('Lee', 'L000'),
+    ("O'Brien", 'O165'),
+    ('', ''),
+])
+def test_soundex(name, code):
+    assert soundex(name) == code
+
+
+@pytest.mark.parametrize('a, b, expected', [
+    ('MARTHA', 'MARHTA', 0.9611),
+    ('DWAYNE', 'DUANE', 0.84),
+    ('DIXON', 'DICKSONX', 0.8133),
+])
+def test_jaro_winkler(a, b, expected):
+    assert jaro_winkler(a, b) == pytest.approx(expected, abs=1e-4)
+
+
+def test_jaro_winkler_edges():
+    assert jaro_winkler('SMITH', 'SMITH') == 1.0
+    assert jaro_winkler('', '') == 0.0
+    assert jaro_winkler('SMITH', '') == 0.0
+    assert jaro_winkler('ABC', 'XYZ') == 0.0
+
+
+@pytest.mark.parametrize('a, b, expected', [
+    ('1990-03-04', '1990-03-04', 1.0),
+    ('1990-03-04', '1990-04-03', 0.8),  # day and month swapped
+    ('1990-03-04', '1991-03-04', 0.5),
+    ('1990-03-04', '1985-11-20', 0.0),
+    ('1990-03-04', None, 0.0),
+])
+def test_date_similarity(a, b, expected):
+    assert _date_similarity(a, b) == expected
+
+
+def test_normalize_phone():
+    assert normalize_phone('+1 (555) 123-4567') == '5551234567'
+    assert normalize_phone('555-1234') == '5551234'
+    assert normalize_phone('12345') is None
+
+
+def test_score_identical_patients():
+    patient = {'firstName': 'Maria', 'lastName': 'Garcia', 'dateOfBirth': '1985-06-12',
+               'phone': '555-123-4567', 'email': 'maria@example.com', 'address': '1 Main St'}
+    value, matched = score(patient, dict(patient))
+    assert value == pytest.approx(1.0)
+    assert matched == list(WEIGHTS)
+
+
+def test_score_swapped_birth_date_and_reformatted_phone():
+    a = {'firstName': 'Maria', 'lastName': 'Garcia', 'dateOfBirth': '1985-06-12', 'phone': '(555) 123-4567'}
+    b = {'firstName': 'Maria', 'lastName': 'Garcia', 'dateOfBirth': '1985-12-06', 'phone': '+1 555 123 4567'}
+    value, matched = score(a, b)
+    assert value == pytest.approx(0.15 + 0.2 + 0.3 * 0.8 + 0.2)
+    assert matched == ['firstName', 'lastName', 'phone']
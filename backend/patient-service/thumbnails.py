@@ -0,0 +1,124 @@
+import io
+import os
+import logging
+import importlib.util
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Derivative name -> bounding box; images are scaled down, never up
+DERIVATIVE_SIZES = {
+    'thumbnail': (256, 256),
+    'preview': (1024, 1024),
+}
+DERIVATIVE_CONTENT_TYPE = 'image/jpeg'
+DERIVATIVE_QUALITY = 85
+
+PILLOW_AVAILABLE = importlib.util.find_spec('PIL') is not None
+
+
+def derivative_key(original_key, name):
+    """Derivatives live next to the original, e.g. ``<key>.thumbnail.jpg``.
+
+    Because originals are content-addressed, duplicates share derivatives too.
+    """
+    base, _ = os.path.splitext(original_key)
+    return f"{base}.{name}.jpg"
+
+
+def render_derivatives(data):
+    """Render every derivative for one image. Runs in a pool process.
+
+    Returns a dict of derivative name -> JPEG bytes.
+    """
+    from PIL import Image
+
+    results = {}
+    with Image.open(io.BytesIO(data)) as original:
+        # draft() lets the JPEG decoder downscale while decoding
+        original.draft('RGB', max(DERIVATIVE_SIZES.values()))
+        image = original.convert('RGB')
+    for name, size in DERIVATIVE_SIZES.items():
+        derivative = image.copy()
+        derivative.thumbnail(size, Image.LANCZOS)
+        out = io.BytesIO()
+        derivative.save(out, 'JPEG', quality=DERIVATIVE_QUALITY, optimize=True)
+        results[name] = out.getvalue()
+    return results
+
+
+class DerivativePipeline:
+    """Generates derivatives in a process pool so resizing large scans never
+    runs on a request thread.
+
+    ``submit`` is fire-and-forget: the rendered bytes are handed to
+    ``on_rendered(image_id, original_key, derivatives)`` on a small I/O
+    thread pool, which stores them and updates the database.
+    """
+
+    def __init__(self, max_workers=None, io_workers=2):
+        self.max_workers = max_workers or max(1, (os.cpu_count() or 2) // 2)
+        self.io_workers = io_workers
+        self._processes = None
+        self._io = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return PILLOW_AVAILABLE
+
+    def _executors(self):
+        with self._lock:
+            if self._processes is None:
+                # spawn keeps pool processes free of the parent's DB connections and threads
+                self._processes = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context('spawn'))
+                self._io = ThreadPoolExecutor(self.io_workers, thread_name_prefix='derivatives')
+            return self._processes, self._io
+
+    def submit(self, image_id, original_key, load_original, on_rendered):
+        """Queue derivative generation for one image.
+
+        ``load_original`` returns the original bytes; it runs on the I/O pool so
+        presigned uploads (whose bytes never reached us) can be read back.
+        """
+        if not self.enabled:
+            return None
+        processes, io_pool = self._executors()
+
+        def load_and_render():
+            data = load_original()
+            return processes.submit(render_derivatives, data).result()
+
+        def done(future):
+            try:
+                on_rendered(image_id, original_key, future.result())
+            except Exception:
+                logger.exception('Derivative generation failed for image %s', image_id)
+
+        future = io_pool.submit(load_and_render)
+        future.add_done_callback(done)
+        return future
+
+    def render_many(self, originals):
+        """Render a batch in parallel. ``originals`` is a list of bytes; the
+        result list has a dict of derivatives or None (failure) per item."""
+        processes, _ = self._executors()
+        futures = [processes.submit(render_derivatives, data) for data in originals]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                logger.warning('Derivative generation failed: %s', e)
+                results.append(None)
+        return results
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._processes is not None:
+                self._io.shutdown(wait=wait)
+                self._processes.shutdown(wait=wait)
+                self._processes = None
+                self._io = None
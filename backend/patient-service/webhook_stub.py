@@ -0,0 +1,85 @@
+"""Local webhook receiver for trying out outbox delivery.
+
+    python webhook_stub.py --port 9100 --fail-rate 0.3 --secret s3cret
+    WEBHOOK_DESTINATIONS='{"billing": {"url": "http://localhost:9100/billing", "secret": "s3cret"}}' \\
+        flask --app app outbox-dispatch
+
+Every POSTed batch is printed. GET / returns what was received per path:
+the event ids in arrival order and how many arrived more than once.
+"""
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from outbox import sign
+
+
+def make_handler(options):
+    lock = threading.Lock()
+    received = {}  # path -> event ids in arrival order
+    calls = {'count': 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            with lock:
+                calls['count'] += 1
+                call = calls['count']
+            if options.delay:
+                time.sleep(options.delay)
+
+            if options.secret and self.headers.get('X-HMS-Signature') != sign(options.secret, body):
+                return self._reply(401, {'message': 'Bad signature'})
+            if call <= options.fail_first or random.random() < options.fail_rate:
+                print(f'{self.path}: failing request {call} with {options.status}', flush=True)
+                return self._reply(options.status, {'message': 'Simulated failure'})
+
+            events = json.loads(body)['events']
+            with lock:
+                received.setdefault(self.path, []).extend(event['id'] for event in events)
+            print(f"{self.path}: {len(events)} events, {events[0]['id']}..{events[-1]['id']} "
+                  f"({', '.join(sorted({event['type'] for event in events}))})", flush=True)
+            self._reply(200, {'received': len(events)})
+
+        def do_GET(self):
+            with lock:
+                summary = {path: {'events': ids, 'duplicates': len(ids) - len(set(ids))} for path, ids in received.items()}
+            self._reply(200, summary)
+
+        def _reply(self, status, data):
+            body = json.dumps(data).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=9100)
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='Share of requests answered with --status')
+    parser.add_argument('--fail-first', type=int, default=0, help='Fail this many requests first')
+    parser.add_argument('--status', type=int, default=503, help='Status code of simulated failures')
+    parser.add_argument('--delay', type=float, default=0.0, help='Seconds to wait before answering')
+    parser.add_argument('--secret', help='Reject requests without a valid X-HMS-Signature')
+    options = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', options.port), make_handler(options))
+    print(f'Webhook stub listening on http://127.0.0.1:{options.port}', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,16 @@
 import os
 from app import app as flask_app
-import swagger_api
 
 # Determine which app to run based on environment variable
 if os.environ.get('USE_SWAGGER', 'false').lower() == 'true':
+    # flask_restx is only imported when the Swagger UI is enabled
+    import swagger_api
     app = swagger_api.flask_app
 else:
     app = flask_app
-    
-# Initialize database on Heroku
-if os.environ.get('FLASK_ENV') == 'production':
-    # Ensure the database tables exist
-    with flask_app.app_context():
-        from app import db
-        db.create_all()
+
+# The schema is created and upgraded by migrations (`flask db upgrade`), not
+# on import; the gunicorn master checks its revision (see gunicorn.conf.py)
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 8080))
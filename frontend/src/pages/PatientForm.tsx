@@ -68,7 +68,7 @@ const PatientForm = () => {
         });
         
         if (data.profileImageUrl) {
-          setPreviewImage(data.profileImageUrl);
+          setPreviewImage(data.profileImageViewUrl || data.profileImageUrl);
         }
         
         setError(null);
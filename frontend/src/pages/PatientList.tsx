@@ -165,7 +165,7 @@ const PatientList = () => {
                     {patient?.profileImageUrl ? (
                       <div className="patient-avatar mb-3">
                         <img 
-                          src={patient.profileImageUrl} 
+                          src={patient.profileImageViewUrl || patient.profileImageUrl} 
                           alt={`${patient?.firstName || ''} ${patient?.lastName || ''}`}
                           className="rounded-circle"
                           width="50"
@@ -12,6 +12,7 @@ export interface Patient {
   allergies?: string[];
   notes?: string;
   profileImageUrl?: string;
+  profileImageViewUrl?: string; // Signed URL for displaying the profile image
   profileImage?: string; // Base64 encoded image data for upload
   createdBy?: string;
 }